@@ -11,6 +11,9 @@ from app.main.controller.shipment_controller import api as shipment_ns
 from app.main.controller.position_controller import api as position_ns
 from app.main.services import db, flask_bcrypt
 from app.main.celery import init_celery
+from app.main.util.profiler import profiler
+from app.main.util import metrics
+from app.main.util.sqldiagnostics import sql_diagnostics
 
 
 def create_app(**kwargs):
@@ -23,6 +26,9 @@ def create_app(**kwargs):
     flask_bcrypt.init_app(app)
     if(kwargs.get("celery")):
       init_celery(kwargs.get("celery"), app)
+    profiler.init_app(app)
+    metrics.init_app(app)
+    sql_diagnostics.init_app(app)
 
     blueprint = Blueprint('api', __name__)
     api = Api(blueprint,
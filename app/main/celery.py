@@ -20,27 +20,80 @@ def init_celery(celery, app):
 
     celery.Task = ContextTask
 
+#outbound gossip, checks of new companies and signed callbacks run on their own queues,
+#so a slow partner cannot hold the validations back; the rest goes to the default queue
+DEFAULT_QUEUE = 'celery'
+TASK_ROUTES = {
+    'app.main.util.tasks.send_shipment': {'queue': 'gossip'},
+    'app.main.util.tasks.send_shipment_batch': {'queue': 'gossip'},
+    'app.main.util.tasks.sync_with_peer': {'queue': 'gossip'},
+    'app.main.util.tasks.validate_new_company': {'queue': 'verification'},
+    'app.main.util.tasks.validate_remote_location': {'queue': 'signing'},
+    'app.main.util.tasks.send_validations': {'queue': 'signing'}
+}
+DEFAULT_QUEUE_CONCURRENCY = {'gossip': 4, 'verification': 1, 'signing': 2, DEFAULT_QUEUE: 1}
+
+def queue_concurrency(queues):
+    """ the worker processes for the given queues, as configured in CELERY_QUEUE_CONCURRENCY """
+    config = config_by_name[os.getenv('EONFLASK_ENV') or 'dev']
+    concurrency = getattr(config, 'CELERY_QUEUE_CONCURRENCY', DEFAULT_QUEUE_CONCURRENCY)
+    return sum(concurrency.get(queue, 1) for queue in queues)
+
 def make_celery(app_name=__name__):
     """ create the celery app loading parameters from the config file and the env variable """
 
     config = config_by_name[os.getenv('EONFLASK_ENV') or 'dev']
-    broker = config.CELERY_BROKER_URL
-    backend = config.CELERY_RESULT_BACKEND if config.CELERY_RESULT_BACKEND else broker
+    #every task ignores its result, no result backend is needed
     celery = Celery(
         app_name,
-        broker=broker,
-        backend=backend
+        broker=config.CELERY_BROKER_URL
     )
-    celery.conf.result_expires = 600
+    celery.conf.task_default_queue = DEFAULT_QUEUE
+    celery.conf.task_routes = TASK_ROUTES
+    celery.conf.beat_schedule = {
+        'prune-blacklist': {
+            'task': 'app.main.util.tasks.prune_blacklist',
+            'schedule': getattr(config, 'BLACKLIST_PRUNE_INTERVAL', 3600)
+        },
+        'sync-peers': {
+            'task': 'app.main.util.tasks.sync_with_all_peers',
+            'schedule': getattr(config, 'SYNC_INTERVAL', 900)
+        },
+        'dispatch-outbox': {
+            'task': 'app.main.util.tasks.dispatch_outbox',
+            'schedule': getattr(config, 'OUTBOX_DISPATCH_INTERVAL', 1)
+        },
+        'prune-outbox': {
+            'task': 'app.main.util.tasks.prune_outbox',
+            'schedule': 3600
+        }
+    }
     return celery
 
 
 celery = make_celery()
 
-def setup_worker(celery, app):
+def setup_worker(celery, app, queues=None, concurrency=None, beat=None):
+    """
+    start a worker consuming the given queues, all of them by default
+
+    the concurrency defaults to the sum of the configured concurrency of the queues,
+    run one worker per queue to give each queue its own processes. Only one worker
+    must run the beat scheduler, by default the one consuming the default queue,
+    and that worker loads the shared blacklist index at startup
+    """
     cel = make_celery()
+    queues = queues or sorted(set(route['queue'] for route in TASK_ROUTES.values()) | {DEFAULT_QUEUE})
+    beat = DEFAULT_QUEUE in queues if beat is None else beat
+    if beat:
+        #the shared blacklist index is loaded before the first pruning comes
+        from app.main.model.blacklist import BlacklistToken
+        with app.app_context():
+            BlacklistToken.load_index()
     worker = cel.Worker(
-        concurrency=1,
+        queues=queues,
+        concurrency=concurrency or queue_concurrency(queues),
+        beat=beat,
         loglevel='info',
         autoreload=True)
     worker.start()
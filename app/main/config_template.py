@@ -5,6 +5,63 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 class Config:
     DEBUG = False
     SECRET_KEY = os.getenv('SECRET_KEY', 'my_precious_secret_key')
+    # outbound gossip: timeouts in seconds, connections kept per peer, peers kept warm, retries with backoff
+    GOSSIP_CONNECT_TIMEOUT = 3.05
+    GOSSIP_READ_TIMEOUT = 10
+    GOSSIP_POOL_MAXSIZE = 10
+    GOSSIP_MAX_PEERS = 64
+    GOSSIP_MAX_RETRIES = 3
+    GOSSIP_BACKOFF_FACTOR = 0.3
+    # concurrent fan-out: calls in flight per peer and overall, seconds before a broadcast gives up
+    GOSSIP_PER_PEER_CONCURRENCY = 4
+    GOSSIP_MAX_CONCURRENCY = 32
+    GOSSIP_BROADCAST_DEADLINE = 30
+    # shared index of the blacklisted tokens, defaults to the celery broker; seconds between prunings
+    BLACKLIST_REDIS_URL = None
+    BLACKLIST_REDIS_PREFIX = 'eonpeers:blacklist'
+    BLACKLIST_PRUNE_INTERVAL = 3600
+    # seconds a process trusts a verified token before reading its user again
+    TOKEN_CACHE_MAX_AGE = 30
+    # seconds between two anti-entropy reconciliations with every peer
+    SYNC_INTERVAL = 900
+    # outbox of the outbound tasks: seconds between two dispatches, messages published per batch, seconds kept once dispatched
+    OUTBOX_DISPATCH_INTERVAL = 1
+    OUTBOX_BATCH_SIZE = 100
+    OUTBOX_RETENTION = 86400
+    # failed publications of a message before the dispatcher parks it, seconds a parked message is kept
+    # (python manage.py outbox_parked lists them, requeue_outbox gives them to the dispatcher again)
+    OUTBOX_MAX_ATTEMPTS = 5
+    OUTBOX_PARKED_RETENTION = 604800
+    # shipments to the same peer are sent together: seconds the first one may wait, shipments per request
+    SHIPMENT_BATCH_WINDOW = 2
+    SHIPMENT_BATCH_SIZE = 50
+    # seconds before a peer without the batch import is asked again
+    SHIPMENT_BATCH_UNSUPPORTED_TTL = 3600
+    # per-request profiling: Server-Timing header on every response and totals per endpoint at /profiling
+    PROFILING = False
+    # /metrics, not authenticated: keep it off or reachable by the scraper only; directory where the web and
+    # celery processes share their values (None: only the answering process), seconds between two dumps
+    METRICS_ENABLED = False
+    METRICS_DIR = None
+    METRICS_FLUSH_INTERVAL = 5
+    # diagnostics on the db engine: log the queries slower than SLOW_QUERY_THRESHOLD seconds and the
+    # statements run more than NPLUSONE_THRESHOLD times by a single request or task
+    SQL_DIAGNOSTICS = False
+    SLOW_QUERY_THRESHOLD = 0.1
+    NPLUSONE_THRESHOLD = 10
+    # celery worker processes per queue, see TASK_ROUTES in celery.py
+    CELERY_QUEUE_CONCURRENCY = {'gossip': 4, 'verification': 1, 'signing': 2, 'celery': 1}
+    # seconds a process trusts its company directory before reloading it, and between reloads on a miss;
+    # the processes bump the redis key on every company change and check it every VERSION_CHECK seconds
+    COMPANY_DIRECTORY_TTL = 60
+    COMPANY_DIRECTORY_MISS_RELOAD = 1
+    COMPANY_DIRECTORY_VERSION_KEY = 'eonpeers:companies:version'
+    COMPANY_DIRECTORY_VERSION_CHECK = 1
+    # bcrypt: cost of a hash, threads doing the work, requests allowed to wait before answering 503
+    BCRYPT_LOG_ROUNDS = 12
+    PASSWORD_HASH_WORKERS = 2
+    PASSWORD_HASH_QUEUE_DEPTH = 8
+    PASSWORD_HASH_TIMEOUT = 10
 
 class DevelopmentConfig(Config):
     KMI_TYPE = 'DEV'
@@ -12,7 +69,6 @@ class DevelopmentConfig(Config):
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'eonpeers_dev.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     CELERY_BROKER_URL = 'redis://localhost:6379'
-    CELERY_RESULT_BACKEND = 'redis://localhost:6379'
     EONPASS_URL = ''
     EONPASS_USER = ''
     EONPASS_PWD = ''
@@ -23,11 +79,11 @@ class TestingConfig(Config):
     KMI_TYPE = 'DEV'
     DEBUG = True
     TESTING = True
+    BCRYPT_LOG_ROUNDS = 4
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'eonpeers_test.db')
     PRESERVE_CONTEXT_ON_EXCEPTION = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     CELERY_BROKER_URL = 'redis://localhost:6379'
-    CELERY_RESULT_BACKEND = 'redis://localhost:6379'
     EONPASS_URL = ''
     EONPASS_USER = ''
     EONPASS_PWD = ''
@@ -38,13 +94,13 @@ class TestingConfig(Config):
 class ProductionConfig(Config):
     KMI_TYPE = 'PYKMIP'
     DEBUG = False
+    BCRYPT_LOG_ROUNDS = 13
     # uncomment the line below to use postgres
     # postgres_local_base = os.environ['DATABASE_URL']
     # SQLALCHEMY_DATABASE_URI = postgres_local_base
     PRESERVE_CONTEXT_ON_EXCEPTION = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     CELERY_BROKER_URL = 'redis://localhost:6379'
-    CELERY_RESULT_BACKEND = 'redis://localhost:6379'
     EONPASS_URL = ''
     EONPASS_USER = ''
     EONPASS_PWD = ''
@@ -20,6 +20,7 @@ class UserLogin(Resource):
     """
     @api.doc('user login')
     @api.expect(user_auth, validate=True)
+    @api.response(503, 'Too many logins in progress, retry later.')
     @validate_json("email", "password")
     def post(self):
         # get the post data
@@ -1,10 +1,11 @@
 from flask import request
-from flask_restplus import Resource
+from flask_restplus import Resource, inputs
 
-from app.main.service.company_service import (get_a_company, get_all_companies, save_new_company, get_node_owner, get_locations_of_a_company)
+from app.main.service.company_service import (get_a_company, get_companies_page, save_new_company, get_node_owner, get_locations_of_a_company, start_sync_with_company)
 from app.main.util.dto import CompanyDto, LocationDto
 from app.main.util.decorator import admin_token_required, token_required
 from app.main.util.eonerror import EonError
+from app.main.util.pagination import next_cursor_headers
 
 api = CompanyDto.api
 _company = CompanyDto.company
@@ -15,16 +16,26 @@ _location = LocationDto.location
 parser = api.parser()
 parser.add_argument('Authorization', location='headers', help="Auth token from login")
 
+list_parser = api.parser()
+list_parser.add_argument('cursor', type=int, location='args', help="X-Next-Cursor header of the previous page")
+list_parser.add_argument('limit', type=int, location='args', help="Page size")
+list_parser.add_argument('vat_number', location='args', help="Only the company with this vat")
+list_parser.add_argument('date_from', type=inputs.datetime_from_iso8601, location='args', help="Created on or after (ISO 8601)")
+list_parser.add_argument('date_to', type=inputs.datetime_from_iso8601, location='args', help="Created on or before (ISO 8601)")
+
 @api.route('/')
 class CompanyList(Resource):
     @api.doc('List of companies registere on this node')
+    @api.expect(list_parser)
     @api.marshal_with(_company, as_list=True)
     @api.response(400, 'Malformed URL.')
     @api.response(500, 'Internal Server Error.')
     def get(self):
-        """Returns companies, known by this node, in a list"""
+        """Returns a page of companies, known by this node, the next page cursor is in the X-Next-Cursor header"""
+        args = list_parser.parse_args()
         try:
-            return get_all_companies()
+            companies, next_cursor = get_companies_page(**args)
+            return companies, 200, next_cursor_headers(next_cursor)
         except Exception as e:
                 api.abort(500)
 
@@ -82,6 +93,26 @@ class LocationsOfCompany(Resource):
                 api.abort(500)
 
 
+@api.route('/<public_id>/rpc/sync')
+@api.param('public_id', 'The company identifier')
+class SyncWithCompany(Resource):
+    @api.doc('reconcile the shipments shared with the company node')
+    @api.expect(parser)
+    @api.response(202, 'Sync started.')
+    @api.response(400, 'The company has no node.')
+    @api.response(404, 'Company not found.')
+    @api.response(500, 'Internal Server Error.')
+    def put(self, public_id):
+        """Pull the shipments shared with the company that are missing or different on this node"""
+        try:
+            return start_sync_with_company(public_id)
+        except EonError as e:
+            if(e.code and e.message):
+                api.abort(e.code, e.message)
+            else:
+                api.abort(500)
+
+
 @api.route('/node-owner')
 class NodeOwnerCompany(Resource):
     @api.doc('get the company owning this node')
@@ -1,29 +1,46 @@
-from flask import request
-from flask_restplus import Resource
+from flask import request, Response, stream_with_context
+from flask_restplus import Resource, inputs
 
-from app.main.service.position_service import (get_a_position, get_all_positions, save_new_position, sign_a_position)
+from app.main.service.position_service import (get_a_position, export_positions, get_positions_page, save_new_position, sign_a_position, sign_positions)
 from app.main.util.dto import PositionDto
 from app.main.util.decorator import admin_token_required, token_required
 from app.main.util.eonerror import EonError
+from app.main.util.pagination import next_cursor_headers, ndjson_lines
 
 api = PositionDto.api
 _position = PositionDto.position
 _new_position = PositionDto.new_position
 _position_to_sign = PositionDto.position_to_sign
+_positions_to_sign = PositionDto.positions_to_sign
 
 parser = api.parser()
 parser.add_argument('Authorization', location='headers', help="Auth token from login")
 
+list_parser = api.parser()
+list_parser.add_argument('cursor', type=int, location='args', help="X-Next-Cursor header of the previous page")
+list_parser.add_argument('limit', type=int, location='args', help="Page size")
+list_parser.add_argument('company_id', location='args', help="Only positions held by this company")
+list_parser.add_argument('shipment_id', location='args', help="Only positions of this shipment")
+list_parser.add_argument('date_from', type=inputs.datetime_from_iso8601, location='args', help="Created on or after (ISO 8601)")
+list_parser.add_argument('date_to', type=inputs.datetime_from_iso8601, location='args', help="Created on or before (ISO 8601)")
+
+export_parser = list_parser.copy()
+export_parser.remove_argument('limit')
+export_parser.replace_argument('cursor', type=int, location='args', help="cursor of the last line received, to resume an export")
+
 @api.route('/')
 class PositionList(Resource):
     @api.doc('List of positions registered on this node')
+    @api.expect(list_parser)
     @api.marshal_with(_position, as_list=True)
     @api.response(400, 'Malformed URL.')
     @api.response(500, 'Internal Server Error.')
     def get(self):
-        """Returns positions, known by this node, in a list"""
+        """Returns a page of positions, known by this node, the next page cursor is in the X-Next-Cursor header"""
+        args = list_parser.parse_args()
         try:
-            return get_all_positions()
+            positions, next_cursor = get_positions_page(**args)
+            return positions, 200, next_cursor_headers(next_cursor)
         except Exception as e:
             api.abort(500)
 
@@ -46,6 +63,37 @@ class PositionList(Resource):
                 api.abort(500)
 
 
+@api.route('/rpc/sign-batch')
+class PositionConfirmBatch(Resource):
+    @api.doc('Sign many existing positions')
+    @api.expect(parser, _positions_to_sign, validate=True)
+    @api.response(201, 'Positions successfully signed.')
+    @api.response(400, 'Positions of other companies.')
+    @api.response(404, 'Unknown positions.')
+    @api.response(500, 'Internal Server Error.')
+    def put(self):
+        """Sign many existing positions in a single transaction - Node Admin only"""
+        try:
+            data = request.json
+            return sign_positions(data['public_ids'])
+        except EonError as e:
+            if(e.code and e.message):
+                api.abort(e.code, e.message)
+            else:
+                api.abort(500)
+
+
+@api.route('/rpc/export')
+class PositionExport(Resource):
+    @api.doc('Stream all the positions registered on this node')
+    @api.expect(export_parser)
+    @api.response(200, 'Newline-delimited JSON, one object per line with its resume cursor.')
+    @api.response(400, 'Malformed URL.')
+    def get(self):
+        """Export the positions, known by this node, as a NDJSON stream"""
+        args = export_parser.parse_args()
+        return Response(stream_with_context(ndjson_lines(export_positions(**args), _position)), mimetype='application/x-ndjson')
+
 @api.route('/<public_id>')
 @api.param('public_id', 'The position identifier')
 class Position(Resource):
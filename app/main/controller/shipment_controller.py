@@ -1,30 +1,54 @@
-from flask import request
-from flask_restplus import Resource
+from flask import request, Response, stream_with_context
+from flask_restplus import Resource, inputs
 
-from app.main.service.shipment_service import (get_a_shipment, get_all_shipments, save_new_shipment, get_positions_of_a_shipment, send_shipment_to_next_peer, receive_shipment_from_previous_peer)
+from app.main.service.shipment_service import (get_a_shipment, export_shipments, get_shipments_page, save_new_shipment, get_positions_of_a_shipment, send_shipment_to_next_peer, receive_shipment_from_previous_peer, receive_shipments_batch, get_position_proof, get_shipment_state, apply_shipment_delta)
 from app.main.util.dto import ShipmentDto, PositionDto
 from app.main.util.decorator import admin_token_required, token_required
+from app.main.service.sync_service import (get_sync_summary, get_sync_bucket, get_sync_payloads)
 from app.main.util.eonerror import EonError
+from app.main.util.pagination import next_cursor_headers, ndjson_lines
 
 api = ShipmentDto.api
 _shipment = ShipmentDto.shipment
 _new_shipment = ShipmentDto.new_shipment
 _position = PositionDto.position
 _import_shipment = ShipmentDto.import_shipment
+_import_shipment_batch = ShipmentDto.import_shipment_batch
+_position_proof = ShipmentDto.position_proof
+_sync_payloads_request = ShipmentDto.sync_payloads_request
+_shipment_delta = ShipmentDto.shipment_delta
 
 parser = api.parser()
 parser.add_argument('Authorization', location='headers', help="Auth token from login")
 
+list_parser = api.parser()
+list_parser.add_argument('cursor', type=int, location='args', help="X-Next-Cursor header of the previous page")
+list_parser.add_argument('limit', type=int, location='args', help="Page size")
+list_parser.add_argument('company_id', location='args', help="Only shipments held by this company")
+list_parser.add_argument('date_from', type=inputs.datetime_from_iso8601, location='args', help="Created on or after (ISO 8601)")
+list_parser.add_argument('date_to', type=inputs.datetime_from_iso8601, location='args', help="Created on or before (ISO 8601)")
+list_parser.add_argument('hs_code', location='args', help="Only shipments with this hs_code")
+
+sync_parser = api.parser()
+sync_parser.add_argument('vat', required=True, location='args', help="vat of the requesting peer")
+
+export_parser = list_parser.copy()
+export_parser.remove_argument('limit')
+export_parser.replace_argument('cursor', type=int, location='args', help="cursor of the last line received, to resume an export")
+
 @api.route('/')
 class ShipmentList(Resource):
     @api.doc('List of shipments registered on this node')
+    @api.expect(list_parser)
     @api.marshal_with(_shipment, as_list=True)
     @api.response(400, 'Malformed URL.')
     @api.response(500, 'Internal Server Error.')
     def get(self):
-        """Returns shipments, known by this node, in a list"""
+        """Returns a page of shipments, known by this node, the next page cursor is in the X-Next-Cursor header"""
+        args = list_parser.parse_args()
         try:
-            return get_all_shipments()
+            shipments, next_cursor = get_shipments_page(**args)
+            return shipments, 200, next_cursor_headers(next_cursor)
         except Exception as e:
             api.abort(500)
 
@@ -66,6 +90,120 @@ class ShipmentImport(Resource):
             else:
                 api.abort(500)
 
+@api.route('/rpc/state/<hash_id>')
+@api.param('hash_id', 'The shipment hash in the network')
+class ShipmentState(Resource):
+    @api.doc('state of a shipment known by this node')
+    @api.response(404, 'Unknown shipment.')
+    def get(self, hash_id):
+        """Get the merkle root and the position hashes of a shipment, so a peer can send only a delta"""
+        try:
+            return get_shipment_state(hash_id)
+        except EonError as e:
+            if(e.code and e.message):
+                api.abort(e.code, e.message)
+            else:
+                api.abort(500)
+
+@api.route('/rpc/update')
+class ShipmentUpdate(Resource):
+    @api.doc('Update a shipment already imported from a peer')
+    @api.expect(_shipment_delta, validate=True)
+    @api.response(200, 'Shipment successfully updated.')
+    @api.response(400, 'Shipment input data, signatures or holder change are invalid.')
+    @api.response(404, 'Unknown shipment.')
+    @api.response(409, 'Conflicting positions.')
+    @api.response(500, 'Internal Server Error.')
+    def put(self):
+        """Apply the positions new or newly signed since the last state of the shipment on this node"""
+        data = request.json
+        try:
+            return apply_shipment_delta(data)
+        except EonError as e:
+            if(e.code and e.message):
+                api.abort(e.code, e.message)
+            else:
+                api.abort(500)
+
+@api.route('/rpc/import-batch')
+class ShipmentImportBatch(Resource):
+    @api.doc('Import many shipments from a peer in a single transaction')
+    @api.expect(parser, _import_shipment_batch, validate=True)
+    @api.response(201, 'Shipments successfully created.')
+    @api.response(400, 'Shipment input data is invalid.')
+    @api.response(409, 'Shipment already exists.')
+    @api.response(500, 'Internal Server Error.')
+    def post(self):
+        """Import many new Shipments from a peer"""
+        data = request.json
+        try:
+            return receive_shipments_batch(data=data)
+        except EonError as e:
+            if(e.code and e.message):
+                api.abort(e.code, e.message)
+            else:
+                api.abort(500)
+
+@api.route('/rpc/export')
+class ShipmentExport(Resource):
+    @api.doc('Stream all the shipments registered on this node')
+    @api.expect(export_parser)
+    @api.response(200, 'Newline-delimited JSON, one object per line with its resume cursor.')
+    @api.response(400, 'Malformed URL.')
+    def get(self):
+        """Export the shipments, known by this node, as a NDJSON stream"""
+        args = export_parser.parse_args()
+        return Response(stream_with_context(ndjson_lines(export_shipments(**args), _shipment)), mimetype='application/x-ndjson')
+
+@api.route('/rpc/sync/summary')
+class SyncSummary(Resource):
+    @api.doc('digests of the buckets of shipments shared with a peer')
+    @api.expect(sync_parser)
+    @api.response(400, 'Unknown company.')
+    def get(self):
+        """Anti-entropy: summary of the shipments shared with the requesting peer"""
+        args = sync_parser.parse_args()
+        try:
+            return get_sync_summary(args['vat'])
+        except EonError as e:
+            if(e.code and e.message):
+                api.abort(e.code, e.message)
+            else:
+                api.abort(500)
+
+@api.route('/rpc/sync/bucket/<prefix>')
+@api.param('prefix', 'The first two hex chars of the shipment hash_ids')
+class SyncBucket(Resource):
+    @api.doc('entries of a bucket of shipments shared with a peer')
+    @api.expect(sync_parser)
+    @api.response(400, 'Unknown company or malformed prefix.')
+    def get(self, prefix):
+        """Anti-entropy: digest of each shipment of a bucket shared with the requesting peer"""
+        args = sync_parser.parse_args()
+        try:
+            return get_sync_bucket(args['vat'], prefix)
+        except EonError as e:
+            if(e.code and e.message):
+                api.abort(e.code, e.message)
+            else:
+                api.abort(500)
+
+@api.route('/rpc/sync/payloads')
+class SyncPayloads(Resource):
+    @api.doc('payloads of the shipments missing on a peer')
+    @api.expect(_sync_payloads_request, validate=True)
+    @api.response(400, 'Unknown company or too many shipments requested.')
+    def post(self):
+        """Anti-entropy: full payloads of the requested shipments shared with the requesting peer"""
+        data = request.json
+        try:
+            return get_sync_payloads(data['vat'], data['hash_ids'])
+        except EonError as e:
+            if(e.code and e.message):
+                api.abort(e.code, e.message)
+            else:
+                api.abort(500)
+
 @api.route('/<public_id>')
 @api.param('public_id', 'The shipment identifier')
 class Shipment(Resource):
@@ -100,6 +238,24 @@ class PositionsOfShipment(Resource):
             else:
                 api.abort(500)
 
+@api.route('/<public_id>/positions/<position_id>/proof')
+@api.param('public_id', 'The shipment identifier')
+@api.param('position_id', 'The position identifier')
+class PositionProofOfShipment(Resource):
+    @api.doc('get the merkle inclusion proof of a position')
+    @api.marshal_with(_position_proof)
+    @api.response(404, 'Shipment or position not found.')
+    @api.response(500, 'Internal Server Error.')
+    def get(self, public_id, position_id):
+        """Get the merkle root of the shipment and the inclusion proof of one of its positions"""
+        try:
+            return get_position_proof(public_id, position_id)
+        except EonError as e:
+            if(e.code and e.message):
+                api.abort(e.code, e.message)
+            else:
+                api.abort(500)
+
 @api.route('/<public_id>/rpc/send')
 @api.param('public_id', 'The shipment identifier')
 class SendShipment(Resource):
@@ -1,7 +1,7 @@
 from flask import request
 from flask_restplus import Resource
 
-from app.main.service.validation_service import (get_a_validation, sign_a_validation, create_new_validation, receive_a_validation)
+from app.main.service.validation_service import (get_a_validation, sign_a_validation, create_new_validation, receive_a_validation, sign_validations)
 from app.main.util.dto import ValidationDto
 from app.main.util.decorator import admin_token_required, token_required
 from app.main.util.eonerror import EonError
@@ -11,6 +11,7 @@ _validation = ValidationDto.validation
 _new_validation_request = ValidationDto.new_validation_request
 _new_validation = ValidationDto.new_validation
 _validation_to_sign = ValidationDto.validation_to_sign
+_validations_to_sign = ValidationDto.validations_to_sign
 
 parser = api.parser()
 parser.add_argument('Authorization', location='headers', help="Auth token from login")
@@ -51,6 +52,24 @@ class ValidationList(Resource):
                 api.abort(500)
 
 
+@api.route('/rpc/sign-batch')
+class ValidationConfirmBatch(Resource):
+    @api.doc('Sign many existing validations')
+    @api.expect(parser, _validations_to_sign, validate=True)
+    @api.response(201, 'Validations successfully signed.')
+    @api.response(404, 'Validation not found.')
+    @api.response(500, 'Internal Server Error.')
+    def put(self):
+        """Sign many existing validations in a single transaction - Node Admin only"""
+        try:
+            data = request.json
+            return sign_validations(data['public_ids'])
+        except EonError as e:
+            if(e.code and e.message):
+                api.abort(e.code, e.message)
+            else:
+                api.abort(500)
+
 @api.route('/<public_id>')
 @api.param('public_id', 'The validation identifier')
 class Validation(Resource):
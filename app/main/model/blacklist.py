@@ -1,6 +1,10 @@
 import datetime
 
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
 from app.main.services import db
+from app.main.util.blacklistindex import blacklist_index
 
 
 class BlacklistToken(db.Model):
@@ -11,20 +15,88 @@ class BlacklistToken(db.Model):
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     token = db.Column(db.String(500), unique=True, nullable=False)
+    token_hash = db.Column(db.String(64), unique=True, index=True)
     blacklisted_on = db.Column(db.DateTime, nullable=False)
+    expires_on = db.Column(db.DateTime, nullable=True, index=True)
 
-    def __init__(self, token):
+    def __init__(self, token, expires_on=None):
         self.token = token
+        self.token_hash = blacklist_index.hash_token(token)
         self.blacklisted_on = datetime.datetime.now()
+        self.expires_on = expires_on
 
     def __repr__(self):
         return '<id: token: {}'.format(self.token)
 
     @staticmethod
     def check_blacklist(auth_token):
-        # check whether auth token has been blacklisted
+        # check whether auth token has been blacklisted, the shared index answers
+        # without touching the db unless it is not loaded or not reachable
+        token_hash = blacklist_index.hash_token(auth_token)
+        indexed = blacklist_index.contains(token_hash)
+        if indexed is not None:
+            return indexed
         res = BlacklistToken.query.filter_by(token=str(auth_token)).first()
         if res:
             return True
         else:
             return False
+
+    @staticmethod
+    def prune_expired():
+        """
+        Delete the tokens which are expired anyway, then reload the shared index
+
+        tokens stored without expiration are dropped two days after the blacklisting,
+        well after the end of their lifetime
+        """
+        now = datetime.datetime.utcnow()
+        BlacklistToken.query.filter(db.or_(
+            BlacklistToken.expires_on < now,
+            db.and_(BlacklistToken.expires_on == None, BlacklistToken.blacklisted_on < now - datetime.timedelta(days=2))
+        )).delete(synchronize_session=False)
+        db.session.commit()
+        BlacklistToken.load_index()
+
+    @staticmethod
+    def load_index():
+        """ (re)load the shared index with every token still blacklisted, at the worker startup and after a pruning """
+        blacklist_index.load(db.session.query(BlacklistToken.token_hash, BlacklistToken.expires_on).yield_per(1000))
+
+    @staticmethod
+    def backfill_token_hashes():
+        """
+        Fill the digest of the tokens blacklisted before the column existed, then reload the index
+
+        until this runs the index is not complete and the lookups go to the db
+
+        Returns
+        -------
+        int
+            the number of tokens filled
+        """
+        tokens = BlacklistToken.query.filter(BlacklistToken.token_hash == None).all()
+        for token in tokens:
+            token.token_hash = blacklist_index.hash_token(token.token)
+        db.session.commit()
+        BlacklistToken.load_index()
+        return len(tokens)
+
+
+@event.listens_for(BlacklistToken, 'after_insert')
+def stage_blacklisted_token(mapper, connection, target):
+    """ the token is indexed once committed, a rolled back logout must not be seen by the other workers """
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('blacklisted_tokens', []).append((target.token_hash, target.expires_on))
+
+
+@event.listens_for(db.session, 'after_commit')
+def index_blacklisted_tokens(session):
+    for token_hash, expires_on in session.info.pop('blacklisted_tokens', []):
+        blacklist_index.add(token_hash, expires_on)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def drop_blacklisted_tokens(session):
+    session.info.pop('blacklisted_tokens', None)
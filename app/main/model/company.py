@@ -1,7 +1,12 @@
 import datetime
 
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
 from app.main.config import key
 from app.main.services import db, flask_bcrypt
+from app.main.util.keymanagementclientfactory import public_key_cache, public_key_fingerprint
+from app.main.util.companydirectory import company_directory
 
 
 class Company(db.Model):
@@ -17,10 +22,48 @@ class Company(db.Model):
     base_url = db.Column(db.String(50))
     eori_number = db.Column(db.String(255), unique=True, nullable=True)
     aeo_status = db.Column(db.String(255), unique=False, nullable=True)
-    public_key = db.Column(db.String(100))
+    public_key = db.Column(db.Text)
+    #SHA256 of the DER key, see public_key_fingerprint: keys are looked up by this column, never by PEM
+    public_key_fingerprint = db.Column(db.String(64), index=True)
 
     
     def __repr__(self):
         return "<Company '{}', vat '{}'>".format(self.name, self.vat_number)
 
-    
\ No newline at end of file
+
+@event.listens_for(Company.public_key, 'set', active_history=True)
+def invalidate_replaced_public_key(target, value, oldvalue, initiator):
+    """ a company changed its key: the loaded copy of the old one must not be used anymore """
+    if isinstance(oldvalue, (str, bytes)) and oldvalue != value:
+        public_key_cache.invalidate(oldvalue)
+    target.public_key_fingerprint = public_key_fingerprint(value)
+
+
+@event.listens_for(Company, 'after_delete')
+def invalidate_deleted_public_key(mapper, connection, target):
+    if target.public_key:
+        public_key_cache.invalidate(target.public_key)
+
+
+@event.listens_for(Company, 'after_insert')
+@event.listens_for(Company, 'after_update')
+@event.listens_for(Company, 'after_delete')
+def invalidate_company_directory(mapper, connection, target):
+    """ the flushed change is seen at once by this session, and by everyone once the transaction ends """
+    company_directory.invalidate()
+    session = object_session(target)
+    if session is not None:
+        session.info['company_directory_dirty'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def publish_company_directory(session):
+    if session.info.pop('company_directory_dirty', False):
+        company_directory.invalidate()
+        company_directory.bump_version()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def reload_company_directory(session):
+    if session.info.pop('company_directory_dirty', False):
+        company_directory.invalidate()
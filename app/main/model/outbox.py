@@ -0,0 +1,54 @@
+import datetime
+import json
+
+from app.main.services import db
+
+
+class OutboxMessage(db.Model):
+    """
+    Outbox Model for the tasks to be published once the change producing them is committed
+
+    rows are added to the same session, and so the same transaction, as the business
+    change; the dispatcher publishes them to the broker and marks them dispatched.
+    attempts counts the failed publications, the rows reaching OUTBOX_MAX_ATTEMPTS
+    stay undispatched but are skipped by the dispatcher (parked)
+    """
+    __tablename__ = "outbox_message"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    task = db.Column(db.String(255), nullable=False)
+    args = db.Column(db.Text, nullable=False)
+    created_on = db.Column(db.DateTime, nullable=False)
+    dispatched_on = db.Column(db.DateTime, nullable=True, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+
+    def __init__(self, task, args):
+        self.task = task
+        self.args = json.dumps(list(args))
+        self.created_on = datetime.datetime.utcnow()
+        self.attempts = 0
+
+    def __repr__(self):
+        return "<OutboxMessage '{}', task '{}'>".format(self.id, self.task)
+
+    @property
+    def task_args(self):
+        return json.loads(self.args)
+
+    @staticmethod
+    def prune_dispatched(before):
+        """ delete the messages dispatched before the given datetime """
+        OutboxMessage.query.filter(OutboxMessage.dispatched_on < before).delete(synchronize_session=False)
+        db.session.commit()
+
+    @staticmethod
+    def parked(max_attempts):
+        """ the query of the messages parked after max_attempts failed publications """
+        return OutboxMessage.query.filter(OutboxMessage.dispatched_on == None, OutboxMessage.attempts >= max_attempts)
+
+    @staticmethod
+    def prune_parked(max_attempts, before):
+        """ delete the parked messages created before the given datetime, returns how many """
+        pruned = OutboxMessage.parked(max_attempts).filter(OutboxMessage.created_on < before).delete(synchronize_session=False)
+        db.session.commit()
+        return pruned
@@ -1,7 +1,10 @@
 import datetime
 
+from sqlalchemy import event
+
 from app.main.config import key
 from app.main.services import db, flask_bcrypt
+from app.main.model.shipment import Shipment
 
 
 class Position(db.Model):
@@ -14,13 +17,37 @@ class Position(db.Model):
     signed_hash = db.Column(db.String(255))
     created_on = db.Column(db.DateTime, nullable=False)
     company_id = db.Column(db.String(100), db.ForeignKey('company.public_id'), nullable=False)
-    shipment_id = db.Column(db.String(100), db.ForeignKey('shipment.public_id'), nullable=False)
+    shipment_id = db.Column(db.String(100), db.ForeignKey('shipment.public_id'), nullable=False, index=True)
     position = db.Column(db.Integer, unique=False, nullable=False)
     role = db.Column(db.Integer, unique=False, nullable=False)
+    company = db.relationship('Company')
+    shipment = db.relationship('Shipment', back_populates='positions')
     __table_args__ = (db.UniqueConstraint('company_id', 'shipment_id', 'position', name='_company_shipment_position_uc'),)
 
     def __repr__(self):
         return "<Shipment '{}', company '{}', position '{}'>".format(self.shipment_id, self.company_id, self.position)
 
-    
 
+@event.listens_for(db.session, 'before_flush')
+def bump_shipment_version(session, flush_context, instances):
+    """
+    Increase the version of every shipment changed by this flush
+
+    a shipment changes when its own fields change or when one of its positions
+    is added, updated (e.g. signed) or deleted; new shipments keep the default version
+    """
+    shipments = set()
+    shipment_ids = set()
+    for obj in session.dirty:
+        if isinstance(obj, Shipment) and session.is_modified(obj):
+            shipments.add(obj)
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Position) and (obj in session.new or obj in session.deleted or session.is_modified(obj)):
+            shipment_ids.add(obj.shipment_id)
+    shipment_ids -= set(obj.public_id for obj in session.new if isinstance(obj, Shipment))
+    shipment_ids -= set(shipment.public_id for shipment in shipments)
+    if shipment_ids:
+        with session.no_autoflush:
+            shipments.update(session.query(Shipment).filter(Shipment.public_id.in_(shipment_ids)).all())
+    for shipment in shipments:
+        shipment.version = (shipment.version or 0) + 1
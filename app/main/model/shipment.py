@@ -16,12 +16,16 @@ class Shipment(db.Model):
     shipment_date = db.Column(db.DateTime, nullable=True)
     origin = db.Column(db.String(255), unique=False, nullable=False)
     destination = db.Column(db.String(255), unique=False, nullable=False)
-    hs_code = db.Column(db.String(255), unique=False, nullable=True)
+    hs_code = db.Column(db.String(255), unique=False, nullable=True, index=True)
     description = db.Column(db.String(255), unique=False, nullable=True)
     serials_hash = db.Column(db.String(255), unique=False, nullable=True)
-    current_company_id = db.Column(db.String(100), db.ForeignKey('company.public_id'))
+    current_company_id = db.Column(db.String(100), db.ForeignKey('company.public_id'), index=True)
     waybill_number = db.Column(db.String(255), unique=False, nullable=True)
     custom_reference_number = db.Column(db.String(255), unique=False, nullable=True)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    merkle_root = db.Column(db.String(64), nullable=True)
+    current_company = db.relationship('Company')
+    positions = db.relationship('Position', back_populates='shipment', order_by='Position.position')
 
     
     def __repr__(self):
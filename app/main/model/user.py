@@ -1,10 +1,13 @@
 import datetime
 
 import jwt
+from sqlalchemy import event
 
 from app.main.config import key
 from app.main.model.blacklist import BlacklistToken
 from app.main.services import db, flask_bcrypt
+from app.main.util.passwordhasher import password_hasher
+from app.main.util.tokencache import token_cache
 
 
 class User(db.Model):
@@ -25,11 +28,10 @@ class User(db.Model):
 
     @password.setter
     def password(self, password):
-        self.password_hash = flask_bcrypt.generate_password_hash(
-            password).decode('utf-8')
+        self.password_hash = password_hasher.generate(password)
 
     def check_password(self, password):
-        return flask_bcrypt.check_password_hash(self.password_hash, password)
+        return password_hasher.check(self.password_hash, password)
 
     def __repr__(self):
         return "<User '{}'>".format(self.username)
@@ -61,14 +63,33 @@ class User(db.Model):
         :param auth_token:
         :return: integer|string
         """
+        payload = User.decode_auth_payload(auth_token)
+        if isinstance(payload, str):
+            return payload
+        return payload['sub']
+
+    @staticmethod
+    def decode_auth_payload(auth_token):
+        """
+        Decodes the auth token and checks it is not blacklisted
+        :param auth_token:
+        :return: dict (the claims, with 'sub' and 'exp')|string
+        """
         try:
             payload = jwt.decode(auth_token, key)
             is_blacklisted_token = BlacklistToken.check_blacklist(auth_token)
             if is_blacklisted_token:
                 return 'Token blacklisted. Please log in again.'
             else:
-                return payload['sub']
+                return payload
         except jwt.ExpiredSignatureError:
             return 'Signature expired. Please log in again.'
         except jwt.InvalidTokenError:
             return 'Invalid token. Please log in again.'
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def evict_cached_tokens(mapper, connection, target):
+    """ the cached tokens carry the user data (e.g. the admin flag), drop them when the user changes """
+    token_cache.evict_user(target.id)
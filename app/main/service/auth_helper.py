@@ -1,5 +1,10 @@
+from flask import current_app
+
+from app.main.model.blacklist import BlacklistToken
 from app.main.model.user import User
 from app.main.service.blacklist_service import save_token
+from app.main.util.eonerror import EonError
+from app.main.util.tokencache import token_cache
 
 
 class Auth:
@@ -25,6 +30,12 @@ class Auth:
                 }
                 return response_object, 401
 
+        except EonError as e:
+            response_object = {
+                'status': 'fail',
+                'message': e.message
+            }
+            return response_object, e.code
         except Exception as e:
             print(e)
             response_object = {
@@ -42,7 +53,8 @@ class Auth:
         if auth_token:
             resp = User.decode_auth_token(auth_token)
             if not isinstance(resp, str):
-                # mark the token as blacklisted
+                # mark the token as blacklisted and forget it was verified
+                token_cache.evict(auth_token)
                 return save_token(token=auth_token)
             else:
                 response_object = {
@@ -62,17 +74,35 @@ class Auth:
         # get the auth token
         auth_token = new_request.headers.get('Authorization')
         if auth_token:
-            resp = User.decode_auth_token(auth_token)
+            # tokens already verified by this process skip the decode and the db
+            cached_data = token_cache.get(auth_token)
+            if cached_data:
+                # the logouts handled by the other processes are only in the blacklist
+                if BlacklistToken.check_blacklist(auth_token):
+                    token_cache.evict(auth_token)
+                    response_object = {
+                        'status': 'fail',
+                        'message': 'Token blacklisted. Please log in again.'
+                    }
+                    return response_object, 401
+                response_object = {
+                    'status': 'success',
+                    'data': dict(cached_data)
+                }
+                return response_object, 200
+            resp = User.decode_auth_payload(auth_token)
             if not isinstance(resp, str):
-                user = User.query.filter_by(id=resp).first()
+                user = User.query.filter_by(id=resp['sub']).first()
+                data = {
+                    'user_id': user.id,
+                    'email': user.email,
+                    'admin': user.admin,
+                    'registered_on': str(user.registered_on)
+                }
+                token_cache.put(auth_token, resp['exp'], data, current_app.config['TOKEN_CACHE_MAX_AGE'])
                 response_object = {
                     'status': 'success',
-                    'data': {
-                        'user_id': user.id,
-                        'email': user.email,
-                        'admin': user.admin,
-                        'registered_on': str(user.registered_on)
-                    }
+                    'data': dict(data)
                 }
                 return response_object, 200
             response_object = {
@@ -1,9 +1,16 @@
+import datetime
+
+import jwt
+
 from app.main.model.blacklist import BlacklistToken
 from app.main.services import db
 
 
 def save_token(token):
-    blacklist_token = BlacklistToken(token=token)
+    # keep the expiration of the token, so the entry can be pruned once it is useless
+    claims = jwt.decode(token, verify=False)
+    expires_on = datetime.datetime.utcfromtimestamp(claims['exp']) if claims.get('exp') else None
+    blacklist_token = BlacklistToken(token=token, expires_on=expires_on)
     try:
         # insert the token
         db.session.add(blacklist_token)
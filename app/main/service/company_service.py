@@ -4,9 +4,12 @@ import uuid
 from app.main.model.company import Company
 from app.main.model.location import Location
 from app.main.services import db
-from app.main.util.tasks import validate_new_company
+from app.main.util.tasks import validate_new_company, sync_with_peer
+from app.main.service.outbox_service import enqueue
 from app.main.util.eonerror import EonError
+from app.main.util.companydirectory import company_directory
 from app.main.util.keymanagementutils import KeyManagementClient
+from app.main.util.pagination import keyset_page
 
 
 def save_new_company(data):
@@ -22,22 +25,63 @@ def save_new_company(data):
             base_url=data['base_url'],
             public_key=data.get('public_key', None)
         )
-        save_changes(new_company) 
 
-        #GET data from the new base_url and check if it matches
+        #GET data from the new base_url and check if it matches, once the company is stored
         if(data['base_url']):
             base_url = data['base_url'] if data['base_url'][-1]=='/' else data['base_url']+'/'
-            _task = validate_new_company.delay(base_url+'company/node-owner', new_company.public_id)
+            enqueue(validate_new_company, base_url+'company/node-owner', new_company.public_id)
             #validate_new_company(base_url+'company/node-owner', new_company.public_id)
+        save_changes(new_company) 
 
         return generate_creation_ok_message(new_company)
     else:
        raise EonError('Another company already exists with the given data.', 409)
 
 
+def start_sync_with_company(public_id):
+    """
+    Queue the anti-entropy reconciliation with the node of the given company
+
+    Raises
+    ------
+    EonError
+        404, unknown company
+        400, the company has no node
+    """
+    company = Company.query.filter_by(public_id=public_id).first()
+    if not company:
+        raise EonError('Company not found.', 404)
+    if company.is_own or not company.base_url:
+        raise EonError('The company has no peer node to sync with.', 400)
+    _task = sync_with_peer.delay(company.public_id)
+    response_object = {
+        'status': 'success',
+        'message': 'Sync with the company node started.',
+        'public_id': company.public_id
+    }
+    return response_object, 202
+
 def get_all_companies():
     return Company.query.filter_by(is_own=False).all()
 
+def get_companies_page(cursor=None, limit=None, vat_number=None, date_from=None, date_to=None):
+    """
+    get a page of the companies known by this node (except the owner), ordered by id
+
+    Returns
+    -------
+    tuple
+        (companies, next_cursor)
+    """
+    query = Company.query.filter_by(is_own=False)
+    if vat_number:
+        query = query.filter(Company.vat_number == vat_number)
+    if date_from:
+        query = query.filter(Company.created_on >= date_from)
+    if date_to:
+        query = query.filter(Company.created_on <= date_to)
+    return keyset_page(query, Company.id, cursor, limit)
+
 def get_node_owner():
     """ 
     Gets the details of the company owning the node, 
@@ -46,10 +90,9 @@ def get_node_owner():
     Notice that the key is retrieved via KMC, so it's returned in bytes and thus decoded.
 
     """
-    owner = Company.query.filter_by(is_own=True).first()
+    owner = company_directory.own()
     kmc = KeyManagementClient()
-    owner.public_key = kmc.get_serialized_pub_key().decode('utf-8')
-    return owner
+    return owner._replace(public_key=kmc.get_serialized_pub_key().decode('utf-8'))
 
 def get_a_company(public_id):
     return Company.query.filter_by(public_id=public_id).first()
@@ -2,10 +2,10 @@ import datetime
 import uuid
 
 from app.main.model.location import Location
-from app.main.model.company import Company
 from app.main.services import db
 from app.main.util.tasks import make_gossip_call
 from app.main.util.eonerror import EonError
+from app.main.util.companydirectory import company_directory
 from app.main.util.keymanagementutils import KeyManagementClient
 from app.main.util.hashutils import HashUtils
 
@@ -17,7 +17,7 @@ def save_new_location(data):
     location = Location.query.filter_by(company_id=data['company_id'], name=data['name']).first()
     if not location:
         #get the key of the connected company, if "is_own", call the keymanagement system:
-        connected_company = Company.query.filter_by(public_id=data['company_id']).first()
+        connected_company = company_directory.by_public_id(data['company_id'])
         if not connected_company:
             raise EonError('Unknown company, craete the company first.', 400)
 
@@ -77,7 +77,7 @@ def save_new_external_location(data):
     """
     location = Location.query.filter_by(company_id=data['company_id'], location_key=data['location_key']).first()
     if not location:
-        connected_company = Company.query.filter_by(public_id=data['company_id']).first()
+        connected_company = company_directory.by_public_id(data['company_id'])
         if not connected_company:
             raise EonError('Unknown company, craete the company first.', 400)
 
@@ -0,0 +1,187 @@
+import datetime
+import logging
+
+from flask import current_app
+from kombu.exceptions import OperationalError
+from sqlalchemy import func
+
+from app.main.celery import celery
+from app.main.model.outbox import OutboxMessage
+from app.main.services import db
+from app.main.util.tasks import send_shipment, send_shipment_batch
+
+
+logger = logging.getLogger('eonpeers.outbox')
+
+def enqueue(task, *args):
+    """
+    Add a task to the outbox of the current transaction, instead of calling task.delay
+
+    nothing is committed here: the message is written by the same commit as the
+    business change, so either both are stored or none, and it is published later
+    by dispatch_outbox
+
+    Parameters
+    ----------
+    task: celery task
+        the task to be run, e.g. send_shipment
+    args: list
+        its arguments, must be JSON serialisable
+
+    Returns
+    -------
+    OutboxMessage
+        the pending message
+    """
+    message = OutboxMessage(task.name, args)
+    db.session.add(message)
+    return message
+
+def _coalesce(messages, now, window, max_size):
+    """
+    group the send_shipment messages by destination
+
+    Returns
+    -------
+    list
+        (task name, args, messages) to be published, a send_shipment_batch for each group
+        of at most max_size shipments, or the single send_shipment of a group of one
+    list
+        the messages held back, their group is neither full nor older than window seconds
+    """
+    groups = {}
+    for message in messages:
+        groups.setdefault(message.task_args[1], []).append(message)
+    publish = []
+    held = []
+    for next_company_id, group in groups.items():
+        if len(group) < max_size and group[0].created_on > now - datetime.timedelta(seconds=window):
+            held.extend(group)
+            continue
+        for start in range(0, len(group), max_size):
+            chunk = group[start:start + max_size]
+            if len(chunk) == 1:
+                publish.append((chunk[0].task, chunk[0].task_args, chunk))
+            else:
+                publish.append((send_shipment_batch.name, [[message.task_args[0] for message in chunk], next_company_id], chunk))
+    return publish, held
+
+def dispatch_outbox(batch_size=None):
+    """
+    Publish the pending messages of the outbox to the broker, in batches
+
+    each batch is published on a single broker connection and marked dispatched
+    with a single commit. Delivery is at least once: if the commit fails after the
+    publish, the batch is published again by the next run. When the broker cannot
+    be reached the dispatch stops, to be retried by the next run, without blaming
+    the messages; a message failing to be published on its own has its attempts
+    increased and is parked (kept, but not published anymore) once they reach
+    OUTBOX_MAX_ATTEMPTS.
+
+    Shipments to the same destination are coalesced in one send_shipment_batch:
+    they are held until SHIPMENT_BATCH_SIZE of them are pending or the oldest one
+    waited SHIPMENT_BATCH_WINDOW seconds.
+
+    Parameters
+    ----------
+    batch_size: int
+        messages per batch, OUTBOX_BATCH_SIZE by default
+
+    Returns
+    -------
+    int
+        the number of messages published
+    """
+    batch_size = batch_size or current_app.config.get('OUTBOX_BATCH_SIZE', 100)
+    window = current_app.config.get('SHIPMENT_BATCH_WINDOW', 2)
+    max_size = current_app.config.get('SHIPMENT_BATCH_SIZE', 50)
+    max_attempts = current_app.config.get('OUTBOX_MAX_ATTEMPTS', 5)
+    published = 0
+    last_id = 0
+    while True:
+        messages = OutboxMessage.query.filter(OutboxMessage.dispatched_on == None, OutboxMessage.id > last_id,
+                OutboxMessage.attempts < max_attempts) \
+            .order_by(OutboxMessage.id).limit(batch_size).with_for_update(skip_locked=True).all()
+        if not messages:
+            break
+        last_id = messages[-1].id
+        now = datetime.datetime.utcnow()
+        shipments = [message for message in messages if message.task == send_shipment.name]
+        publish = [(message.task, message.task_args, [message]) for message in messages if message.task != send_shipment.name]
+        coalesced, _held = _coalesce(shipments, now, window, max_size)
+        publish.extend(coalesced)
+        sent = []
+        broker_down = False
+        try:
+            with celery.producer_or_acquire() as producer:
+                for task, args, group in publish:
+                    try:
+                        celery.send_task(task, args=args, producer=producer)
+                    except OperationalError:
+                        raise
+                    except Exception as e:
+                        _failed(group, max_attempts, e)
+                        continue
+                    sent.extend(group)
+        except OperationalError as e:
+            logger.warning("outbox dispatch stopped, broker not reachable: %s", e)
+            broker_down = True
+        for message in sent:
+            message.dispatched_on = now
+            published += 1
+        db.session.commit()
+        if broker_down or len(messages) < batch_size:
+            break
+    return published
+
+def _failed(messages, max_attempts, error):
+    for message in messages:
+        message.attempts += 1
+        if message.attempts >= max_attempts:
+            logger.error("outbox message %s parked after %s attempts: %s", message.id, message.attempts, error)
+        else:
+            logger.warning("outbox message %s not published: %s", message.id, error)
+
+def prune_outbox():
+    """
+    delete the messages dispatched more than OUTBOX_RETENTION seconds ago and the
+    parked ones created more than OUTBOX_PARKED_RETENTION seconds ago
+    """
+    now = datetime.datetime.utcnow()
+    retention = current_app.config.get('OUTBOX_RETENTION', 86400)
+    OutboxMessage.prune_dispatched(now - datetime.timedelta(seconds=retention))
+    parked_retention = current_app.config.get('OUTBOX_PARKED_RETENTION', 604800)
+    pruned = OutboxMessage.prune_parked(current_app.config.get('OUTBOX_MAX_ATTEMPTS', 5), now - datetime.timedelta(seconds=parked_retention))
+    if pruned:
+        logger.warning("outbox messages parked for too long deleted: %s", pruned)
+
+def parked_messages():
+    """ the messages parked by the dispatcher, oldest first """
+    return OutboxMessage.parked(current_app.config.get('OUTBOX_MAX_ATTEMPTS', 5)).order_by(OutboxMessage.id).all()
+
+def count_parked():
+    """ the number of parked messages per task, {task: count} """
+    counts = OutboxMessage.parked(current_app.config.get('OUTBOX_MAX_ATTEMPTS', 5)) \
+        .with_entities(OutboxMessage.task, func.count(OutboxMessage.id)).group_by(OutboxMessage.task).all()
+    return dict(counts)
+
+def requeue_parked(message_ids=None):
+    """
+    Give the parked messages to the dispatcher again, e.g. once the cause of the failures is fixed
+
+    Parameters
+    ----------
+    message_ids: list
+        the ids of the messages to requeue, all the parked ones by default
+
+    Returns
+    -------
+    int
+        the number of messages requeued
+    """
+    query = OutboxMessage.parked(current_app.config.get('OUTBOX_MAX_ATTEMPTS', 5))
+    if message_ids:
+        query = query.filter(OutboxMessage.id.in_(message_ids))
+    requeued = query.update({OutboxMessage.attempts: 0}, synchronize_session=False)
+    db.session.commit()
+    return requeued
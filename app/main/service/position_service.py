@@ -3,20 +3,21 @@ import uuid
 
 from sqlalchemy import desc
 
-from app.main.model.company import Company
 from app.main.model.shipment import Shipment
 from app.main.model.position import Position
 from app.main.services import db
 from app.main.util.eonerror import EonError
+from app.main.util.companydirectory import company_directory
 from app.main.util.keymanagementutils import KeyManagementClient
 from app.main.util.hashutils import HashUtils
+from app.main.util.pagination import keyset_page, keyset_batches
 
 
 def save_new_position(data):
     position = Position.query.filter_by(company_id=data['company_id'], shipment_id=data['shipment_id'], position=data['position']).first()
     if not position:
 
-        connected_company = Company.query.filter_by(public_id=data['company_id']).first()
+        connected_company = company_directory.by_public_id(data['company_id'])
         if not connected_company:
             raise EonError('Unknown company, create the company first.', 400)
 
@@ -24,9 +25,7 @@ def save_new_position(data):
         if not connected_shipment:
             raise EonError('Unknown shipment, create the company first.', 400)
 
-        payload_to_hash = str(data['position'])+data['role']+connected_company.vat_number+connected_shipment.hash_id
-        hu = HashUtils()
-        hashed_payload = hu.digest(payload_to_hash).hex()
+        hashed_payload = compute_position_hash(data['position'], data['role'], connected_company.vat_number, connected_shipment.hash_id)
         print("save_position: ", data.get("signed_hash"))
         new_position = Position(
             public_id=str(uuid.uuid4()),
@@ -44,6 +43,53 @@ def save_new_position(data):
     else:
        raise EonError('The shipment already has an entry for this position for this company.', 409)
 
+def compute_position_hash(position, role, vat_number, shipment_hash_id):
+    """
+    compute the network identifier (hash_id) of a position
+
+    the hash binds the index and role of the position to the vat of the holding company
+    and to the hash of the shipment, so every peer can recompute it from the shipment payload
+
+    Parameters
+    ----------
+    position: int
+        index of the position in handling the shipment
+    role: str
+        the role held in the position
+    vat_number: str
+        vat of the company holding the position
+    shipment_hash_id: str
+        the hash_id of the connected shipment
+
+    Returns
+    -------
+    str
+        the hex digest of the position
+    """
+    payload_to_hash = str(position)+str(role)+vat_number+shipment_hash_id
+    hu = HashUtils()
+    return hu.digest(payload_to_hash).hex()
+
+def compute_position_hashes(positions, shipment_hash_id):
+    """
+    compute the hash_id of many positions of the same shipment in one pass
+
+    Parameters
+    ----------
+    positions: list
+        tuples (position, role, vat_number)
+    shipment_hash_id: str
+        the hash_id of the connected shipment
+
+    Returns
+    -------
+    list
+        the hex digests, in the same order
+    """
+    hu = HashUtils()
+    payloads = [str(position)+str(role)+vat_number+shipment_hash_id for position, role, vat_number in positions]
+    return [digest.hex() for digest in hu.digest_many(payloads)]
+
 def import_position(data):
     #when importing a position, after saving check that the hash matches and that the signed hash is correct if any
     saved_position = save_new_position(data)
@@ -51,7 +97,7 @@ def import_position(data):
     if(data["hash_id"] and data["hash_id"]!=position.hash_id):
         raise EonError('Position hash not matching! '+data["hash_id"], 400)        
 
-    connected_company = Company.query.filter_by(public_id=data['company_id']).first()
+    connected_company = company_directory.by_public_id(data['company_id'])
     if(data.get("signed_hash") and not connected_company.is_own):
         kmc = KeyManagementClient()
         #TODO: fix encoding and decoding, the validation fails probably due to encode to utf on one side, but decode as hex on the other side
@@ -66,7 +112,7 @@ def sign_a_position(public_id):
         raise EonError('Unknown position, create the data first.', 400)
 
     #double check that you are signing a position of your own company:
-    connected_company = Company.query.filter_by(public_id=position.company_id).first()
+    connected_company = company_directory.by_public_id(position.company_id)
     if not connected_company or not connected_company.is_own:
         raise EonError('You can sign only your positions.', 400)
 
@@ -82,12 +128,167 @@ def sign_a_position(public_id):
 
     return generate_update_ok_message(position)
 
+def sign_positions(public_ids):
+    """
+    Sign many positions of the own company at once
+
+    positions and companies are loaded with one query each, the signatures run in
+    parallel on the key management pool and are persisted with a single commit
+
+    Parameters
+    ----------
+    public_ids: list
+        the local public ids of the positions to sign
+
+    Returns
+    -------
+    dict
+        the body of the response, a dict with the following keys:
+        'status',
+        'message',
+        'public_ids', the ids of the signed positions
+
+    Raises
+    ------
+    EonError
+        404, unknown positions
+        400, positions not held by the own company
+    """
+    public_ids = list(set(public_ids))
+    positions = Position.query.filter(Position.public_id.in_(public_ids)).all() if public_ids else []
+    if len(positions) != len(public_ids):
+        raise EonError('Unknown position, create the data first.', 404)
+
+    company_ids = set(position.company_id for position in positions)
+    own_company_ids = set(company.public_id for company in company_directory.by_public_ids(company_ids) if company.is_own)
+    if company_ids - own_company_ids:
+        raise EonError('You can sign only your positions.', 400)
+
+    apply_position_signatures(positions)
+    db.session.commit()
+
+    response_object = {
+        'status': 'success',
+        'message': 'Positions signed.',
+        'public_ids': [position.public_id for position in positions]
+    }
+    return response_object, 201
+
+def apply_position_signatures(positions):
+    """
+    Sign the given positions of the own company and set their signed_hash
+
+    the caller is responsible for checking the positions are held by the own
+    company and for committing, so the signatures can join a larger transaction
+
+    Parameters
+    ----------
+    positions: list
+        Position objects attached to the session
+    """
+    if not positions:
+        return
+    hu = HashUtils()
+    kmc = KeyManagementClient()
+    signed_positions = kmc.sign_many([hu.digest(position.hash_id) for position in positions])
+    for position, signed_position in zip(positions, signed_positions):
+        position.signed_hash = signed_position['signed'].hex()
+    db.session.add_all(positions)
+
+def verify_position_signatures(signed_positions):
+    """
+    Check the signatures of positions received from a peer, all at once
+
+    a position is signed by its company over the digest of its hash_id (see
+    apply_position_signatures); the signatures are checked in parallel against the
+    public key of each company, the key of the node for the own company
+
+    Parameters
+    ----------
+    signed_positions: list
+        tuples (hash_id, signed_hash, company), signed_hash as a hex string,
+        company as returned by the company_directory
+
+    Raises
+    ------
+    EonError
+        400, when a company has no known public key or a signature does not check out
+    """
+    if not signed_positions:
+        return
+    hu = HashUtils()
+    kmc = KeyManagementClient()
+    items = []
+    for hash_id, signed_hash, company in signed_positions:
+        public_key = kmc.get_serialized_pub_key().decode('utf-8') if company.is_own else company.public_key
+        if not public_key:
+            raise EonError('Unknown public key of the signer company: '+company.vat_number, 400)
+        try:
+            signature = bytes.fromhex(signed_hash)
+        except ValueError:
+            raise EonError('Position signature corrupted! '+hash_id, 400)
+        items.append((signature, hu.digest(hash_id), public_key))
+    for (hash_id, _signed_hash, _company), verified in zip(signed_positions, kmc.verify_many(items)):
+        if not verified:
+            raise EonError('Position signature corrupted! '+hash_id, 400)
+
 def get_a_position(public_id):
     return Position.query.filter_by(public_id=public_id).first()
 
 def get_all_positions():
     return Position.query.filter_by().all()
 
+def get_positions_page(cursor=None, limit=None, company_id=None, shipment_id=None, date_from=None, date_to=None):
+    """
+    get a page of the positions known by this node, ordered by id
+
+    Parameters
+    ----------
+    cursor: int
+        the next_cursor of the previous page, None for the first one
+    limit: int
+        page size, capped by the pagination utility
+    company_id: str
+        only positions held by this company
+    shipment_id: str
+        only positions of this shipment
+    date_from, date_to: datetime
+        only positions created in this range (inclusive)
+
+    Returns
+    -------
+    tuple
+        (positions, next_cursor)
+    """
+    query = filter_positions(company_id, shipment_id, date_from, date_to)
+    return keyset_page(query, Position.id, cursor, limit)
+
+def export_positions(cursor=None, company_id=None, shipment_id=None, date_from=None, date_to=None):
+    """
+    iterate over all the positions matching the filters in batches, ordered by id
+
+    see get_positions_page for the filters; pass the id of the last position
+    received as cursor to resume an export
+
+    Yields
+    ------
+    list
+        a batch of positions
+    """
+    return keyset_batches(filter_positions(company_id, shipment_id, date_from, date_to), Position.id, cursor)
+
+def filter_positions(company_id=None, shipment_id=None, date_from=None, date_to=None):
+    query = Position.query
+    if company_id:
+        query = query.filter(Position.company_id == company_id)
+    if shipment_id:
+        query = query.filter(Position.shipment_id == shipment_id)
+    if date_from:
+        query = query.filter(Position.created_on >= date_from)
+    if date_to:
+        query = query.filter(Position.created_on <= date_to)
+    return query
+
 def get_positions_of_a_shipment(shipment_id):
     return Position.query.filter_by(shipment_id=shipment_id).order_by(Position.position.desc()).all()
 
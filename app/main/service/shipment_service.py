@@ -1,22 +1,29 @@
 import datetime
 import uuid
 
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
+
 from app.main.model.shipment import Shipment
 from app.main.model.position import Position
-from app.main.model.company import Company
 from app.main.services import db
-from app.main.service.position_service import import_position, sign_a_position
+from app.main.service.position_service import import_position, apply_position_signatures, compute_position_hashes, verify_position_signatures
 from app.main.util.tasks import send_shipment
+from app.main.service.outbox_service import enqueue
 from app.main.util.eonerror import EonError
+from app.main.util.companydirectory import company_directory
 from app.main.util.keymanagementutils import KeyManagementClient
 from app.main.util.hashutils import HashUtils
+from app.main.util.payloadcache import shipment_payload_cache
+from app.main.util.pagination import keyset_page, keyset_batches
+from app.main.util.merkle import merkle_root, merkle_proof
 
 
 def save_new_shipment(data):
     shipment = Shipment.query.filter_by(name=data['name']).first()
     if not shipment:
 
-        connected_company = Company.query.filter_by(public_id=data['current_company_id']).first()
+        connected_company = company_directory.by_public_id(data['current_company_id'])
         if not connected_company:
             raise EonError('Unknown company, create the company first.', 400)
 
@@ -51,6 +58,57 @@ def save_new_shipment(data):
 def get_all_shipments():
     return Shipment.query.filter_by().all()
 
+def get_shipments_page(cursor=None, limit=None, company_id=None, date_from=None, date_to=None, hs_code=None):
+    """
+    get a page of the shipments known by this node, ordered by id
+
+    Parameters
+    ----------
+    cursor: int
+        the next_cursor of the previous page, None for the first one
+    limit: int
+        page size, capped by the pagination utility
+    company_id: str
+        only shipments currently held by this company
+    date_from, date_to: datetime
+        only shipments created in this range (inclusive)
+    hs_code: str
+        only shipments with this goods classification code
+
+    Returns
+    -------
+    tuple
+        (shipments, next_cursor)
+    """
+    query = filter_shipments(company_id, date_from, date_to, hs_code)
+    return keyset_page(query, Shipment.id, cursor, limit)
+
+def export_shipments(cursor=None, company_id=None, date_from=None, date_to=None, hs_code=None):
+    """
+    iterate over all the shipments matching the filters in batches, ordered by id
+
+    used to stream the ledger out of the node, see get_shipments_page for the filters;
+    pass the id of the last shipment received as cursor to resume an export
+
+    Yields
+    ------
+    list
+        a batch of shipments
+    """
+    return keyset_batches(filter_shipments(company_id, date_from, date_to, hs_code), Shipment.id, cursor)
+
+def filter_shipments(company_id=None, date_from=None, date_to=None, hs_code=None):
+    query = Shipment.query
+    if company_id:
+        query = query.filter(Shipment.current_company_id == company_id)
+    if date_from:
+        query = query.filter(Shipment.created_on >= date_from)
+    if date_to:
+        query = query.filter(Shipment.created_on <= date_to)
+    if hs_code:
+        query = query.filter(Shipment.hs_code == hs_code)
+    return query
+
 def get_a_shipment(public_id):
     return Shipment.query.filter_by(public_id=public_id).first()
 
@@ -64,18 +122,18 @@ def send_shipment_to_next_peer(shipment_id):
     """
     send the shipment to the next peer, which will add its info and return it back
     """
-    payloads = prepare_shipment_payload(shipment_id)
-    #pyalkods[0]: JSON payload to send, [1]: next position
-    if not payloads[1] and payloads[0]:
+    cached_payload = get_shipment_payload(shipment_id)
+    if not cached_payload['target_company'] and cached_payload['body']:
         raise EonError('Missing company or shipment, create the data first.', 400)
 
-    _task = send_shipment.delay(payloads[0], payloads[1])
+    enqueue(send_shipment, cached_payload['body'], cached_payload['target_company'])
+    db.session.commit()
 
 def receive_shipment_from_previous_peer(data):
     """
     receive a shipment payload, check for matching data and create it
     """
-    current_company = Company.query.filter_by(vat_number=data["current_company_vat"]).first()
+    current_company = company_directory.by_vat(data["current_company_vat"])
     if not current_company:
         raise EonError('Missing company, create the company first.', 400)
 
@@ -88,16 +146,31 @@ def receive_shipment_from_previous_peer(data):
         #TODO: if you have, the sender should use a different call, to update the shipment position, not to create a new one
         raise EonError('A shipment with this hash already exist.', 404)
 
-    new_shipment_result = save_new_shipment(data)[0]
-    if not new_shipment_result["public_id"]:
-        raise EonError('Error while creating the new shipment.', 500)
-
     #create the positions
     if not data["positions"] or len(data["positions"])<2:
         raise EonError('Missing or corrupt positions data.', 400)
 
+    #the root sent by the peer must commit to the positions it sent
+    root = merkle_root(payload_leaves(data["positions"]))
+    if(data.get("merkle_root") and data["merkle_root"]!=root):
+        raise EonError('Shipment merkle root not matching! '+data["merkle_root"], 400)
+
+    #the signatures are checked against the key of each company before anything is stored
+    signed_positions = []
     for position in data["positions"]:
-        position_company = Company.query.filter_by(vat_number=position["company_vat"]).first()
+        if position.get("signed_hash"):
+            position_company = company_directory.by_vat(position["company_vat"])
+            if not position_company:
+                raise EonError('Missing company, create the company first: '+position["company_vat"], 400)
+            signed_positions.append((position["hash_id"], position["signed_hash"], position_company))
+    verify_position_signatures(signed_positions)
+
+    new_shipment_result = save_new_shipment(data)[0]
+    if not new_shipment_result["public_id"]:
+        raise EonError('Error while creating the new shipment.', 500)
+
+    for position in data["positions"]:
+        position_company = company_directory.by_vat(position["company_vat"])
         if not position_company:
             print("gossip to get this company info ", position["company_vat"])
         position_payload = {
@@ -110,33 +183,348 @@ def receive_shipment_from_previous_peer(data):
         }
         saved_position = import_position(position_payload)
 
+    new_shipment = Shipment.query.filter_by(public_id=new_shipment_result["public_id"]).first()
+    new_shipment.merkle_root = root
+    save_changes(new_shipment)
+
+
+def receive_shipments_batch(data):
+    """
+    receive many shipment payloads from a peer and create them in a single transaction
+
+    every company referenced by the batch (current holders and position holders) is resolved
+    with one IN query, the same goes for the hash_ids and names already known by this node;
+    the signatures of every position of the batch are checked at once (verify_many), then
+    shipments and positions are written with a single commit, so either the whole batch
+    is imported or nothing is.
+
+    Parameters
+    ----------
+    data: dict
+        the body of the request with the following keys:
+        'shipments', a list of payloads as accepted by receive_shipment_from_previous_peer
+
+    Returns
+    -------
+    dict
+        the body of the response, a dict with the following keys:
+        'status',
+        'message',
+        'public_ids', the local public_id of each imported shipment, in the same order of the request
+
+    Raises
+    ------
+    EonError
+        400, missing companies, corrupt positions data or signatures
+        409, a shipment in the batch already exists on this node
+    """
+    shipments_data = data.get("shipments") or []
+    if not shipments_data:
+        raise EonError('Missing shipments data.', 400)
+
+    vats = set()
+    hash_ids = set()
+    names = set()
+    for shipment_data in shipments_data:
+        if not shipment_data.get("positions") or len(shipment_data["positions"])<2:
+            raise EonError('Missing or corrupt positions data.', 400)
+        if not shipment_data.get("hash_id"):
+            raise EonError('Missing shipment hash.', 400)
+        if shipment_data["hash_id"] in hash_ids or shipment_data["name"] in names:
+            raise EonError('The batch contains the same shipment twice.', 409)
+        vats.add(shipment_data["current_company_vat"])
+        vats.update(position["company_vat"] for position in shipment_data["positions"])
+        hash_ids.add(shipment_data["hash_id"])
+        names.add(shipment_data["name"])
+
+    companies_by_vat = company_directory.by_vats(vats)
+    missing_vats = vats - set(companies_by_vat)
+    if missing_vats:
+        raise EonError('Missing company, create the company first: '+', '.join(sorted(missing_vats)), 400)
+
+    existing_shipment = Shipment.query.filter(db.or_(Shipment.hash_id.in_(hash_ids), Shipment.name.in_(names))).first()
+    if existing_shipment:
+        raise EonError('A shipment with this hash already exist. '+existing_shipment.hash_id, 409)
+
+    now = datetime.datetime.utcnow()
+    new_objects = []
+    public_ids = []
+    signed_positions = []
+    for shipment_data in shipments_data:
+        new_shipment = Shipment(
+            public_id=str(uuid.uuid4()),
+            hash_id=shipment_data["hash_id"],
+            name=shipment_data['name'],
+            created_on=now,
+            shipment_date=datetime.datetime.fromisoformat(shipment_data["shipment_date"]),
+            origin=shipment_data['origin'],
+            destination=shipment_data['destination'],
+            hs_code=shipment_data.get('hs_code', None),
+            description=shipment_data.get('description', None),
+            current_company_id=companies_by_vat[shipment_data["current_company_vat"]].public_id,
+            waybill_number=shipment_data.get('waybill_number', None),
+            custom_reference_number=shipment_data.get('custom_reference_number', None)
+        )
+        new_objects.append(new_shipment)
+        public_ids.append(new_shipment.public_id)
+
+        hashed_payloads = compute_position_hashes([(position["position"], position["role"], position["company_vat"]) for position in shipment_data["positions"]], new_shipment.hash_id)
+        new_shipment.merkle_root = merkle_root(payload_leaves([dict(position, hash_id=hashed_payload) for position, hashed_payload in zip(shipment_data["positions"], hashed_payloads)]))
+        if(shipment_data.get("merkle_root") and shipment_data["merkle_root"]!=new_shipment.merkle_root):
+            raise EonError('Shipment merkle root not matching! '+shipment_data["merkle_root"], 400)
+        for position, hashed_payload in zip(shipment_data["positions"], hashed_payloads):
+            position_company = companies_by_vat[position["company_vat"]]
+            if(position.get("hash_id") and position["hash_id"]!=hashed_payload):
+                raise EonError('Position hash not matching! '+position["hash_id"], 400)
+            if position.get("signed_hash"):
+                signed_positions.append((hashed_payload, position["signed_hash"], position_company))
+            new_objects.append(Position(
+                public_id=str(uuid.uuid4()),
+                hash_id=hashed_payload,
+                signed_hash=position.get("signed_hash") or None,
+                created_on=now,
+                company_id=position_company.public_id,
+                shipment_id=new_shipment.public_id,
+                position=position["position"],
+                role=position["role"]
+            ))
+
+    verify_position_signatures(signed_positions)
+
+    try:
+        db.session.add_all(new_objects)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        raise EonError('Conflicting shipments or positions in the batch.', 409)
+
+    response_object = {
+        'status': 'success',
+        'message': 'Shipments imported.',
+        'public_ids': public_ids
+    }
+    return response_object, 201
+
+def get_shipment_payload(shipment_id):
+    """
+    get the canonical serialised payload of the shipment, building it only when the shipment changed
+
+    the payload is cached per shipment version, so resends and retries to several peers
+    cost one query and reuse the same bytes
+
+    Returns
+    -------
+    dict
+        'body', the serialised payload (str)
+        'etag', the SHA256 hex digest of the body
+        'target_company', the local id of the company holding the last position
+    """
+    version = db.session.query(Shipment.version).filter_by(public_id=shipment_id).scalar()
+    if version is None:
+        raise EonError('Missing shipment or wrong id.', 400)
+    cached_payload = shipment_payload_cache.get(shipment_id, version)
+    if cached_payload:
+        return cached_payload
+
+    payload, target_company = prepare_shipment_payload(shipment_id)
+    #signing own positions during the preparation bumps the version
+    version = db.session.query(Shipment.version).filter_by(public_id=shipment_id).scalar()
+    return shipment_payload_cache.put(shipment_id, version, payload, target_company)
+
+def apply_shipment_delta(data):
+    """
+    apply to a shipment already known by this node the positions that are new or newly signed
+
+    positions already known are matched by hash_id and only get their signature if they
+    had none; new positions are checked against their recomputed hash and added. Signatures
+    are only accepted for positions of the other companies, the own ones are signed by this
+    node only, and every signature is checked against the key of its company. The
+    resulting merkle root must match the one sent by the peer, if any. Everything is
+    written with a single commit.
+
+    Parameters
+    ----------
+    data: dict
+        'hash_id', the hash of the shipment
+        'merkle_root', optional, the root of the sender after the update
+        'current_company_vat', optional, the vat of the new holder of the shipment: the holder
+        only changes if the new one signed one of its positions, stored or in this update,
+        so a peer cannot hand over a shipment on behalf of another company
+        'positions', list of positions as in the import payload (company_vat, position, role, hash_id, signed_hash)
+
+    Returns
+    -------
+    dict
+        'status', 'message', 'public_id' of the local shipment, 'merkle_root',
+        'added' and 'signed', the number of positions added and signed
+
+    Raises
+    ------
+    EonError
+        404, unknown shipment
+        400, unknown companies, hashes, signatures or root not matching
+        409, conflicting positions
+    """
+    shipment = Shipment.query.options(selectinload(Shipment.positions)).filter_by(hash_id=data["hash_id"]).first()
+    if not shipment:
+        raise EonError('Unknown shipment, import it first.', 404)
+
+    existing = {position.hash_id: position for position in shipment.positions}
+    new_positions = [position for position in data.get("positions") or [] if position["hash_id"] not in existing]
+    vats = set(position["company_vat"] for position in new_positions)
+    if data.get("current_company_vat"):
+        vats.add(data["current_company_vat"])
+    companies_by_vat = company_directory.by_vats(vats)
+    missing_vats = vats - set(companies_by_vat)
+    if missing_vats:
+        raise EonError('Missing company, create the company first: '+', '.join(sorted(missing_vats)), 400)
+
+    #signatures of the other companies only, all of them checked before anything is changed
+    signatures = []
+    for position in data.get("positions") or []:
+        local_position = existing.get(position["hash_id"])
+        if not position.get("signed_hash") or (local_position and local_position.signed_hash):
+            continue
+        company = company_directory.by_public_id(local_position.company_id) if local_position else companies_by_vat[position["company_vat"]]
+        if not company or company.is_own:
+            raise EonError('Signatures of the own positions are not accepted from peers: '+position["hash_id"], 400)
+        signatures.append((position, local_position, company))
+    verify_position_signatures([(position["hash_id"], position["signed_hash"], company) for position, _local_position, company in signatures])
+
+    new_holder = companies_by_vat[data["current_company_vat"]] if data.get("current_company_vat") else None
+    if new_holder and new_holder.public_id != shipment.current_company_id:
+        signed_by_holder = any(position.company_id == new_holder.public_id and position.signed_hash for position in shipment.positions) \
+            or any(company.public_id == new_holder.public_id for _position, _local_position, company in signatures)
+        if not signed_by_holder:
+            raise EonError('The new holder must sign its position to take over the shipment.', 400)
+        shipment.current_company_id = new_holder.public_id
+
+    signed = 0
+    for position, local_position, _company in signatures:
+        if local_position:
+            local_position.signed_hash = position["signed_hash"]
+            signed += 1
+
+    hashed_payloads = compute_position_hashes([(position["position"], position["role"], position["company_vat"]) for position in new_positions], shipment.hash_id)
+    now = datetime.datetime.utcnow()
+    for position, hashed_payload in zip(new_positions, hashed_payloads):
+        if position["hash_id"] != hashed_payload:
+            db.session.rollback()
+            raise EonError('Position hash not matching! '+position["hash_id"], 400)
+        db.session.add(Position(
+            public_id=str(uuid.uuid4()),
+            hash_id=hashed_payload,
+            signed_hash=position.get("signed_hash") or None,
+            created_on=now,
+            company_id=companies_by_vat[position["company_vat"]].public_id,
+            shipment_id=shipment.public_id,
+            position=position["position"],
+            role=position["role"]
+        ))
+
+    leaves = [(position.position, position.hash_id) for position in shipment.positions]
+    leaves += [(position["position"], position["hash_id"]) for position in new_positions]
+    root = merkle_root([hash_id for _position, hash_id in sorted(leaves)])
+    if(data.get("merkle_root") and data["merkle_root"]!=root):
+        db.session.rollback()
+        raise EonError('Shipment merkle root not matching! '+data["merkle_root"], 400)
+    shipment.merkle_root = root
+
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        raise EonError('Conflicting positions in the update.', 409)
+
+    response_object = {
+        'status': 'success',
+        'message': 'Shipment updated.',
+        'public_id': shipment.public_id,
+        'merkle_root': root,
+        'added': len(new_positions),
+        'signed': signed
+    }
+    return response_object, 200
+
+def get_shipment_state(hash_id):
+    """
+    describe the state of a shipment on this node, so a peer can send only what is missing
+
+    Parameters
+    ----------
+    hash_id: str
+        the hash of the shipment
+
+    Returns
+    -------
+    dict
+        'hash_id', 'merkle_root' and 'positions', {position hash_id: True if signed}
+
+    Raises
+    ------
+    EonError
+        404, unknown shipment
+    """
+    shipment = Shipment.query.filter_by(hash_id=hash_id).first()
+    if not shipment:
+        raise EonError('Unknown shipment.', 404)
+    positions = db.session.query(Position.hash_id, Position.signed_hash).filter_by(shipment_id=shipment.public_id).all()
+    response_object = {
+        'hash_id': shipment.hash_id,
+        'merkle_root': shipment.merkle_root,
+        'positions': {position_hash: bool(signed_hash) for position_hash, signed_hash in positions}
+    }
+    return response_object, 200
 
 def prepare_shipment_payload(shipment_id):
     """
     prepare the payload to describe the shipment for the next party
 
+    own positions not yet signed are signed on the way
+
     In current_position there the position of the company giving currently holding the shipment
     in next_position there's the expected position of the next company, which will receive the payload
     """
-    #get the shipment and the connected positions
+    #get the shipment, its holder and the connected positions with their companies in two queries
     #in the payload company reference must be vats, shipment reference the hash of its fields
-    shipment = Shipment.query.filter_by(public_id=shipment_id).first()
+    shipment = Shipment.query.options(
+        joinedload(Shipment.current_company),
+        selectinload(Shipment.positions).joinedload(Position.company)
+    ).filter_by(public_id=shipment_id).first()
     if not shipment:
         raise EonError('Missing shipment or wrong id.', 400)
-    company = Company.query.filter_by(public_id = shipment.current_company_id).first()
+    #sign positions of the current company, if they're not already signed, in one go
+    unsigned_own = [position for position in shipment.positions if position.company.is_own and not position.signed_hash]
+    apply_position_signatures(unsigned_own)
+    payload, target_company = build_shipment_payload(shipment)
+
+    root_changed = shipment.merkle_root != payload['merkle_root']
+    if root_changed:
+        shipment.merkle_root = payload['merkle_root']
+    if unsigned_own or root_changed:
+        db.session.commit()
+    return payload, target_company
+
+def build_shipment_payload(shipment):
+    """
+    build the payload of a shipment loaded with its holder and its positions with their companies
+
+    nothing is signed nor written, the payload describes the current state
+
+    Returns
+    -------
+    tuple
+        the payload and the local id of the company holding the last position
+    """
+    company = shipment.current_company
     if not company:
         raise EonError('Missing company or wrong id.', 400)
-    positions = Position.query.filter_by(shipment_id=shipment_id).order_by(Position.position.asc()).all()
+    positions = shipment.positions
     positions_array = []
     target_company = ""
     for position in positions:
-        #sign position of the current company, if it's not already signed
-        pos_company = Company.query.filter_by(public_id = position.company_id).first()
-        if(pos_company.is_own and not position.signed_hash):
-            sign_a_position(position.public_id)
-            position = Position.query.filter_by(public_id=position.public_id).first()
         position_payload = {
-            "company_vat":pos_company.vat_number,
+            "company_vat":position.company.vat_number,
             "position":position.position,
             "role":position.role,
             "hash_id":position.hash_id,
@@ -160,10 +548,56 @@ def prepare_shipment_payload(shipment_id):
         'current_company_vat':company.vat_number,
         'waybill_number':shipment.waybill_number,
         'custom_reference_number':shipment.custom_reference_number,
+        'merkle_root': merkle_root(position_leaves(positions)),
         'positions': positions_array
     }
     return payload, target_company
 
+def position_leaves(positions):
+    """ the leaves of the shipment merkle tree: position hash_ids ordered by position index """
+    return [position.hash_id for position in sorted(positions, key=lambda position: (position.position, position.hash_id))]
+
+def payload_leaves(positions):
+    """ same as position_leaves, for the positions of a shipment payload """
+    return [position["hash_id"] for position in sorted(positions, key=lambda position: (position["position"], position["hash_id"]))]
+
+def get_position_proof(shipment_id, position_id):
+    """
+    get the merkle inclusion proof of a position of the shipment
+
+    a peer holding only the root can check the position belongs to the shipment
+    with O(log n) hashes, instead of rehashing the whole chain
+
+    Parameters
+    ----------
+    shipment_id: str
+        the local public id of the shipment
+    position_id: str
+        the local public id of the position
+
+    Returns
+    -------
+    dict
+        'merkle_root', 'hash_id' of the position and 'proof', the list of siblings
+
+    Raises
+    ------
+    EonError
+        404, unknown shipment or position not in the shipment
+    """
+    shipment = Shipment.query.options(selectinload(Shipment.positions)).filter_by(public_id=shipment_id).first()
+    if not shipment:
+        raise EonError('Missing shipment or wrong id.', 404)
+    leaves = position_leaves(shipment.positions)
+    position = next((position for position in shipment.positions if position.public_id == position_id), None)
+    if not position:
+        raise EonError('The position is not part of the shipment.', 404)
+    return {
+        'merkle_root': merkle_root(leaves),
+        'hash_id': position.hash_id,
+        'proof': merkle_proof(leaves, leaves.index(position.hash_id))
+    }
+
 def save_changes(data):
     db.session.add(data)
     db.session.commit()
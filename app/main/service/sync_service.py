@@ -0,0 +1,197 @@
+"""
+Anti-entropy between two peers
+
+each node summarises the shipments it shares with a partner (both companies hold a
+position) in 256 buckets, by the first byte of the shipment hash_id. A bucket digest
+covers hash_id, merkle root and number of signed positions of each shipment, so two
+nodes only need to compare ~16KB of digests, then the entries of the differing buckets,
+and finally transfer the payloads of the shipments missing or different locally.
+"""
+import json
+import logging
+import re
+
+from sqlalchemy import case, func
+from sqlalchemy.orm import joinedload, selectinload
+
+from app.main.model.shipment import Shipment
+from app.main.model.position import Position
+from app.main.services import db
+from app.main.service.shipment_service import build_shipment_payload, receive_shipments_batch, receive_shipment_from_previous_peer, apply_shipment_delta
+from app.main.util.tasks import make_gossip_call, peer_url, JSON_HEADERS
+from app.main.util.eonerror import EonError
+from app.main.util.companydirectory import company_directory
+from app.main.util.hashutils import HashUtils
+
+
+MAX_PAYLOADS_PER_REQUEST = 200
+
+logger = logging.getLogger('eonpeers.sync')
+
+
+def _shared_shipments_query(own_company, partner_company):
+    own_shipments = db.session.query(Position.shipment_id).filter(Position.company_id == own_company.public_id)
+    partner_shipments = db.session.query(Position.shipment_id).filter(Position.company_id == partner_company.public_id)
+    signed_positions = func.sum(case([(Position.signed_hash != '', 1)], else_=0))
+    return db.session.query(Shipment.hash_id, Shipment.merkle_root, signed_positions) \
+        .join(Position, Position.shipment_id == Shipment.public_id) \
+        .filter(Shipment.public_id.in_(own_shipments), Shipment.public_id.in_(partner_shipments)) \
+        .group_by(Shipment.id)
+
+
+def _entry_digest(hash_id, root, signed_positions):
+    return '{}:{}:{}'.format(hash_id, root or '', signed_positions or 0)
+
+
+def _companies(vat):
+    own_company = company_directory.own()
+    partner_company = company_directory.by_vat(vat)
+    if not own_company or not partner_company:
+        raise EonError('Unknown company, create the company first.', 400)
+    return own_company, partner_company
+
+
+def local_entries(own_company, partner_company, prefix=None):
+    """ the entries {hash_id: digest} of the shipments shared with the partner, optionally of one bucket """
+    query = _shared_shipments_query(own_company, partner_company)
+    if prefix:
+        query = query.filter(Shipment.hash_id.like(prefix + '%'))
+    return {hash_id: _entry_digest(hash_id, root, signed) for hash_id, root, signed in query.all()}
+
+
+def summarize(entries):
+    """ the digest of every non empty bucket of the entries """
+    buckets = {}
+    for hash_id in sorted(entries):
+        buckets.setdefault(hash_id[:2], []).append(entries[hash_id])
+    hu = HashUtils()
+    return {prefix: hu.digest('|'.join(digests)).hex() for prefix, digests in buckets.items()}
+
+
+def get_sync_summary(vat):
+    """
+    Summarise the shipments shared with the company of the given vat
+
+    Parameters
+    ----------
+    vat: str
+        the vat of the requesting peer
+
+    Returns
+    -------
+    dict
+        'buckets', {prefix: digest} of the non empty buckets
+        'count', the number of shared shipments
+    """
+    entries = local_entries(*_companies(vat))
+    return {'buckets': summarize(entries), 'count': len(entries)}
+
+
+def get_sync_bucket(vat, prefix):
+    """
+    List the entries of one bucket of the shipments shared with the company of the given vat
+
+    Returns
+    -------
+    dict
+        'entries', {hash_id: digest}
+    """
+    if not re.fullmatch('[0-9a-fA-F]{2}', prefix):
+        raise EonError('Bucket prefix must be two hex chars.', 400)
+    return {'entries': local_entries(*_companies(vat), prefix=prefix.lower())}
+
+
+def get_sync_payloads(vat, hash_ids):
+    """
+    Get the payloads of the given shipments, if they are shared with the company of the given vat
+
+    the shipments and their positions are loaded in two queries and nothing is signed
+    nor written, the peer gets the current state
+
+    Returns
+    -------
+    dict
+        'shipments', the list of payloads as sent by send_shipment
+    """
+    if len(hash_ids) > MAX_PAYLOADS_PER_REQUEST:
+        raise EonError('Too many shipments requested.', 400)
+    own_company, partner_company = _companies(vat)
+    shared = [hash_id for hash_id, _root, _signed in _shared_shipments_query(own_company, partner_company).filter(Shipment.hash_id.in_(hash_ids)).all()]
+    if not shared:
+        return {'shipments': []}
+    shipments = Shipment.query.options(
+        joinedload(Shipment.current_company),
+        selectinload(Shipment.positions).joinedload(Position.company)
+    ).filter(Shipment.hash_id.in_(shared)).order_by(Shipment.id).all()
+    return {'shipments': [build_shipment_payload(shipment)[0] for shipment in shipments]}
+
+
+def reconcile_with_peer(company_id):
+    """
+    Pull from the peer the shipments it shares with this node and are missing or different here
+
+    only differing buckets are listed and only differing shipments are transferred;
+    new shipments are imported in batch, falling back to single imports when some of
+    them cannot be imported, known ones get their new or newly signed positions
+
+    Parameters
+    ----------
+    company_id: str
+        local public id of the peer company
+
+    Returns
+    -------
+    dict
+        'imported', 'updated', 'failed': number of shipments
+    """
+    partner_company = company_directory.by_public_id(company_id)
+    own_company = company_directory.own()
+    if not partner_company or not partner_company.base_url or not own_company:
+        raise EonError('Unknown company or missing base url.', 400)
+
+    def remote(method, path, payload=None):
+        res = make_gossip_call(method, peer_url(partner_company.base_url, path), json.dumps(payload) if payload else {}, JSON_HEADERS)
+        if isinstance(res, dict) or res is None or res.status_code != 200:
+            raise EonError('Peer not reachable or sync not supported.', 502)
+        return res.json()
+
+    vat_param = '?vat=' + own_company.vat_number
+    local = local_entries(own_company, partner_company)
+    local_buckets = summarize(local)
+    remote_buckets = remote('get', 'shipment/rpc/sync/summary' + vat_param)['buckets']
+
+    wanted = []
+    for prefix, digest in remote_buckets.items():
+        if local_buckets.get(prefix) == digest:
+            continue
+        remote_entries = remote('get', 'shipment/rpc/sync/bucket/' + prefix + vat_param)['entries']
+        wanted.extend(hash_id for hash_id, entry in remote_entries.items() if local.get(hash_id) != entry)
+
+    result = {'imported': 0, 'updated': 0, 'failed': 0}
+    for start in range(0, len(wanted), MAX_PAYLOADS_PER_REQUEST):
+        chunk = wanted[start:start + MAX_PAYLOADS_PER_REQUEST]
+        payloads = remote('post', 'shipment/rpc/sync/payloads', {'vat': own_company.vat_number, 'hash_ids': chunk})['shipments']
+        new_payloads = [payload for payload in payloads if payload['hash_id'] not in local]
+        for payload in payloads:
+            if payload['hash_id'] in local:
+                try:
+                    apply_shipment_delta(payload)
+                    result['updated'] += 1
+                except EonError as e:
+                    logger.warning("sync update of %s failed: %s", payload['hash_id'], e)
+                    result['failed'] += 1
+        if not new_payloads:
+            continue
+        try:
+            receive_shipments_batch({'shipments': new_payloads})
+            result['imported'] += len(new_payloads)
+        except EonError:
+            for payload in new_payloads:
+                try:
+                    receive_shipment_from_previous_peer(payload)
+                    result['imported'] += 1
+                except EonError as e:
+                    db.session.rollback()
+                    logger.warning("sync import of %s failed: %s", payload['hash_id'], e)
+                    result['failed'] += 1
+    return result
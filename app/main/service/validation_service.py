@@ -3,11 +3,12 @@ import uuid
 
 from app.main.model.validation import Validation
 from app.main.model.location import Location
-from app.main.model.company import Company
 from app.main.services import db
 from app.main.service.location_service import save_new_external_location
-from app.main.util.tasks import validate_remote_location
+from app.main.util.tasks import validate_remote_location, send_validations
+from app.main.service.outbox_service import enqueue
 from app.main.util.eonerror import EonError
+from app.main.util.companydirectory import company_directory
 from app.main.util.keymanagementutils import KeyManagementClient
 from app.main.util.hashutils import HashUtils
 
@@ -47,7 +48,7 @@ def create_new_validation(data):
         409, the given location already exists with the same key
     """
     #escaped_key = data['company_public_key'].replace('\n','\\n')
-    requesting_company = Company.query.filter_by(public_key=data['company_public_key']).first()   
+    requesting_company = company_directory.by_public_key(data['company_public_key'])   
     if not requesting_company or not requesting_company.public_key:
         raise EonError('Unknown or incomplete company, craete the company first.', 400)
     existing_location = Location.query.filter_by(location_key=data['location_key']).first()
@@ -100,19 +101,71 @@ def sign_a_validation(public_id):
         hashed_payload = hu.digest(payload_to_sign)
         signed_validation = kmc.sign_message(hashed_payload) #hexdigest this?
         validation.signed_location_key = signed_validation['signed'].hex()
-        signer_company = Company.query.filter_by(is_own = True).first()
+        signer_company = company_directory.own()
         #TODO: check integrity, the public key of the KMC must match the public key expected by the requesting party
         validation.signer_company_id = signer_company.public_id
+        #the job that notifies the requestor is stored with the signature:
+        enqueue(validate_remote_location, location.public_id, validation.public_id)
         save_changes(validation)
         validation = Validation.query.filter_by(public_id=public_id).first()
-        #launch a job that notifies the requestor:
-        _task = validate_remote_location.delay(location.public_id, validation.public_id)
 
         return generate_signed_ok_message(validation)
     except Exception as e:
         print(e)
         raise EonError('Something is wrong with the signature system', 500) 
 
+def sign_validations(public_ids):
+    """
+    Sign many validations with the local key at once, must be protected by admin_token
+
+    validations and locations are loaded with one query each, the signatures run in
+    parallel on the key management pool and are persisted with a single commit;
+    the requesting companies are then notified concurrently by a single send_validations job
+
+    Parameters
+    ----------
+    public_ids: list
+        the ids on the local db of the validations to sign
+
+    Returns
+    -------
+    dict
+        the body of the response with 'status', 'message' and 'public_ids'
+
+    Raises
+    ------
+    EonError
+        404: when one of the validations does not exist
+        500: when the signature breaks it raises Exception
+    """
+    public_ids = list(set(public_ids))
+    validations = Validation.query.filter(Validation.public_id.in_(public_ids)).all() if public_ids else []
+    if len(validations) != len(public_ids):
+        raise EonError('Validation does not exist.', 404)
+    locations = {location.public_id: location for location in Location.query.filter(Location.public_id.in_(set(v.location_id for v in validations))).all()}
+    try:
+        hu = HashUtils()
+        kmc = KeyManagementClient()
+        signer_company = company_directory.own()
+        payloads_to_sign = [hu.digest(locations[v.location_id].name+locations[v.location_id].location_key) for v in validations]
+        for validation, signed_validation in zip(validations, kmc.sign_many(payloads_to_sign)):
+            validation.signed_location_key = signed_validation['signed'].hex()
+            validation.signer_company_id = signer_company.public_id
+        #the requestors are notified together, by a single job stored with the signatures
+        enqueue(send_validations, [validation.public_id for validation in validations])
+        db.session.add_all(validations)
+        db.session.commit()
+    except Exception as e:
+        print(e)
+        raise EonError('Something is wrong with the signature system', 500)
+
+    response_object = {
+        'status': 'success',
+        'message': 'Validations signed.',
+        'public_ids': [validation.public_id for validation in validations]
+    }
+    return response_object, 201
+
 def receive_a_validation(data):
     """
     This is the service that the signer calls once he's done with the signature
@@ -146,7 +199,7 @@ def receive_a_validation(data):
     """
     location = Location.query.filter_by(location_key=data['location_key']).first()
     signer_key = data['signer_public_key']
-    signer_company = Company.query.filter_by(public_key=signer_key).first()   
+    signer_company = company_directory.by_public_key(signer_key)   
     if not signer_company or not signer_company.public_key:
         raise EonError('Unknown or incomplete company, craete the company first.', 400)
     #TODO: check the signature
@@ -0,0 +1,169 @@
+import datetime
+import hashlib
+import logging
+import threading
+import time
+
+import redis
+from flask import current_app, has_app_context
+
+
+logger = logging.getLogger('eonpeers.blacklist')
+
+DEFAULT_TTL = 60 * 60 * 24 * 2
+
+
+class BlacklistIndex:
+    """
+    Index of the blacklisted token digests shared by every worker of the node
+
+    the digests live in redis, one key per token expiring together with the token,
+    so the index prunes itself and the lookups are O(1) on a 64 chars key instead
+    of a query on the blacklist_tokens table. A 'loaded' marker tells whether the
+    index holds the whole blacklist: when it is missing (e.g. redis was flushed)
+    or redis is down, lookups answer None and the caller falls back to the db.
+    A digest that could not be written drops the marker, so the index stops
+    answering until the next complete load instead of missing a revoked token.
+    The digests seen by this process are also kept locally, so repeated use of
+    a revoked token doesn't even reach redis.
+    """
+
+    def __init__(self, max_local=10000):
+        self._lock = threading.Lock()
+        self._local = {}
+        self._max_local = max_local
+        self._client = None
+        self._client_url = None
+
+    @staticmethod
+    def hash_token(auth_token):
+        if isinstance(auth_token, str):
+            auth_token = auth_token.encode()
+        return hashlib.sha256(auth_token).hexdigest()
+
+    def _prefix(self):
+        if has_app_context():
+            return current_app.config['BLACKLIST_REDIS_PREFIX']
+        return 'eonpeers:blacklist'
+
+    def _get_client(self):
+        if not has_app_context():
+            return None
+        url = current_app.config['BLACKLIST_REDIS_URL'] or current_app.config.get('CELERY_BROKER_URL')
+        if not url:
+            return None
+        if not self._client or self._client_url != url:
+            self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+            self._client_url = url
+        return self._client
+
+    def _remember(self, token_hash, expires_at):
+        with self._lock:
+            if len(self._local) >= self._max_local:
+                now = time.time()
+                self._local = {h: exp for h, exp in self._local.items() if exp > now}
+            if len(self._local) < self._max_local:
+                self._local[token_hash] = expires_at
+
+    def add(self, token_hash, expires_on=None):
+        """
+        Add a blacklisted token digest to the index
+
+        Parameters
+        ----------
+        token_hash: str
+            the digest of the token, see hash_token
+        expires_on: datetime
+            the expiration of the token (naive UTC), the entry disappears afterwards
+
+        Returns
+        -------
+        bool
+            False if the digest could not be written to redis
+        """
+        ttl = DEFAULT_TTL
+        if expires_on:
+            ttl = int((expires_on - datetime.datetime.utcnow()).total_seconds()) + 1
+        if ttl <= 0:
+            return True
+        self._remember(token_hash, time.time() + ttl)
+        client = self._get_client()
+        if not client:
+            return True
+        prefix = self._prefix()
+        try:
+            client.set('{}:{}'.format(prefix, token_hash), 1, ex=ttl)
+            return True
+        except redis.RedisError as e:
+            logger.warning("blacklist index not updated: %s", e)
+        #the index is not complete anymore, the readers must go to the db
+        try:
+            client.delete('{}:loaded'.format(prefix))
+        except redis.RedisError as e:
+            logger.error("blacklist index not marked as incomplete: %s", e)
+        return False
+
+    def contains(self, token_hash):
+        """
+        Check if the token digest is blacklisted
+
+        Returns
+        -------
+        bool
+            True or False when the index can answer exactly,
+            None when the db must be checked instead
+        """
+        with self._lock:
+            expires_at = self._local.get(token_hash)
+        if expires_at and expires_at > time.time():
+            return True
+        client = self._get_client()
+        if not client:
+            return None
+        try:
+            prefix = self._prefix()
+            found, loaded = client.mget('{}:{}'.format(prefix, token_hash), '{}:loaded'.format(prefix))
+        except redis.RedisError:
+            return None
+        if found:
+            self._remember(token_hash, time.time() + DEFAULT_TTL)
+            return True
+        return False if loaded else None
+
+    def load(self, entries):
+        """
+        (Re)load the whole blacklist and mark the index as complete
+
+        a token without digest (blacklisted before the digests were stored, see
+        BlacklistToken.backfill_token_hashes) leaves the index incomplete: the
+        marker is removed and the readers keep checking the db
+
+        Parameters
+        ----------
+        entries: iterable
+            (token_hash, expires_on) of every blacklisted token not yet expired
+        """
+        client = self._get_client()
+        if not client:
+            return
+        complete = True
+        missing = 0
+        for token_hash, expires_on in entries:
+            if not token_hash:
+                missing += 1
+                continue
+            complete = self.add(token_hash, expires_on) and complete
+        if missing or not complete:
+            logger.warning("blacklist index not loaded, %s tokens without digest, digests written: %s", missing, complete)
+            try:
+                client.delete('{}:loaded'.format(self._prefix()))
+            except redis.RedisError as e:
+                logger.error("blacklist index not marked as incomplete: %s", e)
+            return
+        try:
+            client.set('{}:loaded'.format(self._prefix()), 1)
+        except redis.RedisError as e:
+            logger.warning("blacklist index not loaded: %s", e)
+
+
+blacklist_index = BlacklistIndex()
@@ -0,0 +1,192 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+import redis
+from flask import current_app, has_app_context
+
+
+logger = logging.getLogger('eonpeers.companies')
+
+COMPANY_FIELDS = ('id', 'public_id', 'name', 'vat_number', 'created_on', 'is_own', 'base_url',
+    'eori_number', 'aeo_status', 'public_key', 'public_key_fingerprint')
+
+CompanyEntry = namedtuple('CompanyEntry', COMPANY_FIELDS)
+
+
+class CompanyDirectory:
+    """
+    Read-through, process-wide directory of the companies known by the node
+
+    the company set is small and rarely changes, so it is loaded whole with one query
+    and indexed by public_id, vat_number, public key fingerprint and own company.
+    Lookups are dictionary hits on read-only CompanyEntry snapshots: use the Company
+    model when the row must be changed. The directory is dropped when a company is
+    written by this process (see the listeners on the Company model), which also
+    bumps a version key in redis (the celery broker): the other workers compare it
+    with the version they loaded at most every COMPANY_DIRECTORY_VERSION_CHECK
+    seconds and reload on a change. When redis is not reachable the directory is
+    reloaded every COMPANY_DIRECTORY_TTL seconds anyway; a miss reloads it too,
+    at most every COMPANY_DIRECTORY_MISS_RELOAD seconds. A public key missing from
+    the directory is looked up in the indexed public_key_fingerprint column instead,
+    and the directory is only reloaded when a company has it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = None
+        self._loaded_at = 0
+        self._version = None
+        self._checked_at = 0
+        self._client = None
+        self._client_url = None
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+
+    @staticmethod
+    def fingerprint(public_key):
+        from app.main.util.keymanagementclientfactory import public_key_fingerprint
+        return public_key_fingerprint(public_key)
+
+    def _get_client(self):
+        url = current_app.config.get('CELERY_BROKER_URL')
+        if not url:
+            return None
+        if not self._client or self._client_url != url:
+            self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+            self._client_url = url
+        return self._client
+
+    def _version_key(self):
+        return current_app.config['COMPANY_DIRECTORY_VERSION_KEY']
+
+    def _read_version(self):
+        client = self._get_client()
+        if not client:
+            return None
+        try:
+            return client.get(self._version_key())
+        except redis.RedisError:
+            return None
+
+    def bump_version(self):
+        """ tell the other processes that the companies changed, called once the change is committed """
+        if not has_app_context():
+            return
+        client = self._get_client()
+        if not client:
+            return
+        try:
+            client.incr(self._version_key())
+        except redis.RedisError as e:
+            logger.warning("company directory version not bumped, the other workers reload on their TTL: %s", e)
+
+    def _load(self):
+        from app.main.model.company import Company
+        #read before the rows: a change committed during the load bumps it again
+        version = self._read_version()
+        indexes = {'public_id': {}, 'vat_number': {}, 'public_key': {}, 'own': None}
+        for company in Company.query.all():
+            entry = CompanyEntry(*[getattr(company, field) for field in COMPANY_FIELDS])
+            indexes['public_id'][entry.public_id] = entry
+            indexes['vat_number'][entry.vat_number] = entry
+            if entry.public_key:
+                indexes['public_key'][entry.public_key_fingerprint or self.fingerprint(entry.public_key)] = entry
+            if entry.is_own:
+                indexes['own'] = entry
+        with self._lock:
+            self._indexes = indexes
+            self._loaded_at = self._checked_at = time.time()
+            self._version = version
+            self.loads += 1
+        return indexes
+
+    def _get_indexes(self):
+        now = time.time()
+        with self._lock:
+            indexes = self._indexes
+            fresh = now - self._loaded_at < current_app.config['COMPANY_DIRECTORY_TTL']
+            check = now - self._checked_at >= current_app.config['COMPANY_DIRECTORY_VERSION_CHECK']
+            if check:
+                self._checked_at = now
+        if indexes is None or not fresh:
+            return self._load()
+        if check and self._read_version() != self._version:
+            return self._load()
+        return indexes
+
+    @staticmethod
+    def _stored_fingerprint(fingerprint):
+        from app.main.model.company import Company
+        return Company.query.with_entities(Company.id).filter_by(public_key_fingerprint=fingerprint).first() is not None
+
+    def _lookup(self, index, key, stored=None):
+        if key is None:
+            return None
+        entry = self._get_indexes()[index].get(key)
+        if entry is None and stored is not None:
+            #one indexed query tells whether a reload would find it
+            if stored(key):
+                entry = self._load()[index].get(key)
+        elif entry is None and time.time() - self._loaded_at >= current_app.config['COMPANY_DIRECTORY_MISS_RELOAD']:
+            entry = self._load()[index].get(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def by_public_id(self, public_id):
+        """ the company with the given local id, None if unknown """
+        return self._lookup('public_id', public_id)
+
+    def by_vat(self, vat_number):
+        """ the company with the given vat, None if unknown """
+        return self._lookup('vat_number', vat_number)
+
+    def by_public_key(self, public_key):
+        """ the company owning the given PEM public key, None if unknown """
+        if not public_key:
+            return None
+        return self._lookup('public_key', self.fingerprint(public_key), stored=self._stored_fingerprint)
+
+    def by_public_ids(self, public_ids):
+        """ the known companies among the given local ids, in the given order """
+        companies = [self.by_public_id(public_id) for public_id in public_ids]
+        return [company for company in companies if company]
+
+    def by_vats(self, vat_numbers):
+        """
+        Get the known companies with the given vats
+
+        Returns
+        -------
+        dict
+            {vat_number: CompanyEntry}, unknown vats are missing
+        """
+        companies = {vat: self.by_vat(vat) for vat in set(vat_numbers)}
+        return {vat: company for vat, company in companies.items() if company}
+
+    def own(self):
+        """ the company owning this node, None if not created yet """
+        indexes = self._get_indexes()
+        if indexes['own'] is None and time.time() - self._loaded_at >= current_app.config['COMPANY_DIRECTORY_MISS_RELOAD']:
+            indexes = self._load()
+        return indexes['own']
+
+    def invalidate(self):
+        with self._lock:
+            self._indexes = None
+            self._loaded_at = 0
+            self._version = None
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'loads': self.loads,
+                'size': len(self._indexes['public_id']) if self._indexes else 0}
+
+
+company_directory = CompanyDirectory()
@@ -112,6 +112,9 @@ class ValidationDto:
         'location_id': fields.String(required=True,
                                 description='the local public id of the location')
     })
+    validations_to_sign = api.model('validations_to_sign', {
+        'public_ids': fields.List(fields.String, required=True, description='local identifiers of the validations to sign')
+    })
     new_validation = api.model('new_validation', {
         'signer_validation_id': fields.String(required=True,
                               description='public_id on the validating company node of the validation'),
@@ -151,6 +154,9 @@ class PositionDto:
     position_to_sign = api.model('position_to_sign', {
         'public_id': fields.String(description='position local identifier')
     })
+    positions_to_sign = api.model('positions_to_sign', {
+        'public_ids': fields.List(fields.String, required=True, description='local identifiers of the positions to sign')
+    })
 
 class ShipmentDto:
     api = Namespace('shipment', description='shipment related operations')
@@ -169,7 +175,8 @@ class ShipmentDto:
         'description': fields.String(required=True, description='description'),
         'current_company_id': fields.String(required=True, description='the local public id of the company who is the current holder'),
         'waybill_number': fields.String(required=True, description='reference number of the waybill'),
-        'custom_reference_number': fields.String(required=True, description='the identifier of this shipment put into a custom reference field or other service info field')
+        'custom_reference_number': fields.String(required=True, description='the identifier of this shipment put into a custom reference field or other service info field'),
+        'merkle_root': fields.String(required=False, description='root of the merkle tree over the position hashes, ordered by position')
     })
     new_shipment = api.model('new_shipment', {
         'name': fields.String(required=True,
@@ -197,8 +204,31 @@ class ShipmentDto:
         'current_company_vat': fields.String(required=True, description='the vat of the company which is the current holder'),
         'waybill_number': fields.String(required=True, description='reference number of the waybill'),
         'custom_reference_number': fields.String(required=True, description='the identifier of this shipment put into a custom reference field or other service info field'),
+        'merkle_root': fields.String(required=False, description='root of the merkle tree over the position hashes, ordered by position'),
         'positions':fields.List(fields.Nested(PositionDto.import_position))
     })
+    shipment_delta = api.model('shipment_delta', {
+        'hash_id': fields.String(required=True, description='public identifier of the shipment in the network'),
+        'current_company_vat': fields.String(required=False, description='the vat of the company which is the current holder'),
+        'merkle_root': fields.String(required=False, description='root of the merkle tree of the sender after the update'),
+        'positions':fields.List(fields.Nested(PositionDto.import_position), description='only the positions new or newly signed since the receiver state')
+    })
+    proof_step = api.model('proof_step', {
+        'hash': fields.String(required=True, description='hex hash of the sibling node'),
+        'side': fields.String(required=True, description='left/right, side of the sibling')
+    })
+    position_proof = api.model('position_proof', {
+        'merkle_root': fields.String(required=True, description='root of the merkle tree of the shipment'),
+        'hash_id': fields.String(required=True, description='hash_id of the position, i.e. the leaf'),
+        'proof': fields.List(fields.Nested(proof_step), description='siblings from the leaf up to the root')
+    })
+    sync_payloads_request = api.model('sync_payloads_request', {
+        'vat': fields.String(required=True, description='vat of the requesting peer'),
+        'hash_ids': fields.List(fields.String, required=True, description='hash_id of the shipments to transfer')
+    })
+    import_shipment_batch = api.model('import_shipment_batch', {
+        'shipments':fields.List(fields.Nested(import_shipment), required=True, description='the shipments to be imported in a single transaction')
+    })
 
 
 class MethodResultDto:
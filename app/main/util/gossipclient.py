@@ -0,0 +1,111 @@
+import os
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from flask import current_app
+
+from app.main.util.metrics import gossip_calls
+
+
+class GossipClient:
+    """
+    Pool of keep-alive HTTP sessions used to talk with the peer nodes
+
+    one requests.Session is kept for every peer base_url (scheme + host + port),
+    so consecutive gossip calls to the same partner reuse warm connections.
+    Sessions are bound to the process that created them: after a fork (e.g. a
+    celery worker child) the pool is rebuilt instead of sharing sockets.
+    Timeouts, retries and pool sizes are the GOSSIP_* keys of the app config.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self._pid = os.getpid()
+        self.hits = 0
+        self.misses = 0
+
+    def _build_session(self):
+        retry = Retry(
+            total=current_app.config['GOSSIP_MAX_RETRIES'],
+            backoff_factor=current_app.config['GOSSIP_BACKOFF_FACTOR'],
+            status_forcelist=(502, 503, 504)
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=current_app.config['GOSSIP_POOL_MAXSIZE'],
+            max_retries=retry
+        )
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def get_session(self, url):
+        """
+        Get the pooled session for the peer serving the given url
+
+        Parameters
+        ----------
+        url: str
+            any url of the peer, the session is keyed by its base url
+
+        Returns
+        -------
+        requests.Session
+            the session bound to the peer, created on a pool miss
+        """
+        parts = urlsplit(url)
+        base_url = '{}://{}'.format(parts.scheme, parts.netloc)
+        with self._lock:
+            if self._pid != os.getpid():
+                self._sessions = OrderedDict()
+                self._pid = os.getpid()
+            session = self._sessions.get(base_url)
+            if session:
+                self.hits += 1
+                self._sessions.move_to_end(base_url)
+                return session
+            self.misses += 1
+            session = self._build_session()
+            self._sessions[base_url] = session
+            while len(self._sessions) > current_app.config['GOSSIP_MAX_PEERS']:
+                _base_url, evicted = self._sessions.popitem(last=False)
+                evicted.close()
+            return session
+
+    def request(self, method, url, **kwargs):
+        """
+        Execute the HTTP method on the url through the pooled session of the peer
+
+        connect and read timeouts are taken from the config unless given explicitly,
+        the outcome of the call is counted per peer in eonpeers_gossip_calls_total
+        """
+        kwargs.setdefault('timeout', (current_app.config['GOSSIP_CONNECT_TIMEOUT'], current_app.config['GOSSIP_READ_TIMEOUT']))
+        peer = urlsplit(url).netloc
+        try:
+            response = self.get_session(url).request(method, url, **kwargs)
+        except Exception as e:
+            gossip_calls.inc(peer, type(e).__name__)
+            raise
+        gossip_calls.inc(peer, '{}xx'.format(response.status_code // 100))
+        return response
+
+    def stats(self):
+        """ Pool counters: hits, misses and currently open peer sessions """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'peers': len(self._sessions)}
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = OrderedDict()
+
+
+gossip_client = GossipClient()
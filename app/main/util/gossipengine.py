@@ -0,0 +1,113 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from flask import current_app
+
+from app.main.util.gossipclient import gossip_client
+
+
+class GossipEngine:
+    """
+    Run many outbound peer calls concurrently from a single worker
+
+    the calls are scheduled on an asyncio loop and executed on a thread pool
+    through the pooled gossip_client, at most GOSSIP_PER_PEER_CONCURRENCY at a
+    time for the same peer. A broadcast to N peers takes about as long as the
+    slowest peer and never more than the overall deadline.
+
+    the thread pool is shared by every broadcast of the process (and rebuilt in a
+    forked child), so it is never shut down under a running call: at the deadline
+    the calls not started yet are cancelled, the running ones end within the
+    gossip_client timeouts and their results are dropped.
+    """
+
+    _executor = None
+    _executor_pid = None
+    _executor_lock = threading.Lock()
+
+    def __init__(self, app=None):
+        self._app = app
+
+    def _get_app(self):
+        return self._app or current_app._get_current_object()
+
+    @classmethod
+    def _get_executor(cls, max_workers):
+        with cls._executor_lock:
+            if cls._executor is None or cls._executor_pid != os.getpid():
+                cls._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='gossip')
+                cls._executor_pid = os.getpid()
+            return cls._executor
+
+    def broadcast(self, calls, deadline=None):
+        """
+        Execute the given calls concurrently and wait for all of them or the deadline
+
+        Parameters
+        ----------
+        calls: list
+            tuples (method, url, payload, headers) where payload and headers are optional,
+            method is one of 'get', 'post', 'put'
+        deadline: float
+            seconds after which the calls still running are abandoned,
+            defaults to GOSSIP_BROADCAST_DEADLINE
+
+        Returns
+        -------
+        list
+            one item per call, in the same order: the requests.Response or,
+            when the call failed or missed the deadline, a dict with the 'error' key
+        """
+        if not calls:
+            return []
+        app = self._get_app()
+        deadline = deadline if deadline is not None else app.config['GOSSIP_BROADCAST_DEADLINE']
+        executor = self._get_executor(app.config['GOSSIP_MAX_CONCURRENCY'])
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self._broadcast(loop, executor, app, calls, deadline))
+        finally:
+            loop.close()
+
+    async def _broadcast(self, loop, executor, app, calls, deadline):
+        per_peer_limit = app.config['GOSSIP_PER_PEER_CONCURRENCY']
+        semaphores = {}
+        tasks = []
+        for call in calls:
+            parts = urlsplit(call[1])
+            peer = '{}://{}'.format(parts.scheme, parts.netloc)
+            if peer not in semaphores:
+                semaphores[peer] = asyncio.Semaphore(per_peer_limit)
+            tasks.append(loop.create_task(self._call(loop, executor, app, semaphores[peer], call)))
+
+        done, pending = await asyncio.wait(tasks, timeout=deadline)
+        for task in pending:
+            task.cancel()
+        if pending:
+            #let the cancellation reach the executor, the calls still queued never start
+            await asyncio.wait(pending)
+
+        results = []
+        for task in tasks:
+            if task in pending:
+                results.append({'error': 'Deadline exceeded'})
+            elif task.exception():
+                results.append({'error': 'An Exception occured: ' + str(task.exception())})
+            else:
+                results.append(task.result())
+        return results
+
+    async def _call(self, loop, executor, app, semaphore, call):
+        async with semaphore:
+            return await loop.run_in_executor(executor, self._execute, app, call)
+
+    def _execute(self, app, call):
+        method = call[0]
+        url = call[1]
+        payload = call[2] if len(call) > 2 else {}
+        headers = call[3] if len(call) > 3 else {}
+        with app.app_context():
+            return gossip_client.request(method.upper(), url, data=payload, headers=headers)
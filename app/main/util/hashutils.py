@@ -1,7 +1,7 @@
 
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes, serialization, hmac
-from cryptography.hazmat.primitives.asymmetric import ec
+import hashlib
+import hmac as std_hmac
+from functools import lru_cache
 
 from flask import current_app
 
@@ -14,6 +14,21 @@ class Singleton(object):
         return cls._instance
 
 
+def _to_bytes(message):
+    if(isinstance(message, str)):
+        return message.encode()
+    elif(isinstance(message, bytes)):
+        return message
+    else:
+        raise Exception('Corrupt message type')
+
+
+@lru_cache(maxsize=1024)
+def _derive_hmac_key(key):
+    # the same location key is used for many messages, its derived key is kept
+    return hashlib.sha256(key).digest()
+
+
 class HashUtils(Singleton):
 
     def __init__(self):
@@ -44,15 +59,32 @@ class HashUtils(Singleton):
             general exception
 
         """
-        digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
-        if(isinstance(message, str)):
-            digest.update(message.encode())
-        elif(isinstance(message, bytes)):
-            digest.update(message)
-        else:
-            raise Exception('Corrupt message type')
-        bytes_digest = digest.finalize()
-        return bytes_digest
+        return hashlib.sha256(_to_bytes(message)).digest()
+
+    def digest_many(self, messages):
+        """
+        digest many messages: perform SHA256 on each of them
+
+        hashlib (OpenSSL) is used directly, without building a cryptography
+        Hash context per message, which is what dominates on short messages
+
+        Parameters
+        ----------
+        messages: iterable
+            str or bytes messages to be hashed
+
+        Returns
+        --------
+        list
+            the hashed messages in bytes, in the same order
+
+        Raises
+        ------
+        Exception
+            if one of the messages is not a string or bytes
+        """
+        sha256 = hashlib.sha256
+        return [sha256(_to_bytes(message)).digest() for message in messages]
 
     def hmac(self, message, key):
         """
@@ -79,8 +111,37 @@ class HashUtils(Singleton):
             if the inputs are not a string or bytes raise a
             general exception
         """
-        correct_length_bit_key = self.digest(key)
-        message = message.encode() if isinstance(message, str) else message
-        h = hmac.HMAC(correct_length_bit_key, hashes.SHA256(), backend=default_backend())
-        h.update(message)
-        return h.finalize()
\ No newline at end of file
+        correct_length_bit_key = _derive_hmac_key(_to_bytes(key))
+        return std_hmac.new(correct_length_bit_key, _to_bytes(message), hashlib.sha256).digest()
+
+    def hmac_many(self, messages, key):
+        """
+        compute the hmac of many messages with the same key
+
+        the 256bit key is derived once and the messages are processed in one pass
+
+        Parameters
+        ----------
+        messages: iterable
+            str or bytes messages to be hashed
+        key: str or bytes
+            the key for the hmac, e.g. a location_key
+
+        Returns
+        --------
+        list
+            the hmacs in bytes, in the same order
+
+        Raises
+        ------
+        Exception
+            if the inputs are not a string or bytes
+        """
+        correct_length_bit_key = _derive_hmac_key(_to_bytes(key))
+        template = std_hmac.new(correct_length_bit_key, digestmod=hashlib.sha256)
+        results = []
+        for message in messages:
+            h = template.copy()
+            h.update(_to_bytes(message))
+            results.append(h.digest())
+        return results
\ No newline at end of file
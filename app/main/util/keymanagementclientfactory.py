@@ -1,10 +1,14 @@
+import os
 import os.path
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.serialization import load_pem_private_key
 from cryptography.hazmat.primitives.asymmetric import ec
-from cryptography.exceptions import InvalidSignature 
+from cryptography.exceptions import InvalidSignature, UnsupportedAlgorithm
 
 """
 TODO: This class will handle the connection to KMIP-compliant key management server
@@ -17,6 +21,140 @@ TODO: once the functions from pykmip are clear, define the abastract methods
 #from kmip.pie import client
 #from kmip import enums
 
+class PublicKeyCache:
+    """
+    Bounded LRU cache of loaded public keys
+
+    loading a PEM is way more expensive than the lookup, peers sign many objects
+    with the same key so the loaded key object is kept, keyed by the SHA256
+    fingerprint of the PEM bytes. Entries are invalidated when a company key
+    changes (see the listeners on the Company model).
+    """
+    def __init__(self, maxsize=256):
+        self._maxsize = maxsize
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def fingerprint(serialized_public):
+        """ SHA256 hex digest of the PEM, str or bytes """
+        if(isinstance(serialized_public, str)):
+            serialized_public = serialized_public.encode()
+        digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
+        digest.update(serialized_public.strip())
+        return digest.finalize().hex()
+
+    def get(self, serialized_public):
+        """
+        Get the loaded public key for the given PEM, loading it on a miss
+
+        Parameters
+        ----------
+        serialized_public: str (utf-8 decoded) or bytes
+            the public key in PEM encoding
+
+        Returns
+        -------
+        EllipticCurvePublicKey
+            as for the cryptography library
+
+        Raises
+        ------
+        ValueError, UnsupportedAlgorithm
+            when the PEM cannot be loaded, nothing is cached in that case
+        """
+        if(isinstance(serialized_public, str)):
+            serialized_public = serialized_public.encode()
+        fingerprint = self.fingerprint(serialized_public)
+        with self._lock:
+            loaded_public_key = self._keys.get(fingerprint)
+            if loaded_public_key:
+                self.hits += 1
+                self._keys.move_to_end(fingerprint)
+                return loaded_public_key
+            self.misses += 1
+        loaded_public_key = serialization.load_pem_public_key(
+            serialized_public,
+            backend=default_backend()
+        )
+        with self._lock:
+            self._keys[fingerprint] = loaded_public_key
+            while len(self._keys) > self._maxsize:
+                self._keys.popitem(last=False)
+        return loaded_public_key
+
+    def invalidate(self, serialized_public):
+        """ drop the loaded key of the given PEM, if cached """
+        with self._lock:
+            self._keys.pop(self.fingerprint(serialized_public), None)
+
+    def clear(self):
+        with self._lock:
+            self._keys = OrderedDict()
+
+    def stats(self):
+        """ counters of the cache: hits, misses, hit_rate and current size """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._keys)
+            }
+
+
+public_key_cache = PublicKeyCache()
+
+
+def public_key_fingerprint(serialized_public):
+    """
+    Fixed-length fingerprint of a public key, used to index and look up the companies by key
+
+    Parameters
+    ----------
+    serialized_public: str (utf-8 decoded) or bytes
+        the public key in PEM encoding
+
+    Returns
+    -------
+    str
+        the SHA256 hex digest of the DER SubjectPublicKeyInfo, so the same key always gets
+        the same fingerprint whatever its PEM layout; when the value cannot be loaded as a
+        key, the SHA256 hex digest of the value itself. None for an empty key
+    """
+    if not serialized_public:
+        return None
+    try:
+        spki = public_key_cache.get(serialized_public).public_bytes(
+            encoding=serialization.Encoding.DER,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+    except (ValueError, TypeError, UnsupportedAlgorithm):
+        return PublicKeyCache.fingerprint(serialized_public)
+    digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
+    digest.update(spki)
+    return digest.finalize().hex()
+
+_crypto_executor = None
+_crypto_executor_lock = threading.Lock()
+
+def get_crypto_executor():
+    """
+    Thread pool shared by the bulk signatures and verifications of this process
+
+    OpenSSL releases the GIL while signing and checking, so threads are enough
+    to use every core without paying for process start-up and key pickling
+    """
+    global _crypto_executor
+    with _crypto_executor_lock:
+        if not _crypto_executor:
+            _crypto_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+        return _crypto_executor
+
+
 class KeyManagementClientFactory:
     def __init__(self):
         self._builders = {}
@@ -187,13 +325,35 @@ class DevKeyManagementClient:
         signed = priv_key.sign(message, ec.ECDSA(hashes.SHA256()))
         return {'signed': signed, 'serialized_public': serialized_key}
 
+    def sign_many_bytes_messages(self, messages):
+        """
+        sign many messages in parallel on the shared thread pool
+
+        Parameters
+        ----------
+        messages: list
+            the messages to be signed by the node, in bytes
+
+        Returns
+        --------
+        list
+            one {signed, serialized_public} dict per message, in the same order,
+            as returned by sign_bytes_message
+        """
+        priv_key = self._priv_key
+        serialized_key = self.get_serialized_pub_key()
+        executor = get_crypto_executor()
+        signatures = executor.map(lambda message: priv_key.sign(message, ec.ECDSA(hashes.SHA256())), messages)
+        return [{'signed': signed, 'serialized_public': serialized_key} for signed in signatures]
+
 
     def verify_signed_message(self, signed, message, serialized_public):
         """
         check if a message and a signature are matching given the pub key 
 
         note that the signature may be sent over by another node, 
-        therefore we also need to know the public_key
+        therefore we also need to know the public_key, which is loaded
+        once and then served by the public_key_cache
 
         Parameters
         ----------
@@ -217,10 +377,7 @@ class DevKeyManagementClient:
             print("inside factory")
             if(isinstance(serialized_public, str)):
                 serialized_public = serialized_public.encode()
-            loaded_public_key = serialization.load_pem_public_key(
-                serialized_public,
-                backend=default_backend()
-            )
+            loaded_public_key = public_key_cache.get(serialized_public)
             if(isinstance(message, str)):
                 message = message.encode()
                 
@@ -238,3 +395,70 @@ class DevKeyManagementClient:
             print("general exc", e)
             return False
 
+    def verify_many_signed_messages(self, items):
+        """
+        check many (signature, message, public key) triples at once
+
+        the items are grouped by public key so every PEM is loaded once,
+        then the groups are split in chunks verified in parallel on the
+        shared thread pool
+
+        Parameters
+        ----------
+        items: list
+            tuples (signed, message, serialized_public) with the same types
+            accepted by verify_signed_message
+
+        Returns
+        --------
+        list
+            one bool per item, in the same order, True if the signature checks out.
+            As for verify_signed_message, anything going wrong results in False
+        """
+        groups = OrderedDict()
+        for index, (signed, message, serialized_public) in enumerate(items):
+            if(isinstance(serialized_public, str)):
+                serialized_public = serialized_public.encode()
+            groups.setdefault(serialized_public, []).append(index)
+
+        results = [False] * len(items)
+        jobs = []
+        for serialized_public, indexes in groups.items():
+            try:
+                loaded_public_key = public_key_cache.get(serialized_public)
+            except Exception as e:
+                print("general exc", e)
+                continue
+            jobs.append((loaded_public_key, indexes))
+
+        executor = get_crypto_executor()
+        chunk_size = max(1, len(items) // ((os.cpu_count() or 1) * 4))
+        futures = []
+        for loaded_public_key, indexes in jobs:
+            for start in range(0, len(indexes), chunk_size):
+                chunk = indexes[start:start+chunk_size]
+                futures.append((chunk, executor.submit(self._verify_chunk, loaded_public_key, [items[i] for i in chunk])))
+        for chunk, future in futures:
+            for index, result in zip(chunk, future.result()):
+                results[index] = result
+        return results
+
+    def _verify_chunk(self, loaded_public_key, items):
+        results = []
+        for signed, message, _serialized_public in items:
+            if(isinstance(message, str)):
+                message = message.encode()
+            try:
+                loaded_public_key.verify(signed, message, ec.ECDSA(hashes.SHA256()))
+                results.append(True)
+            except InvalidSignature:
+                results.append(False)
+            except Exception as e:
+                print("general exc", e)
+                results.append(False)
+        return results
+
+    def public_key_cache_stats(self):
+        """ counters of the cache of loaded peer public keys """
+        return public_key_cache.stats()
+
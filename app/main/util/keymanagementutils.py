@@ -2,6 +2,7 @@
 from flask import current_app
 
 from app.main.util.keymanagementclientfactory import KeyManagementClientFactory
+from app.main.util.metrics import signatures, verifications
 
 class Singleton(object):
     _instance = None  # Keep instance reference
@@ -55,11 +56,43 @@ class KeyManagementClient(Singleton):
             a general Exception is raised complaining about the message type
         """
         if isinstance(message, str):
-            return self._get_kmic().sign_bytes_message(message.encode())
-        elif isinstance(message, bytes):
-            return self._get_kmic().sign_bytes_message(message)
-        else:
+            message = message.encode()
+        elif not isinstance(message, bytes):
             raise Exception('Corrupt message type')
+        signed = self._get_kmic().sign_bytes_message(message)
+        signatures.inc()
+        return signed
+
+    def sign_many(self, messages):
+        """
+        sign many messages at once, using every core of the node
+
+        Parameters
+        ----------
+        messages: list
+            str/bytes messages, str are encoded first
+
+        Returns
+        --------
+        list
+            one {signed, serialized_public} dict per message, in the same order
+
+        Raises
+        ------
+        Exception
+            if one of the messages is not a string, not a bytes array
+        """
+        bytes_messages = []
+        for message in messages:
+            if isinstance(message, str):
+                bytes_messages.append(message.encode())
+            elif isinstance(message, bytes):
+                bytes_messages.append(message)
+            else:
+                raise Exception('Corrupt message type')
+        signed = self._get_kmic().sign_many_bytes_messages(bytes_messages)
+        signatures.inc(amount=len(signed))
+        return signed
 
     def verify_signed_message(self, signed, message, serialized_public):
         """
@@ -83,7 +116,42 @@ class KeyManagementClient(Singleton):
             Note that anything going wrong is catched and 
             the method just returns False
         """
-        return self._get_kmic().verify_signed_message(signed, message, serialized_public)
+        result = self._get_kmic().verify_signed_message(signed, message, serialized_public)
+        verifications.inc('valid' if result else 'invalid')
+        return result
+
+    def verify_many(self, items):
+        """
+        check many signatures at once, using every core of the node
+
+        Parameters
+        ----------
+        items: list
+            tuples (signed, message, serialized_public), see verify_signed_message
+
+        Returns
+        --------
+        list
+            one bool per item, in the same order, True if the signature checks out
+        """
+        results = self._get_kmic().verify_many_signed_messages(items)
+        valid = sum(1 for result in results if result)
+        if valid:
+            verifications.inc('valid', amount=valid)
+        if len(results) - valid:
+            verifications.inc('invalid', amount=len(results) - valid)
+        return results
+
+    def public_key_cache_stats(self):
+        """
+        Get the counters of the cache of loaded peer public keys
+
+        Returns
+        -------
+        dict
+            hits, misses, hit_rate and size of the cache
+        """
+        return self._get_kmic().public_key_cache_stats()
 
     def get_serialized_pub_key(self):
         """
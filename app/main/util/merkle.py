@@ -0,0 +1,125 @@
+"""
+Merkle tree over the ordered positions of a shipment
+
+leaves and inner nodes are hashed with different prefixes (0x00, 0x01) so a node
+cannot be passed off as a leaf; an odd node at the end of a level is promoted
+as it is to the next level instead of being paired with itself.
+"""
+from app.main.util.eonerror import EonError
+from app.main.util.hashutils import HashUtils
+
+
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+
+def _leaf_bytes(leaf):
+    """ the prefixed leaf, the hash_id comes from a peer and may not be hex """
+    try:
+        return LEAF_PREFIX + bytes.fromhex(leaf)
+    except (ValueError, TypeError):
+        raise EonError('Position hash is not a valid hex string: {}'.format(leaf), 400)
+
+
+def _leaf_hash(leaf):
+    return HashUtils().digest(_leaf_bytes(leaf))
+
+
+def _node_hash(left, right):
+    return HashUtils().digest(NODE_PREFIX + left + right)
+
+
+def _levels(leaves):
+    level = HashUtils().digest_many([_leaf_bytes(leaf) for leaf in leaves])
+    levels = [level]
+    while len(level) > 1:
+        next_level = [_node_hash(level[i], level[i+1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            next_level.append(level[-1])
+        levels.append(next_level)
+        level = next_level
+    return levels
+
+
+def merkle_root(leaves):
+    """
+    compute the root of the tree over the given leaves
+
+    Parameters
+    ----------
+    leaves: list
+        the hex hash_id of the positions, in the shipment order
+
+    Returns
+    -------
+    str
+        the hex root, None when there are no leaves
+
+    Raises
+    ------
+    EonError
+        400, when a leaf is not a hex string
+    """
+    if not leaves:
+        return None
+    return _levels(leaves)[-1][0].hex()
+
+
+def merkle_proof(leaves, index):
+    """
+    compute the inclusion proof of the leaf at the given index
+
+    Returns
+    -------
+    list
+        the siblings from the leaf up to the root, as dicts
+        {'hash': hex sibling, 'side': 'left'|'right'}; levels where the node
+        is promoted without a sibling are skipped
+
+    Raises
+    ------
+    IndexError
+        when the index is out of the leaves
+    EonError
+        400, when a leaf is not a hex string
+    """
+    if index < 0 or index >= len(leaves):
+        raise IndexError('Leaf index out of range')
+    proof = []
+    for level in _levels(leaves)[:-1]:
+        sibling = index + 1 if index % 2 == 0 else index - 1
+        if sibling < len(level):
+            proof.append({'hash': level[sibling].hex(), 'side': 'right' if sibling > index else 'left'})
+        index = index // 2
+    return proof
+
+
+def verify_merkle_proof(leaf, proof, root):
+    """
+    check that the leaf belongs to the tree with the given root, in O(log n) hashes
+
+    Parameters
+    ----------
+    leaf: str
+        the hex hash_id of the position
+    proof: list
+        the siblings as returned by merkle_proof
+    root: str
+        the hex root
+
+    Returns
+    -------
+    bool
+        True if the proof checks out
+    """
+    try:
+        node = _leaf_hash(leaf)
+        for sibling in proof:
+            sibling_hash = bytes.fromhex(sibling['hash'])
+            if sibling['side'] == 'left':
+                node = _node_hash(sibling_hash, node)
+            else:
+                node = _node_hash(node, sibling_hash)
+        return node.hex() == root
+    except (EonError, ValueError, KeyError, TypeError):
+        return False
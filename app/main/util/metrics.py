@@ -0,0 +1,343 @@
+"""
+Metrics registry of the node, exposed at /metrics in the Prometheus text format
+
+counters and histograms are plain dicts of floats guarded by a lock, so an update
+costs a dict lookup and an addition. Each process only counts its own work: the
+values are dropped in a forked child (the parent keeps and reports them), and when
+METRICS_DIR is set every process dumps its values to <METRICS_DIR>/metrics-<pid>.json
+at most every METRICS_FLUSH_INTERVAL seconds, so the process answering /metrics can
+sum the values of every web and celery worker of the node. A process removes its
+file on exit, and the files of the processes not running anymore (e.g. killed
+workers) are removed when the metrics are collected.
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+from celery import signals
+from flask import Response, g, request
+
+from app.main.services import db
+
+
+logger = logging.getLogger('eonpeers.metrics')
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels_text(names, values, extra=None):
+    pairs = ['{}="{}"'.format(name, _escape(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append('{}="{}"'.format(*extra))
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """ a monotonic value per combination of labels """
+
+    kind = 'counter'
+
+    def __init__(self, registry, name, description, labels=()):
+        self._registry = registry
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        label_values = tuple(str(label) for label in label_values)
+        with self._registry.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+        self._registry.maybe_flush()
+
+    def snapshot(self):
+        return [[list(key), value] for key, value in self.values.items()]
+
+    def merge(self, merged, snapshot):
+        for key, value in snapshot:
+            merged[tuple(key)] = merged.get(tuple(key), 0) + value
+
+    def render(self, values):
+        return ['{}{} {}'.format(self.name, _labels_text(self.labels, key), value) for key, value in sorted(values.items())]
+
+
+class Histogram:
+    """ cumulative buckets, sum and count of the observed values per combination of labels """
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        self._registry = registry
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}
+
+    def observe(self, value, *label_values):
+        label_values = tuple(str(label) for label in label_values)
+        with self._registry.lock:
+            entry = self.values.get(label_values)
+            if entry is None:
+                entry = self.values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+        self._registry.maybe_flush()
+
+    def snapshot(self):
+        return [[list(key), value] for key, value in self.values.items()]
+
+    def merge(self, merged, snapshot):
+        for key, (counts, total, count) in snapshot:
+            entry = merged.setdefault(tuple(key), [[0] * len(self.buckets), 0.0, 0])
+            entry[0] = [a + b for a, b in zip(entry[0], counts)]
+            entry[1] += total
+            entry[2] += count
+
+    def render(self, values):
+        lines = []
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append('{}_bucket{} {}'.format(self.name, _labels_text(self.labels, key, ('le', bound)), cumulative))
+            lines.append('{}_bucket{} {}'.format(self.name, _labels_text(self.labels, key, ('le', '+Inf')), count))
+            lines.append('{}_sum{} {}'.format(self.name, _labels_text(self.labels, key), total))
+            lines.append('{}_count{} {}'.format(self.name, _labels_text(self.labels, key), count))
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Registry of the counters and histograms of the process, see the module docstring
+
+    gauges are not stored: they are callables returning {label values: value},
+    evaluated by the process answering /metrics
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._metrics = []
+        self._gauges = []
+        self._directory = None
+        self._flush_interval = 5
+        self._flushed_at = 0
+        atexit.register(self._remove_dump)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._forked)
+
+    def counter(self, name, description, labels=()):
+        metric = Counter(self, name, description, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(self, name, description, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, description, labels, collect):
+        self._gauges.append((name, description, tuple(labels), collect))
+
+    def configure(self, directory=None, flush_interval=5):
+        """ set where the processes of the node share their values, None to keep them in process """
+        self._directory = directory
+        self._flush_interval = flush_interval
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _dump_path(self, pid=None):
+        return os.path.join(self._directory, 'metrics-{}.json'.format(pid or os.getpid()))
+
+    def _remove_dump(self):
+        if not self._directory:
+            return
+        try:
+            os.remove(self._dump_path())
+        except OSError:
+            pass
+
+    @staticmethod
+    def _running(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def _forked(self):
+        #the parent keeps reporting what was counted before the fork
+        self.lock = threading.Lock()
+        for metric in self._metrics:
+            metric.values = {}
+        self._flushed_at = 0
+
+    def snapshot(self):
+        with self.lock:
+            return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def maybe_flush(self):
+        if self._directory and time.time() - self._flushed_at >= self._flush_interval:
+            self.flush()
+
+    def flush(self):
+        """ dump the values of this process to the shared directory, atomically """
+        if not self._directory:
+            return
+        self._flushed_at = time.time()
+        path = self._dump_path()
+        tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("metrics not flushed: %s", e)
+
+    def _collect(self):
+        if not self._directory:
+            return [self.snapshot()]
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(self._directory, 'metrics-*.json')):
+            pid = os.path.basename(path)[len('metrics-'):-len('.json')]
+            if pid.isdigit() and not self._running(int(pid)):
+                #a worker that died without removing its file
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self):
+        """
+        Render every metric of the node in the Prometheus text exposition format
+
+        Returns
+        -------
+        str
+            the body of the /metrics response
+        """
+        snapshots = self._collect()
+        lines = []
+        for metric in self._metrics:
+            merged = {}
+            for snapshot in snapshots:
+                metric.merge(merged, snapshot.get(metric.name, []))
+            lines.append('# HELP {} {}'.format(metric.name, metric.description))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            lines.extend(metric.render(merged))
+        for name, description, labels, collect in self._gauges:
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} gauge'.format(name))
+            try:
+                values = collect()
+            except Exception as e:
+                logger.warning("gauge %s not collected: %s", name, e)
+                continue
+            lines.extend('{}{} {}'.format(name, _labels_text(labels, key), value) for key, value in sorted(values.items()))
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+http_request_duration = metrics.histogram('eonpeers_http_request_duration_seconds',
+    'Latency of the API requests', ('endpoint', 'method', 'status'))
+task_duration = metrics.histogram('eonpeers_celery_task_duration_seconds',
+    'Run time of the celery tasks', ('task', 'state'))
+task_queue_wait = metrics.histogram('eonpeers_celery_task_queue_wait_seconds',
+    'Time between the publication of a celery task and its start', ('task',))
+gossip_calls = metrics.counter('eonpeers_gossip_calls_total',
+    'Outbound calls to the peers by outcome: status code class or error', ('peer', 'outcome'))
+signatures = metrics.counter('eonpeers_signatures_total',
+    'Messages signed with the node key', ())
+verifications = metrics.counter('eonpeers_verifications_total',
+    'Signatures checked against a public key, by result', ('result',))
+
+
+def init_app(app):
+    """
+    Time every request of the app and serve the metrics of the node at /metrics
+
+    the directory shared by the processes of the node is METRICS_DIR, if any.
+    /metrics is not authenticated (Prometheus scrapes it as it is): it is only
+    served when METRICS_ENABLED is set, keep it behind the reverse proxy
+    """
+    if not app.config['METRICS_ENABLED']:
+        return
+    metrics.configure(app.config['METRICS_DIR'], app.config['METRICS_FLUSH_INTERVAL'])
+
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+
+    def observe_request(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            http_request_duration.observe(time.perf_counter() - started,
+                request.endpoint or 'unknown', request.method, response.status_code)
+        return response
+
+    def serve_metrics():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    def db_pool():
+        with app.app_context():
+            pool = db.engine.pool
+        stats = {}
+        for name in ('size', 'checkedout', 'overflow', 'checkedin'):
+            if callable(getattr(pool, name, None)):
+                stats[(name,)] = getattr(pool, name)()
+        return stats
+
+    def outbox_parked():
+        from app.main.service.outbox_service import count_parked
+        with app.app_context():
+            return {(task,): count for task, count in count_parked().items()}
+
+    app.before_request(start_timer)
+    app.after_request(observe_request)
+    app.add_url_rule('/metrics', 'metrics', serve_metrics)
+    metrics.gauge('eonpeers_db_pool_connections', 'Connections of the db pool of the process answering', ('state',), db_pool)
+    metrics.gauge('eonpeers_outbox_parked_messages', 'Outbox messages parked after OUTBOX_MAX_ATTEMPTS failed publications', ('task',), outbox_parked)
+
+
+@signals.before_task_publish.connect
+def stamp_published_task(sender=None, headers=None, **kwargs):
+    if headers is not None:
+        headers['published_at'] = time.time()
+
+
+@signals.task_prerun.connect
+def start_task_timer(sender=None, task=None, **kwargs):
+    published_at = getattr(task.request, 'published_at', None)
+    if published_at:
+        task_queue_wait.observe(max(time.time() - published_at, 0), task.name)
+    task.request.metrics_started = time.perf_counter()
+
+
+@signals.task_postrun.connect
+def observe_task(sender=None, task=None, state=None, **kwargs):
+    started = getattr(task.request, 'metrics_started', None)
+    if started is not None:
+        task_duration.observe(time.perf_counter() - started, task.name, state)
+
@@ -0,0 +1,89 @@
+import json
+
+from flask_restplus import marshal
+
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+EXPORT_BATCH_SIZE = 500
+
+
+def keyset_page(query, column, cursor=None, limit=None):
+    """
+    Get a page of the query using keyset (cursor) pagination
+
+    instead of OFFSET, the page starts right after the cursor, i.e. the last value
+    of the ordering column seen by the client, so every page costs an index range
+    scan whatever its depth and rows inserted meanwhile don't shift the pages.
+
+    Parameters
+    ----------
+    query: Query
+        the filtered query of the model to paginate
+    column: Column
+        the unique, ordered column used as cursor, e.g. Model.id
+    cursor: int
+        the value returned as next_cursor by the previous page, None for the first page
+    limit: int
+        page size, defaults to DEFAULT_PAGE_SIZE and is capped at MAX_PAGE_SIZE
+
+    Returns
+    -------
+    tuple
+        (items, next_cursor), next_cursor is None on the last page
+    """
+    limit = min(max(limit or DEFAULT_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+    if cursor is not None:
+        query = query.filter(column > cursor)
+    rows = query.order_by(column.asc()).limit(limit+1).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, getattr(rows[-1], column.key)
+    return rows, None
+
+
+def keyset_batches(query, column, cursor=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Iterate over the whole query in keyset pages of batch_size rows
+
+    only one batch is held in memory at a time, so the whole table can be
+    exported with constant memory; the iteration can be resumed by passing
+    the cursor value of the last row received
+
+    Yields
+    ------
+    list
+        the rows of each batch, in order of the cursor column
+    """
+    while True:
+        rows, cursor = keyset_page(query, column, cursor, batch_size)
+        if rows:
+            yield rows
+        if cursor is None:
+            return
+
+
+def ndjson_lines(batches, model):
+    """
+    Serialise the batches as newline-delimited JSON, one object per line
+
+    every object is marshalled with the given DTO model and carries the
+    'cursor' to resume the export right after it
+
+    Yields
+    ------
+    str
+        one line per row
+    """
+    for rows in batches:
+        for row in rows:
+            line = marshal(row, model)
+            line['cursor'] = row.id
+            yield json.dumps(line) + '\n'
+
+
+def next_cursor_headers(next_cursor):
+    """ the response headers advertising the cursor of the next page, if any """
+    if next_cursor is None:
+        return {}
+    return {'X-Next-Cursor': str(next_cursor)}
@@ -0,0 +1,83 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from flask import current_app
+
+from app.main.services import flask_bcrypt
+from app.main.util.eonerror import EonError
+
+
+class PasswordHasher:
+    """
+    Bounded executor for the bcrypt work of the node
+
+    bcrypt is slow on purpose: hashing and checking run on a dedicated pool of
+    PASSWORD_HASH_WORKERS threads (bcrypt releases the GIL) and at most
+    PASSWORD_HASH_QUEUE_DEPTH more requests may wait for a thread. Beyond that
+    the call fails at once with a 503, so a burst of logins cannot starve the
+    rest of the traffic. The cost of a hash is set by BCRYPT_LOG_ROUNDS.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+
+    def _get_executor(self):
+        with self._lock:
+            if not self._executor:
+                workers = current_app.config['PASSWORD_HASH_WORKERS']
+                self._executor = ThreadPoolExecutor(max_workers=workers)
+                self._slots = threading.BoundedSemaphore(workers + current_app.config['PASSWORD_HASH_QUEUE_DEPTH'])
+            return self._executor
+
+    def _run(self, fn, *args):
+        executor = self._get_executor()
+        if not self._slots.acquire(blocking=False):
+            raise EonError('Too many password checks in progress, retry later.', 503)
+        try:
+            future = executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        #the slot is held until the hash is done, even when the caller stopped waiting for it
+        future.add_done_callback(lambda done: self._slots.release())
+        try:
+            return future.result(timeout=current_app.config['PASSWORD_HASH_TIMEOUT'])
+        except TimeoutError:
+            raise EonError('Password check timed out, retry later.', 503)
+
+    def generate(self, password):
+        """
+        hash the password with bcrypt on the bounded executor
+
+        Returns
+        -------
+        str
+            the bcrypt hash, utf-8 decoded
+
+        Raises
+        ------
+        EonError
+            503, when the executor is saturated or the hash times out
+        """
+        return self._run(flask_bcrypt.generate_password_hash, password).decode('utf-8')
+
+    def check(self, password_hash, password):
+        """
+        check the password against the bcrypt hash on the bounded executor
+
+        Returns
+        -------
+        bool
+            True if the password matches
+
+        Raises
+        ------
+        EonError
+            503, when the executor is saturated or the check times out
+        """
+        return self._run(flask_bcrypt.check_password_hash, password_hash, password)
+
+
+password_hasher = PasswordHasher()
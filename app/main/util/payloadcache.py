@@ -0,0 +1,74 @@
+import json
+import threading
+from collections import OrderedDict
+
+from app.main.util.hashutils import HashUtils
+
+
+class ShipmentPayloadCache:
+    """
+    Bounded LRU cache of the canonical serialised shipment payloads
+
+    entries are keyed by the shipment public_id and tagged with the shipment
+    version: the version is bumped in the db every time the shipment or one
+    of its positions changes (see the before_flush listener on the models),
+    so a lookup with the current version never returns stale bytes, even when
+    the change was done by another process.
+    """
+
+    def __init__(self, maxsize=1024):
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def serialize(payload):
+        """ canonical JSON: sorted keys, no whitespace, so the same payload is always the same bytes """
+        return json.dumps(payload, sort_keys=True, separators=(',', ':'))
+
+    def get(self, shipment_id, version):
+        """
+        Get the cached entry of the shipment if it was built for the given version
+
+        Returns
+        -------
+        dict
+            'body' (str), 'etag' (str) and 'target_company' (str) or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(shipment_id)
+            if entry and entry['version'] == version:
+                self.hits += 1
+                self._entries.move_to_end(shipment_id)
+                return entry
+            self.misses += 1
+            return None
+
+    def put(self, shipment_id, version, payload, target_company):
+        """ serialise the payload and store it for the given shipment version """
+        body = self.serialize(payload)
+        entry = {
+            'version': version,
+            'body': body,
+            'etag': HashUtils().digest(body).hex(),
+            'target_company': target_company
+        }
+        with self._lock:
+            self._entries[shipment_id] = entry
+            self._entries.move_to_end(shipment_id)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, shipment_id):
+        with self._lock:
+            self._entries.pop(shipment_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+shipment_payload_cache = ShipmentPayloadCache()
@@ -0,0 +1,188 @@
+import threading
+import time
+from functools import wraps
+
+from flask import jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.main.util.hashutils import HashUtils
+from app.main.util.keymanagementutils import KeyManagementClient
+
+
+#methods timed when profiling is on, by bucket of the Server-Timing header
+INSTRUMENTED = {
+    'hash': (HashUtils, ('digest', 'digest_many', 'hmac', 'hmac_many')),
+    'kms': (KeyManagementClient, ('sign_message', 'sign_many', 'verify_signed_message', 'verify_many'))
+}
+
+
+class RequestProfile:
+    """ what a single request spent: wall time, sql queries and time, hashing, signing and commits """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.commits = 0
+        self.buckets = {bucket: 0.0 for bucket in INSTRUMENTED}
+        self.depth = {bucket: 0 for bucket in INSTRUMENTED}
+
+    def server_timing(self, wall):
+        metrics = ['app;dur={:.2f}'.format(wall * 1000),
+            'db;dur={:.2f};desc="{} queries"'.format(self.sql_time * 1000, self.queries)]
+        metrics += ['{};dur={:.2f}'.format(bucket, spent * 1000) for bucket, spent in sorted(self.buckets.items())]
+        metrics.append('commit;desc="{}"'.format(self.commits))
+        return ', '.join(metrics)
+
+
+class Profiler:
+    """
+    Opt-in per-request profiling, enabled by the PROFILING config key
+
+    every request gets a RequestProfile fed by the SQLAlchemy engine events and by
+    timed wrappers around the HashUtils and KeyManagementClient methods; the profile
+    is returned in the Server-Timing header of the response and summed per endpoint,
+    the totals are served at /profiling to admins. Work done outside of a request
+    (e.g. by celery tasks) is not recorded. The wrappers and listeners are installed
+    for the whole process by init_app and cost a thread-local lookup outside of a
+    profiled request; uninstall restores the original methods.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._installed = False
+        self._originals = []
+
+    def init_app(self, app):
+        if not app.config.get('PROFILING'):
+            return
+        self._install()
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+        from app.main.util.decorator import admin_token_required
+        app.add_url_rule('/profiling', 'profiling', admin_token_required(lambda: jsonify(self.stats())))
+
+    def current(self):
+        return getattr(self._local, 'profile', None)
+
+    def _install(self):
+        with self._lock:
+            if self._installed:
+                return
+            self._installed = True
+        self._listen()
+        for bucket, (cls, methods) in INSTRUMENTED.items():
+            for name in methods:
+                method = cls.__dict__[name]
+                self._originals.append((cls, name, method))
+                setattr(cls, name, self._timed(bucket, method))
+
+    def uninstall(self):
+        """ restore the methods timed by _install and remove the engine listeners """
+        with self._lock:
+            if not self._installed:
+                return
+            self._installed = False
+        self._listen(event.remove)
+        for cls, name, method in reversed(self._originals):
+            setattr(cls, name, method)
+        self._originals = []
+
+    def _listen(self, listen=event.listen):
+        """ register (or remove, with event.remove) the engine listeners """
+        listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        listen(Engine, 'commit', self._commit)
+
+    def _timed(self, bucket, method):
+        @wraps(method)
+        def timed(*args, **kwargs):
+            profile = self.current()
+            if profile is None:
+                return method(*args, **kwargs)
+            #nested calls (e.g. digest_many -> digest) are only counted once
+            profile.depth[bucket] += 1
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                profile.depth[bucket] -= 1
+                if not profile.depth[bucket]:
+                    profile.buckets[bucket] += time.perf_counter() - started
+        return timed
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self.current() is not None:
+            conn.info.setdefault('profiler_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        profile = self.current()
+        started = conn.info.get('profiler_started')
+        if profile is not None and started:
+            profile.queries += 1
+            profile.sql_time += time.perf_counter() - started.pop()
+
+    def _commit(self, conn):
+        profile = self.current()
+        if profile is not None:
+            profile.commits += 1
+
+    def _start(self):
+        self._local.profile = RequestProfile()
+
+    def _teardown(self, exc):
+        #after_request is skipped when the view raises, the profile must not leak into the next request
+        self._local.profile = None
+
+    def _finish(self, response):
+        profile = self.current()
+        self._local.profile = None
+        if profile is None:
+            return response
+        wall = time.perf_counter() - profile.started
+        response.headers['Server-Timing'] = profile.server_timing(wall)
+        self._aggregate(request.endpoint or request.path, wall, profile)
+        return response
+
+    def _aggregate(self, endpoint, wall, profile):
+        with self._lock:
+            totals = self._endpoints.setdefault(endpoint, {
+                'requests': 0, 'wall_time': 0.0, 'max_wall_time': 0.0, 'queries': 0,
+                'sql_time': 0.0, 'commits': 0, 'hash_time': 0.0, 'kms_time': 0.0
+            })
+            totals['requests'] += 1
+            totals['wall_time'] += wall
+            totals['max_wall_time'] = max(totals['max_wall_time'], wall)
+            totals['queries'] += profile.queries
+            totals['sql_time'] += profile.sql_time
+            totals['commits'] += profile.commits
+            totals['hash_time'] += profile.buckets['hash']
+            totals['kms_time'] += profile.buckets['kms']
+
+    def stats(self):
+        """
+        Get the totals per endpoint
+
+        Returns
+        -------
+        dict
+            {endpoint: totals}, times in seconds, with the averages per request
+        """
+        with self._lock:
+            stats = {}
+            for endpoint, totals in self._endpoints.items():
+                stats[endpoint] = dict(totals)
+                stats[endpoint]['avg_wall_time'] = totals['wall_time'] / totals['requests']
+                stats[endpoint]['avg_queries'] = totals['queries'] / totals['requests']
+            return stats
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
+
+profiler = Profiler()
@@ -0,0 +1,114 @@
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from functools import lru_cache
+
+from celery import signals
+from sqlalchemy import event
+
+from app.main.services import db
+
+
+logger = logging.getLogger('eonpeers.sql')
+
+SERVICE_PATH = os.path.join('app', 'main', 'service') + os.sep
+
+#bound parameter lists of any length look the same, e.g. IN (?, ?, ?) -> IN (?)
+_PARAMETER_LIST = re.compile(r'\((?:\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*,)+\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*\)')
+
+
+@lru_cache(maxsize=1024)
+def statement_shape(statement):
+    """ the statement with its parameter lists collapsed and its whitespace normalised, cached as the compiled statements repeat """
+    return _PARAMETER_LIST.sub('(?)', ' '.join(statement.split()))
+
+
+def service_origin():
+    """ 'module:function:line' of the innermost service function on the stack, None if the query is not run by a service """
+    frame = sys._getframe(1)
+    while frame is not None:
+        if SERVICE_PATH in frame.f_code.co_filename:
+            module = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]
+            return '{}:{}:{}'.format(module, frame.f_code.co_name, frame.f_lineno)
+        frame = frame.f_back
+    return None
+
+
+class SqlDiagnostics:
+    """
+    Slow query log and N+1 detector on the engine of the db, enabled by SQL_DIAGNOSTICS
+
+    queries slower than SLOW_QUERY_THRESHOLD seconds are logged with the service function
+    running them; within a request or a celery task, a statement shape (the statement with
+    its parameter lists collapsed) run more than NPLUSONE_THRESHOLD times is reported once,
+    with the function running it, as it is likely executed in a loop. The stack is only
+    walked for the queries being reported, so the mode is cheap enough for staging.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self.enabled = False
+        self.slow_threshold = 0.1
+        self.repeat_threshold = 10
+
+    def init_app(self, app):
+        if not app.config.get('SQL_DIAGNOSTICS'):
+            return
+        self.slow_threshold = app.config.get('SLOW_QUERY_THRESHOLD', 0.1)
+        self.repeat_threshold = app.config.get('NPLUSONE_THRESHOLD', 10)
+        with app.app_context():
+            self.listen(db.get_engine(app))
+        app.before_request(lambda: self.start_scope('request'))
+        app.teardown_request(lambda exc: self.end_scope())
+        self.enabled = True
+
+    def listen(self, engine, listen=event.listen):
+        """ register (or remove, with event.remove) the listeners on the engine """
+        listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def start_scope(self, name):
+        """ start counting the statement shapes of a request or a task """
+        self._local.scope = {'name': name, 'shapes': {}, 'reported': set()}
+
+    def end_scope(self):
+        self._local.scope = None
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('diagnostics_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get('diagnostics_started')
+        if not started:
+            return
+        elapsed = time.perf_counter() - started.pop()
+        if elapsed >= self.slow_threshold:
+            logger.warning("slow query %.3fs in %s: %s", elapsed, service_origin(), ' '.join(statement.split()))
+        scope = getattr(self._local, 'scope', None)
+        if scope is None:
+            return
+        shape = statement_shape(statement)
+        count = scope['shapes'].get(shape, 0) + 1
+        scope['shapes'][shape] = count
+        if count > self.repeat_threshold and shape not in scope['reported']:
+            scope['reported'].add(shape)
+            logger.warning("possible N+1 in %s: statement run %s times by %s: %s",
+                scope['name'], count, service_origin(), shape)
+
+
+sql_diagnostics = SqlDiagnostics()
+
+
+@signals.task_prerun.connect
+def start_task_scope(sender=None, task=None, **kwargs):
+    if sql_diagnostics.enabled:
+        sql_diagnostics.start_scope(task.name)
+
+
+@signals.task_postrun.connect
+def end_task_scope(sender=None, **kwargs):
+    if sql_diagnostics.enabled:
+        sql_diagnostics.end_scope()
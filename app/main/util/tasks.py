@@ -2,19 +2,33 @@ from flask import current_app
 from app.main.celery import celery
 from celery.utils.log import get_task_logger
 from app.main.services import db
-import requests, json
+import json
+import time
+from app.main.model.blacklist import BlacklistToken
 from app.main.model.company import Company
 from app.main.model.location import Location
 from app.main.model.validation import Validation
 from app.main.util.keymanagementutils import KeyManagementClient
+from app.main.util.companydirectory import company_directory
+from app.main.util.gossipclient import gossip_client
+from app.main.util.gossipengine import GossipEngine
 
 logger = get_task_logger(__name__)
 
+JSON_HEADERS = {"Content-Type":"application/json", "accept":"application/json"}
+
+def peer_url(base_url, path):
+    """ join the base_url of a peer with an endpoint path """
+    url = base_url if base_url[-1]=='/' else base_url+'/'
+    return url+path
+
 def make_gossip_call(*args):
     """ 
     Exectue the desired HTTP method on the url 
 
-    the headers are optional, the response is returned
+    calls go through the pooled gossip_client, so connections to the same peer
+    are kept alive and every call is bounded by the configured timeouts.
+    The headers are optional, the response is returned
     although it may be ignored if when calling the task
     the ignore_result is set
 
@@ -46,20 +60,20 @@ def make_gossip_call(*args):
 
     try:
         if(method=='get'):
-            return requests.get(url,headers=headers)
+            return gossip_client.request('GET', url, headers=headers)
         elif(method=='post'):
-            r = requests.post(url,data=payload,headers=headers)
+            r = gossip_client.request('POST', url, data=payload, headers=headers)
             print(r.content)
             return r
         elif(method=='put'):
-            return requests.put(url,data=payload,headers=headers)
+            return gossip_client.request('PUT', url, data=payload, headers=headers)
         else:
             return
     except Exception as general_exception:
         print(str(general_exception))
         return {'error': "An Exception occured: " + str(general_exception)}
 
-@celery.task()
+@celery.task(ignore_result=True)
 def validate_new_company(base_url, public_id):
     """ 
     GET the owner data and compare it against the local copy, if all checks out ACK, else destroy local company
@@ -102,7 +116,7 @@ def validate_new_company(base_url, public_id):
         db.session.commit()
     return
 
-@celery.task()
+@celery.task(ignore_result=True)
 def validate_remote_location(location_id, validation_id):
     """ 
     POST the validation data to the requeting company
@@ -128,39 +142,219 @@ def validate_remote_location(location_id, validation_id):
     """
 
     location = Location.query.filter_by(public_id=location_id).first()
+    requesting_company = company_directory.by_public_id(location.company_id)
+    payload = json.dumps(validation_payload(location, validation_id))
+    make_gossip_call('post', peer_url(requesting_company.base_url, 'validation/'), payload, JSON_HEADERS) 
+    #TODO: use headers and registr user when companies registers
+    return
+
+def validation_payload(location, validation_id):
+    """ the body describing a signed validation, as expected by the receiving node """
     validation = Validation.query.filter_by(public_id=validation_id).first()
-    requesting_company = Company.query.filter_by(public_id=location.company_id).first()
     kmc = KeyManagementClient()
-    payload = {
+    return {
         "location_key": location.location_key,
         "signed_location_key": validation.signed_location_key,
         "signer_public_key": kmc.get_serialized_pub_key().decode("utf-8"),
         "signer_validation_id": validation_id
     }
-    url = requesting_company.base_url if requesting_company.base_url[-1]=='/' else requesting_company.base_url+'/'
-    url+='validation/'
-    payload = json.dumps(payload) 
-    headers = {"Content-Type":"application/json", "accept":"application/json"}
-    make_gossip_call('post', url, payload, headers) 
-    #TODO: use headers and registr user when companies registers
+
+@celery.task(ignore_result=True)
+def send_validations(validation_ids):
+    """ 
+    POST many signed validations, each to the company requesting its location
+
+    same payload as validate_remote_location, but the calls are fanned out
+    by the GossipEngine so the task lasts as long as the slowest peer
+
+    Parameters
+    ----------
+    validation_ids: list
+        the local ids of the validations (signed)
+
+    """
+    validations = Validation.query.filter(Validation.public_id.in_(validation_ids)).all()
+    locations = {location.public_id: location for location in Location.query.filter(Location.public_id.in_(set(v.location_id for v in validations))).all()}
+    companies, calls = [], []
+    for validation in validations:
+        location = locations[validation.location_id]
+        company = company_directory.by_public_id(location.company_id)
+        if not company or not company.base_url:
+            continue
+        companies.append(company)
+        calls.append(('post', peer_url(company.base_url, 'validation/'), json.dumps(validation_payload(location, validation.public_id)), JSON_HEADERS))
+    for company, result in zip(companies, GossipEngine().broadcast(calls)):
+        if isinstance(result, dict):
+            logger.warning("validation not delivered to %s: %s", company.vat_number, result['error'])
     return
 
-@celery.task()
-def send_shipment(payload, next_company_id):
+def shipment_delta(payload, state):
     """
-    POST this shipment to the destination node
+    the update to send to a peer which already knows the shipment
 
+    Parameters
+    ----------
+    payload: dict
+        the full shipment payload, see prepare_shipment_payload
+    state: dict
+        the state of the shipment on the peer, see get_shipment_state
+
+    Returns
+    -------
+    dict
+        the payload of shipment/rpc/update, with only the positions the peer
+        doesn't have or has without signature; None if the peer is up to date
+    """
+    known = state.get('positions') or {}
+    positions = [position for position in payload['positions']
+        if position['hash_id'] not in known or (position.get('signed_hash') and not known[position['hash_id']])]
+    if not positions and payload.get('merkle_root') in (None, state.get('merkle_root')):
+        return None
+    return {
+        'hash_id': payload['hash_id'],
+        'current_company_vat': payload['current_company_vat'],
+        'merkle_root': payload.get('merkle_root'),
+        'positions': positions
+    }
+
+def _delivered(res):
+    return not isinstance(res, dict) and res is not None and res.status_code in (200, 201)
+
+def deliver_shipments(target_company, bodies):
+    """
+    send serialised shipments to a node, as updates or as imports when the node doesn't know them
+
+    most sends are updates of shipments the destination already knows, so the
+    positions are PUT to shipment/rpc/update first, where the peer only applies the
+    ones it lacks or has without signature; the shipments answered with 404 (unknown
+    shipment, or a peer without the update endpoint) are POSTed whole to
+    shipment/rpc/import. The calls of each step go through the GossipEngine, so
+    they run concurrently within the per-peer limit and the broadcast deadline
+
+    Returns
+    -------
+    int
+        the number of shipments the node did not accept
+    """
+    engine = GossipEngine()
+    updates = [('put', peer_url(target_company.base_url, 'shipment/rpc/update'), json.dumps(shipment_delta(json.loads(body), {})), JSON_HEADERS) for body in bodies]
+    results = engine.broadcast(updates)
+    unknown = [index for index, res in enumerate(results) if not isinstance(res, dict) and res is not None and res.status_code == 404]
+    imports = [('post', peer_url(target_company.base_url, 'shipment/rpc/import'), bodies[index], JSON_HEADERS) for index in unknown]
+    for index, res in zip(unknown, engine.broadcast(imports)):
+        results[index] = res
+    failed = 0
+    for res in results:
+        if not _delivered(res):
+            failed += 1
+            logger.warning("shipment not delivered to %s: %s", target_company.vat_number, res['error'] if isinstance(res, dict) else getattr(res, 'status_code', None))
+    return failed
+
+@celery.task(ignore_result=True)
+def send_shipment(payload, next_company_id):
+    """
+    send this shipment to the destination node, see deliver_shipments
 
+    The payload can be given already serialised (see get_shipment_payload),
+    in that case the cached bytes are imported as they are
     """  
-    try:        
-        target_company = Company.query.filter_by(public_id=next_company_id).first()
-        url = target_company.base_url if target_company.base_url[-1]=='/' else target_company.base_url+'/'
-        url+='shipment/rpc/import'
-        payload = json.dumps(payload) 
-        headers = {"Content-Type":"application/json", "accept":"application/json"}
-        make_gossip_call('post', url, payload, headers)     
-        #TODO: use authentication to post
+    target_company = company_directory.by_public_id(next_company_id)
+    if not target_company or not target_company.base_url:
+        logger.warning("shipment not sent, unknown destination %s", next_company_id)
+        return
+    deliver_shipments(target_company, [payload if isinstance(payload, str) else json.dumps(payload)])
+    #TODO: use authentication to post
+    return
+
+#{base_url: time} of the peers answering that they have no batch import, sent one by one
+#by this process for SHIPMENT_BATCH_UNSUPPORTED_TTL seconds, then asked again as they may have upgraded
+_batch_unsupported = {}
+
+def _batch_supported(base_url):
+    marked_at = _batch_unsupported.get(base_url)
+    if marked_at is None:
+        return True
+    if time.time() - marked_at >= current_app.config['SHIPMENT_BATCH_UNSUPPORTED_TTL']:
+        _batch_unsupported.pop(base_url, None)
+        return True
+    return False
+
+@celery.task(ignore_result=True)
+def send_shipment_batch(payloads, next_company_id):
+    """
+    send many shipments to the same destination node with a single request
+
+    the payloads, serialised or not, are POSTed together to shipment/rpc/import-batch.
+    The batch path is for new shipments: a peer already knowing one of them rejects
+    the whole batch, whose shipments are then sent one by one as updates, see
+    deliver_shipments. Peers without the batch endpoint get single sends too, and are
+    remembered by this process for a while
+    """
+    target_company = company_directory.by_public_id(next_company_id)
+    if not target_company or not target_company.base_url:
+        logger.warning("shipments not sent, unknown destination %s", next_company_id)
+        return
+    bodies = [payload if isinstance(payload, str) else json.dumps(payload) for payload in payloads]
+    if len(bodies) > 1 and _batch_supported(target_company.base_url):
+        body = '{"shipments":[' + ','.join(bodies) + ']}'
+        res = GossipEngine().broadcast([('post', peer_url(target_company.base_url, 'shipment/rpc/import-batch'), body, JSON_HEADERS)])[0]
+        if not isinstance(res, dict) and res is not None:
+            if res.status_code == 201:
+                return
+            if res.status_code in (404, 405):
+                _batch_unsupported[target_company.base_url] = time.time()
+    deliver_shipments(target_company, bodies)
+    return
+
+@celery.task(ignore_result=True)
+def prune_blacklist():
+    """
+    Delete the blacklisted tokens past their expiration and reload the shared blacklist index
+
+    scheduled periodically by celery beat, see make_celery
+    """
+    BlacklistToken.prune_expired()
+    return
+
+@celery.task(ignore_result=True)
+def sync_with_peer(company_id):
+    """
+    Reconcile the shipments shared with the given peer, see sync_service.reconcile_with_peer
+    """
+    from app.main.service.sync_service import reconcile_with_peer
+    try:
+        result = reconcile_with_peer(company_id)
+        logger.info("sync with %s: %s", company_id, result)
     except Exception as e:
-        print(e)
+        logger.warning("sync with %s failed: %s", company_id, e)
+    return
+
+@celery.task(ignore_result=True)
+def sync_with_all_peers():
+    """
+    Queue a reconciliation with every known peer, scheduled periodically by celery beat
+    """
+    peers = Company.query.filter(Company.is_own == False, Company.base_url != None).all()
+    for company in peers:
+        sync_with_peer.delay(company.public_id)
     return
 
+@celery.task(ignore_result=True)
+def dispatch_outbox():
+    """
+    Publish the pending messages of the outbox, scheduled periodically by celery beat
+    """
+    from app.main.service.outbox_service import dispatch_outbox as dispatch
+    published = dispatch()
+    if published:
+        logger.info("outbox messages published: %s", published)
+    return
+
+@celery.task(ignore_result=True)
+def prune_outbox():
+    """
+    Delete the outbox messages dispatched long ago, scheduled periodically by celery beat
+    """
+    from app.main.service.outbox_service import prune_outbox as prune
+    prune()
+    return
@@ -0,0 +1,96 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenCache:
+    """
+    In-process cache of the auth tokens already verified by this node
+
+    a cached token skips the JWT decode, the blacklist lookup and the user query;
+    entries are keyed by the SHA256 of the token (the token itself is never kept),
+    expire together with the token and are evicted on logout or when the user changes.
+    A logout or a user change handled by another process is not seen by this cache:
+    the caller still checks the blacklist on a hit, and entries are bounded by
+    max_age seconds (TOKEN_CACHE_MAX_AGE) so the user data is refreshed soon.
+    """
+
+    def __init__(self, maxsize=4096, max_age=300):
+        self._maxsize = maxsize
+        self._max_age = max_age
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(auth_token):
+        if isinstance(auth_token, str):
+            auth_token = auth_token.encode()
+        return hashlib.sha256(auth_token).hexdigest()
+
+    def get(self, auth_token):
+        """
+        Get the user data of a verified token
+
+        Returns
+        -------
+        dict
+            the user data cached with put, None if the token is unknown or expired
+        """
+        key = self._key(auth_token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry['exp'] > time.time():
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry['data']
+            if entry:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, auth_token, exp, data, max_age=None):
+        """
+        Store the user data of a verified token until its expiration
+
+        Parameters
+        ----------
+        auth_token: str
+            the token, as sent in the Authorization header
+        exp: int
+            the 'exp' claim of the token, a unix timestamp
+        data: dict
+            the user data to be returned on a hit, must contain 'user_id'
+        max_age: int
+            seconds the entry is kept at most, defaults to the max_age of the cache
+        """
+        key = self._key(auth_token)
+        max_age = self._max_age if max_age is None else max_age
+        with self._lock:
+            self._entries[key] = {'exp': min(exp, time.time() + max_age), 'data': data}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+    def evict(self, auth_token):
+        with self._lock:
+            self._entries.pop(self._key(auth_token), None)
+
+    def evict_user(self, user_id):
+        """ drop every token of the user, e.g. when its admin flag changes """
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry['data']['user_id'] == user_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+token_cache = TokenCache()
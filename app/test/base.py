@@ -2,6 +2,8 @@ from flask_testing import TestCase
 
 import requests
 from app.main.services import db
+from app.main.util.companydirectory import company_directory
+from app.main.util.tokencache import token_cache
 from manage import app
 
 
@@ -19,6 +21,8 @@ class BaseTestCase(TestCase):
     def tearDown(self):
         db.session.remove()
         db.drop_all()
+        company_directory.invalidate()
+        token_cache.clear()
 
     def requestNewTestBlock(self):
         url = "http://"+app.config['RPC_HOST']+":5000/block"
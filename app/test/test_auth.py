@@ -3,7 +3,9 @@ import unittest
 
 from app.main.model.blacklist import BlacklistToken
 from app.main.model.user import User
+from app.main.service.auth_helper import Auth
 from app.main.services import db
+from app.main.util.tokencache import token_cache
 from app.test.base import BaseTestCase
 
 
@@ -183,6 +185,42 @@ class TestAuthBlueprint(BaseTestCase):
                             'Token blacklisted. Please log in again.')
             self.assertEqual(response.status_code, 401)
 
+    def test_verified_token_cache(self):
+        """ Test verified tokens are cached and evicted on logout """
+        with self.client:
+            register_user(self)
+            resp_login = login_user(self)
+            auth_token = json.loads(resp_login.data.decode())['Authorization']
+            token_request = type('TokenRequest', (), {'headers': {'Authorization': auth_token}})
+            data, status = Auth.get_logged_in_user(token_request)
+            self.assertEqual(status, 200)
+            self.assertTrue(token_cache.get(auth_token)['email'] == 'joe@gmail.com')
+            response = self.client.post(
+                '/auth/logout',
+                headers=dict(Authorization='Bearer ' + auth_token)
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(token_cache.get(auth_token) is None)
+            data, status = Auth.get_logged_in_user(token_request)
+            self.assertEqual(status, 401)
+
+    def test_token_blacklisted_elsewhere(self):
+        """ Test a cached token is rejected once blacklisted by another process """
+        with self.client:
+            register_user(self)
+            resp_login = login_user(self)
+            auth_token = json.loads(resp_login.data.decode())['Authorization']
+            token_request = type('TokenRequest', (), {'headers': {'Authorization': auth_token}})
+            data, status = Auth.get_logged_in_user(token_request)
+            self.assertEqual(status, 200)
+            # the logout went through another worker, this cache still has the token
+            db.session.add(BlacklistToken(token=auth_token))
+            db.session.commit()
+            self.assertTrue(token_cache.get(auth_token) is not None)
+            data, status = Auth.get_logged_in_user(token_request)
+            self.assertEqual(status, 401)
+            self.assertTrue(token_cache.get(auth_token) is None)
+
     def test_unathorised_access(self):
         #TODO when there are protected resources
         return
@@ -0,0 +1,124 @@
+import datetime
+import unittest
+from unittest import mock
+
+import redis
+
+from app.main.services import db
+from app.main.model.blacklist import BlacklistToken
+from app.main.util.blacklistindex import blacklist_index
+from app.test.base import BaseTestCase
+
+
+class FakeRedis:
+    """ the few redis commands used by the index, failing while down """
+
+    def __init__(self):
+        self.values = {}
+        self.down = False
+
+    def _check(self):
+        if self.down:
+            raise redis.ConnectionError('redis is down')
+
+    def set(self, name, value, ex=None):
+        self._check()
+        self.values[name] = value
+
+    def delete(self, name):
+        self.values.pop(name, None)
+
+    def mget(self, *names):
+        self._check()
+        return [self.values.get(name) for name in names]
+
+
+class TestBlacklistIndex(BaseTestCase):
+
+    DEBUG = False
+
+    def setUp(self):
+        super().setUp()
+        self.redis = FakeRedis()
+        self.patch = mock.patch.object(blacklist_index, '_get_client', return_value=self.redis)
+        self.patch.start()
+        blacklist_index._local.clear()
+
+    def tearDown(self):
+        self.patch.stop()
+        blacklist_index._local.clear()
+        super().tearDown()
+
+    def test_answers_once_loaded(self):
+        token_hash = blacklist_index.hash_token('a-token')
+        self.assertTrue(blacklist_index.contains(token_hash) is None)
+
+        blacklist_index.load([(token_hash, None)])
+        blacklist_index._local.clear()
+        self.assertTrue(blacklist_index.contains(token_hash) is True)
+        self.assertTrue(blacklist_index.contains(blacklist_index.hash_token('another-token')) is False)
+
+    def test_failed_write_drops_the_loaded_marker(self):
+        blacklist_index.load([])
+        self.redis.down = True
+        token_hash = blacklist_index.hash_token('a-token')
+        self.assertFalse(blacklist_index.add(token_hash))
+        self.assertTrue('eonpeers:blacklist:loaded' not in self.redis.values)
+
+        #the other workers don't know the token, they must ask the db
+        self.redis.down = False
+        blacklist_index._local.clear()
+        self.assertTrue(blacklist_index.contains(token_hash) is None)
+
+    def test_indexed_on_commit_only(self):
+        blacklist_index.load([])
+        expires_on = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+
+        db.session.add(BlacklistToken(token='rolled-back', expires_on=expires_on))
+        db.session.flush()
+        db.session.rollback()
+        self.assertTrue(blacklist_index.contains(blacklist_index.hash_token('rolled-back')) is False)
+
+        db.session.add(BlacklistToken(token='committed', expires_on=expires_on))
+        db.session.flush()
+        self.assertTrue(blacklist_index.contains(blacklist_index.hash_token('committed')) is False)
+        db.session.commit()
+        self.assertTrue(blacklist_index.contains(blacklist_index.hash_token('committed')) is True)
+        self.assertTrue(BlacklistToken.check_blacklist('committed'))
+
+    def test_prune_and_reload(self):
+        now = datetime.datetime.utcnow()
+        db.session.add(BlacklistToken(token='expired', expires_on=now - datetime.timedelta(hours=1)))
+        db.session.add(BlacklistToken(token='revoked', expires_on=now + datetime.timedelta(hours=1)))
+        db.session.commit()
+        self.redis.values.clear()
+        blacklist_index._local.clear()
+
+        BlacklistToken.prune_expired()
+        self.assertTrue(BlacklistToken.query.count() == 1)
+        self.assertTrue('eonpeers:blacklist:loaded' in self.redis.values)
+        self.assertTrue(blacklist_index.contains(blacklist_index.hash_token('revoked')) is True)
+        self.assertTrue(blacklist_index.contains(blacklist_index.hash_token('expired')) is False)
+
+    def test_legacy_token_without_digest(self):
+        db.session.add(BlacklistToken(token='legacy'))
+        db.session.commit()
+        #blacklisted before the digests were stored
+        db.session.execute(BlacklistToken.__table__.update().values(token_hash=None))
+        db.session.commit()
+        self.redis.values.clear()
+        blacklist_index._local.clear()
+
+        BlacklistToken.prune_expired()
+        self.assertTrue('eonpeers:blacklist:loaded' not in self.redis.values)
+        self.assertTrue(blacklist_index.contains(blacklist_index.hash_token('legacy')) is None)
+        self.assertTrue(BlacklistToken.check_blacklist('legacy'))
+
+        self.assertTrue(BlacklistToken.backfill_token_hashes() == 1)
+        self.assertTrue('eonpeers:blacklist:loaded' in self.redis.values)
+        blacklist_index._local.clear()
+        self.assertTrue(blacklist_index.contains(blacklist_index.hash_token('legacy')) is True)
+
+
+if __name__ == '__main__':
+    unittest.main()
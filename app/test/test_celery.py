@@ -0,0 +1,78 @@
+import unittest
+from unittest import mock
+
+from app.main import celery as celery_module
+from app.main.celery import celery, queue_concurrency, DEFAULT_QUEUE
+from app.main.model.blacklist import BlacklistToken
+from app.test.base import BaseTestCase
+
+
+class TestCeleryQueues(BaseTestCase):
+
+    DEBUG = False
+
+    def setUp(self):
+        super().setUp()
+        #the worker reads the concurrency of the queues from the config of EONFLASK_ENV
+        self.patches = [
+            mock.patch.dict('os.environ', {'EONFLASK_ENV': 'dev'}),
+            mock.patch.object(celery_module.config_by_name['dev'], 'CELERY_QUEUE_CONCURRENCY', {'gossip': 6, 'signing': 3, DEFAULT_QUEUE: 1}, create=True)
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        super().tearDown()
+
+    def queue(self, task_name):
+        return celery.amqp.router.route({}, task_name)['queue'].name
+
+    def test_routes(self):
+        for task_name in ('send_shipment', 'send_shipment_batch', 'sync_with_peer'):
+            self.assertTrue(self.queue('app.main.util.tasks.' + task_name)=='gossip')
+        self.assertTrue(self.queue('app.main.util.tasks.validate_new_company')=='verification')
+        for task_name in ('validate_remote_location', 'send_validations'):
+            self.assertTrue(self.queue('app.main.util.tasks.' + task_name)=='signing')
+        self.assertTrue(self.queue('app.main.util.tasks.dispatch_outbox')==DEFAULT_QUEUE)
+
+    def test_no_result_backend(self):
+        self.assertTrue(celery.conf.result_backend is None)
+
+    def test_queue_concurrency(self):
+        self.assertTrue(queue_concurrency(['gossip'])==6)
+        self.assertTrue(queue_concurrency(['gossip', 'signing'])==9)
+        #queues missing in the config get one process
+        self.assertTrue(queue_concurrency(['gossip', 'verification'])==7)
+
+    def run_worker(self, args):
+        import manage
+        worker_app = mock.Mock()
+        worker_app.Worker.return_value.exitcode = 0
+        with mock.patch.object(celery_module, 'make_celery', return_value=worker_app), \
+                mock.patch.object(BlacklistToken, 'load_index') as load_index:
+            manage.manager.handle('manage.py', ['celery'] + args)
+        return worker_app.Worker.call_args[1], load_index
+
+    def test_worker_options(self):
+        options, load_index = self.run_worker(['-q', 'gossip,signing'])
+        self.assertTrue(options['queues']==['gossip', 'signing'])
+        self.assertTrue(options['concurrency']==9)
+        #beat and the blacklist index stay with the worker of the default queue
+        self.assertFalse(options['beat'])
+        self.assertFalse(load_index.called)
+
+        options, load_index = self.run_worker(['-q', DEFAULT_QUEUE, '-c', '2'])
+        self.assertTrue(options['queues']==[DEFAULT_QUEUE])
+        self.assertTrue(options['concurrency']==2)
+        self.assertTrue(options['beat'])
+        self.assertTrue(load_index.called)
+
+        options, load_index = self.run_worker([])
+        self.assertTrue(options['queues']==sorted(['gossip', 'verification', 'signing', DEFAULT_QUEUE]))
+        self.assertTrue(options['concurrency']==6 + 1 + 3 + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
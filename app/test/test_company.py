@@ -1,12 +1,27 @@
 import datetime
 import unittest
+from unittest import mock
 
 from app.main.services import db
 from app.main.model.company import Company
 from app.main.service.company_service import (get_locations_of_a_company, save_new_company, generate_creation_ok_message, get_a_company, get_node_owner, )
+from app.main.util.companydirectory import company_directory
 from app.test.base import BaseTestCase
 
 
+class VersionRedis:
+    """ the version key of the company directory, shared by the workers """
+
+    def __init__(self):
+        self.version = 0
+
+    def get(self, name):
+        return str(self.version).encode()
+
+    def incr(self, name):
+        self.version += 1
+
+
 class TestUserModel(BaseTestCase):
 
     DEBUG = False
@@ -27,5 +42,44 @@ class TestUserModel(BaseTestCase):
 
     	self.assertTrue(company.name == data["name"])
 
+    def test_company_directory(self):
+    	data = {
+    		"name":"test_company",
+    		"vat_number":"12345678",
+    		"base_url":"http://localhost:5400",
+    		"public_key":"123456787"
+    	}
+
+    	res = save_new_company(data)
+    	public_id = res[0]["public_id"]
+    	self.assertTrue(company_directory.by_vat("12345678").public_id == public_id)
+    	self.assertTrue(company_directory.by_public_key("123456787").public_id == public_id)
+
+    	#writes through the model are seen at once
+    	company = Company.query.filter_by(public_id=public_id).first()
+    	company.vat_number = "87654321"
+    	db.session.commit()
+    	self.assertTrue(company_directory.by_vat("87654321").public_id == public_id)
+    	self.assertTrue(company_directory.by_vat("12345678") is None)
+
+    def test_company_directory_other_workers(self):
+    	shared = VersionRedis()
+    	with mock.patch.object(company_directory, '_get_client', return_value=shared):
+    		res = save_new_company({"name":"test_company", "vat_number":"12345678", "base_url":"http://localhost:5400"})
+    		self.assertTrue(shared.version == 1)
+    		public_id = res[0]["public_id"]
+    		self.assertTrue(company_directory.by_vat("12345678").public_id == public_id)
+
+    		#another worker renamed the company: the row changed without the listeners of this process
+    		db.session.execute(Company.__table__.update().where(Company.public_id == public_id).values(name="renamed"))
+    		db.session.commit()
+    		self.app.config['COMPANY_DIRECTORY_VERSION_CHECK'] = 0
+    		try:
+    			self.assertTrue(company_directory.by_vat("12345678").name == "test_company")
+    			shared.incr('version')
+    			self.assertTrue(company_directory.by_vat("12345678").name == "renamed")
+    		finally:
+    			self.app.config['COMPANY_DIRECTORY_VERSION_CHECK'] = 1
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+from app.main.util.gossipclient import GossipClient
+from app.test.base import BaseTestCase
+
+
+class TestGossipClient(BaseTestCase):
+
+    DEBUG = False
+
+    def test_session_reused_per_peer(self):
+        client = GossipClient()
+        session = client.get_session('http://peer-a:5000/shipment/rpc/import')
+        self.assertTrue(client.get_session('http://peer-a:5000/company/node-owner') is session)
+        self.assertTrue(client.get_session('http://peer-a:5001/company/node-owner') is not session)
+        self.assertTrue(client.stats() == {'hits': 1, 'misses': 2, 'peers': 2})
+
+    def test_least_recently_used_peer_evicted(self):
+        client = GossipClient()
+        max_peers = self.app.config['GOSSIP_MAX_PEERS']
+        self.app.config['GOSSIP_MAX_PEERS'] = 2
+        try:
+            peer_a = client.get_session('http://peer-a/')
+            client.get_session('http://peer-b/')
+            client.get_session('http://peer-a/')
+            client.get_session('http://peer-c/')
+        finally:
+            self.app.config['GOSSIP_MAX_PEERS'] = max_peers
+        self.assertTrue(list(client._sessions) == ['http://peer-a', 'http://peer-c'])
+        self.assertTrue(client.get_session('http://peer-a/') is peer_a)
+
+    def test_pool_rebuilt_after_fork(self):
+        client = GossipClient()
+        session = client.get_session('http://peer-a/')
+        #the pool was created by the parent process
+        client._pid = -1
+        self.assertTrue(client.get_session('http://peer-a/') is not session)
+        self.assertTrue(client.stats()['peers'] == 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
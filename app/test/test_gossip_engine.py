@@ -0,0 +1,54 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from app.main.util.gossipclient import gossip_client
+from app.main.util.gossipengine import GossipEngine
+from app.test.base import BaseTestCase
+
+
+class TestGossipEngine(BaseTestCase):
+
+    DEBUG = False
+
+    def test_broadcast_results_in_order(self):
+        def request(method, url, **kwargs):
+            if 'broken' in url:
+                raise ValueError('refused')
+            return url
+
+        with mock.patch.object(gossip_client, 'request', side_effect=request):
+            results = GossipEngine().broadcast([('get', 'http://a.peer/x'), ('post', 'http://broken.peer/x', '{}'), ('put', 'http://b.peer/x')])
+        self.assertTrue(results[0] == 'http://a.peer/x' and results[2] == 'http://b.peer/x')
+        self.assertTrue(results[1] == {'error': 'An Exception occured: refused'})
+        self.assertTrue(GossipEngine().broadcast([]) == [])
+
+    def test_deadline_cancels_the_calls_not_started(self):
+        release = threading.Event()
+        started = []
+
+        def request(method, url, **kwargs):
+            started.append(url)
+            if 'slow' in url:
+                release.wait(5)
+            return url
+
+        #one call at a time per peer: the second call to the slow peer is still queued at the deadline
+        self.app.config['GOSSIP_PER_PEER_CONCURRENCY'] = 1
+        try:
+            with mock.patch.object(gossip_client, 'request', side_effect=request):
+                begin = time.time()
+                results = GossipEngine().broadcast([('get', 'http://slow.peer/1'), ('get', 'http://slow.peer/2'), ('get', 'http://fast.peer/1')], deadline=0.2)
+                self.assertTrue(time.time() - begin < 2)
+                release.set()
+                time.sleep(0.1)
+        finally:
+            self.app.config['GOSSIP_PER_PEER_CONCURRENCY'] = 4
+        self.assertTrue(results[0] == results[1] == {'error': 'Deadline exceeded'})
+        self.assertTrue(results[2] == 'http://fast.peer/1')
+        self.assertTrue('http://slow.peer/2' not in started)
+
+
+if __name__ == '__main__':
+    unittest.main()
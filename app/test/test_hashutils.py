@@ -0,0 +1,61 @@
+import unittest
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, hmac
+
+from app.main.util.hashutils import HashUtils, _derive_hmac_key
+from app.test.base import BaseTestCase
+
+
+MESSAGES = ['', 'position 1', 'è unicode', b'\x00\x01 bytes', 'x' * 10000]
+
+
+def reference_digest(message):
+    """ SHA256 through a cryptography context, as the digests used to be computed """
+    if isinstance(message, str):
+        message = message.encode()
+    digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
+    digest.update(message)
+    return digest.finalize()
+
+
+def reference_hmac(message, key):
+    if isinstance(message, str):
+        message = message.encode()
+    h = hmac.HMAC(reference_digest(key), hashes.SHA256(), backend=default_backend())
+    h.update(message)
+    return h.finalize()
+
+
+class TestHashUtils(BaseTestCase):
+
+    DEBUG = False
+
+    def test_digest_many_matches_digest(self):
+        hu = HashUtils()
+        digests = hu.digest_many(MESSAGES)
+        self.assertTrue(digests == [hu.digest(message) for message in MESSAGES])
+        self.assertTrue(digests == [reference_digest(message) for message in MESSAGES])
+        self.assertTrue(hu.digest_many(iter(MESSAGES)) == digests)
+        self.assertTrue(hu.digest_many([]) == [])
+        with self.assertRaises(Exception):
+            hu.digest_many(['ok', 42])
+
+    def test_hmac_many_matches_hmac(self):
+        hu = HashUtils()
+        for key in ('location-key', b'location-key', 'another key'):
+            hmacs = hu.hmac_many(MESSAGES, key)
+            self.assertTrue(hmacs == [hu.hmac(message, key) for message in MESSAGES])
+            self.assertTrue(hmacs == [reference_hmac(message, key) for message in MESSAGES])
+        self.assertTrue(hu.hmac_many(MESSAGES, 'location-key') != hu.hmac_many(MESSAGES, 'another key'))
+
+    def test_derived_hmac_key(self):
+        _derive_hmac_key.cache_clear()
+        key = _derive_hmac_key(b'location-key')
+        self.assertTrue(key == reference_digest(b'location-key') and len(key) == 32)
+        self.assertTrue(_derive_hmac_key(b'location-key') is key)
+        self.assertTrue(_derive_hmac_key.cache_info().hits == 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import datetime
+import unittest
+import uuid
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from app.main.services import db
+from app.main.model.company import Company
+from app.main.util.hashutils import HashUtils
+from app.main.util.companydirectory import company_directory
+from app.main.util.keymanagementclientfactory import PublicKeyCache, public_key_cache, public_key_fingerprint
+from app.main.util.keymanagementutils import KeyManagementClient
+from app.test.base import BaseTestCase
+
+
+def peer_key():
+    """ a key pair of another node: the private key and its PEM public key """
+    private_key = ec.generate_private_key(ec.SECP384R1(), default_backend())
+    serialized_public = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode('utf-8')
+    return private_key, serialized_public
+
+
+class TestKeyManagement(BaseTestCase):
+
+    DEBUG = False
+
+    def test_verify_many_two_keys(self):
+        hu = HashUtils()
+        kmc = KeyManagementClient()
+        node_public = kmc.get_serialized_pub_key().decode('utf-8')
+        peer_private, peer_public = peer_key()
+        messages = [hu.digest('position {}'.format(i)) for i in range(4)]
+        node_signatures = [signed['signed'] for signed in kmc.sign_many(messages)]
+        peer_signatures = [peer_private.sign(message, ec.ECDSA(hashes.SHA256())) for message in messages]
+
+        items = [
+            (node_signatures[0], messages[0], node_public),
+            (peer_signatures[1], messages[1], peer_public),
+            #signed by the peer, checked against the node key
+            (peer_signatures[2], messages[2], node_public),
+            #signature of another message
+            (node_signatures[0], messages[3], node_public),
+            (peer_signatures[3], messages[3], peer_public),
+            (b'not a signature', messages[1], peer_public)
+        ]
+        self.assertTrue(kmc.verify_many(items) == [True, True, False, False, True, False])
+        self.assertTrue(kmc.verify_many(items) == [kmc.verify_signed_message(*item) for item in items])
+
+    def test_public_key_cache_hits(self):
+        cache = PublicKeyCache(maxsize=1)
+        _private, first_public = peer_key()
+        _private, second_public = peer_key()
+        loaded = cache.get(first_public)
+        self.assertTrue(cache.get(first_public.encode()) is loaded)
+        self.assertTrue(cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1)
+
+        #the least recently used key makes room for the new one
+        cache.get(second_public)
+        self.assertTrue(cache.stats()['size'] == 1)
+        self.assertTrue(cache.get(first_public) is not loaded)
+
+        with self.assertRaises(ValueError):
+            cache.get('not a pem')
+        self.assertTrue(cache.stats()['size'] == 1)
+
+    def test_public_key_cache_invalidated_by_company(self):
+        _private, old_public = peer_key()
+        _private, new_public = peer_key()
+        company = Company(public_id=str(uuid.uuid4()), name='peer', vat_number='IT0009',
+            created_on=datetime.datetime.utcnow(), is_own=False, base_url='http://localhost:5400', public_key=old_public)
+        db.session.add(company)
+        db.session.commit()
+
+        public_key_cache.get(old_public)
+        self.assertTrue(PublicKeyCache.fingerprint(old_public) in public_key_cache._keys)
+        company.public_key = new_public
+        db.session.commit()
+        self.assertTrue(PublicKeyCache.fingerprint(old_public) not in public_key_cache._keys)
+
+        public_key_cache.get(new_public)
+        db.session.delete(company)
+        db.session.commit()
+        self.assertTrue(PublicKeyCache.fingerprint(new_public) not in public_key_cache._keys)
+
+    def test_fingerprint_ignores_the_pem_layout(self):
+        _private, serialized_public = peer_key()
+        fingerprint = public_key_fingerprint(serialized_public)
+        layouts = [
+            serialized_public.encode(),
+            serialized_public.replace('\n', '\r\n'),
+            serialized_public.rstrip('\n'),
+            serialized_public + '\n\n'
+        ]
+        for layout in layouts:
+            self.assertTrue(public_key_fingerprint(layout) == fingerprint)
+        _private, other_public = peer_key()
+        self.assertTrue(public_key_fingerprint(other_public) != fingerprint)
+
+    def test_company_found_by_fingerprint(self):
+        _private, serialized_public = peer_key()
+        company = Company(public_id=str(uuid.uuid4()), name='peer', vat_number='IT0009',
+            created_on=datetime.datetime.utcnow(), is_own=False, base_url='http://localhost:5400', public_key=serialized_public)
+        db.session.add(company)
+        db.session.commit()
+        self.assertTrue(company.public_key_fingerprint == public_key_fingerprint(serialized_public))
+        self.assertTrue(company_directory.by_public_key(serialized_public.replace('\n', '\r\n')).public_id == company.public_id)
+
+        #stored by another worker: the directory does not know it, the column does
+        _private, other_public = peer_key()
+        db.session.execute(Company.__table__.insert().values(public_id=str(uuid.uuid4()), name='other', vat_number='IT0010',
+            created_on=datetime.datetime.utcnow(), is_own=False, base_url='http://localhost:5401',
+            public_key=other_public, public_key_fingerprint=public_key_fingerprint(other_public)))
+        db.session.commit()
+        loads = company_directory.stats()['loads']
+        self.assertTrue(company_directory.by_public_key(other_public).vat_number == 'IT0010')
+        self.assertTrue(company_directory.stats()['loads'] == loads + 1)
+
+        #an unknown key costs one query, not a reload
+        _private, unknown_public = peer_key()
+        self.assertTrue(company_directory.by_public_key(unknown_public) is None)
+        self.assertTrue(company_directory.stats()['loads'] == loads + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+
+from app.main.util.eonerror import EonError
+from app.main.util.hashutils import HashUtils
+from app.main.util.merkle import merkle_root, merkle_proof, verify_merkle_proof
+from app.test.base import BaseTestCase
+
+
+def leaves_of(size):
+    hu = HashUtils()
+    return [hu.digest('position {}'.format(i)).hex() for i in range(size)]
+
+
+class TestMerkle(BaseTestCase):
+
+    DEBUG = False
+
+    def test_every_leaf_has_a_valid_proof(self):
+        for size in range(1, 10):
+            leaves = leaves_of(size)
+            root = merkle_root(leaves)
+            for index, leaf in enumerate(leaves):
+                self.assertTrue(verify_merkle_proof(leaf, merkle_proof(leaves, index), root))
+
+    def test_proof_is_logarithmic(self):
+        leaves = leaves_of(1000)
+        self.assertTrue(len(merkle_proof(leaves, 500)) <= 10)
+
+    def test_tampered_leaf_or_order_is_rejected(self):
+        leaves = leaves_of(5)
+        root = merkle_root(leaves)
+        proof = merkle_proof(leaves, 2)
+        self.assertFalse(verify_merkle_proof(leaves[3], proof, root))
+        self.assertTrue(merkle_root(list(reversed(leaves))) != root)
+
+    def test_empty_shipment_has_no_root(self):
+        self.assertTrue(merkle_root([]) is None)
+
+    def test_invalid_hex_is_rejected(self):
+        leaves = leaves_of(3) + ['not-hex']
+        with self.assertRaises(EonError) as ctx:
+            merkle_root(leaves)
+        self.assertTrue(ctx.exception.code==400)
+        self.assertFalse(verify_merkle_proof('not-hex', [], merkle_root(leaves_of(1))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from app.main.util.metrics import MetricsRegistry
+from app.test.base import BaseTestCase
+
+
+class TestMetrics(BaseTestCase):
+
+    DEBUG = False
+
+    def test_render(self):
+        registry = MetricsRegistry()
+        calls = registry.counter('calls_total', 'calls', ('peer',))
+        latency = registry.histogram('latency_seconds', 'latency', ('endpoint',), buckets=(0.1, 1.0))
+        calls.inc('a')
+        calls.inc('a', amount=2)
+        latency.observe(0.05, 'shipment')
+        latency.observe(5, 'shipment')
+
+        text = registry.render()
+        self.assertTrue('calls_total{peer="a"} 3' in text)
+        self.assertTrue('latency_seconds_bucket{endpoint="shipment",le="0.1"} 1' in text)
+        self.assertTrue('latency_seconds_bucket{endpoint="shipment",le="1.0"} 1' in text)
+        self.assertTrue('latency_seconds_bucket{endpoint="shipment",le="+Inf"} 2' in text)
+        self.assertTrue('latency_seconds_count{endpoint="shipment"} 2' in text)
+
+    def test_processes_are_summed(self):
+        directory = tempfile.mkdtemp()
+        registry = MetricsRegistry()
+        calls = registry.counter('calls_total', 'calls', ('peer',))
+        registry.configure(directory)
+        calls.inc('a')
+        registry.flush()
+        #another process of the node dumped its values too
+        with open(directory + '/metrics-{}.json'.format(os.getppid()), 'w') as f:
+            f.write('{"calls_total": [[["a"], 4]]}')
+
+        self.assertTrue('calls_total{peer="a"} 5' in registry.render())
+
+    def test_files_of_ended_processes_are_removed(self):
+        directory = tempfile.mkdtemp()
+        registry = MetricsRegistry()
+        calls = registry.counter('calls_total', 'calls', ('peer',))
+        registry.configure(directory)
+        calls.inc('a')
+        ended = subprocess.Popen([sys.executable, '-c', ''])
+        ended.wait()
+        path = directory + '/metrics-{}.json'.format(ended.pid)
+        with open(path, 'w') as f:
+            f.write('{"calls_total": [[["a"], 4]]}')
+
+        self.assertTrue('calls_total{peer="a"} 1' in registry.render())
+        self.assertFalse(os.path.exists(path))
+
+        registry._remove_dump()
+        self.assertTrue(os.listdir(directory) == [])
+
+
+if __name__ == '__main__':
+    unittest.main()
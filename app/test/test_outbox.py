@@ -0,0 +1,106 @@
+import datetime
+import time
+import unittest
+from unittest import mock
+
+from app.main.celery import celery
+from app.main.services import db
+from app.main.model.outbox import OutboxMessage
+from app.main.service.outbox_service import enqueue, _coalesce, dispatch_outbox, prune_outbox, parked_messages, count_parked, requeue_parked
+from app.main.util.tasks import send_shipment, send_shipment_batch, _batch_supported, _batch_unsupported
+from app.test.base import BaseTestCase
+
+
+class TestOutbox(BaseTestCase):
+
+    DEBUG = False
+
+    def test_enqueue_follows_the_transaction(self):
+        enqueue(send_shipment, '{"hash_id": "aa"}', 'company-id')
+        db.session.rollback()
+        self.assertTrue(OutboxMessage.query.count()==0)
+
+        enqueue(send_shipment, '{"hash_id": "aa"}', 'company-id')
+        db.session.commit()
+        message = OutboxMessage.query.first()
+        self.assertTrue(message.task == send_shipment.name)
+        self.assertTrue(message.task_args == ['{"hash_id": "aa"}', 'company-id'])
+        self.assertTrue(message.dispatched_on is None)
+
+    def test_shipments_coalesced_per_destination(self):
+        now = datetime.datetime.utcnow()
+        messages = [OutboxMessage(send_shipment.name, ['{{"n": {}}}'.format(i), 'full-peer']) for i in range(3)]
+        messages += [OutboxMessage(send_shipment.name, ['{"n": 9}', 'quiet-peer'])]
+
+        publish, held = _coalesce(messages, now, 2, 3)
+        self.assertTrue(len(publish)==1)
+        self.assertTrue(publish[0][0] == send_shipment_batch.name)
+        self.assertTrue(publish[0][1] == [['{"n": 0}', '{"n": 1}', '{"n": 2}'], 'full-peer'])
+        self.assertTrue(held == messages[3:])
+
+        #once the window is over the lone shipment goes as a single send
+        publish, held = _coalesce(messages[3:], now + datetime.timedelta(seconds=3), 2, 3)
+        self.assertTrue(publish[0][0] == send_shipment.name and not held)
+
+    def test_failing_message_is_parked(self):
+        enqueue(send_shipment, '{"hash_id": "aa"}', 'company-id')
+        enqueue(send_shipment_batch, ['{"hash_id": "bb"}'], 'company-id')
+        db.session.commit()
+        self.app.config['SHIPMENT_BATCH_WINDOW'] = 0
+
+        def send_task(name, args=None, producer=None):
+            if name == send_shipment.name:
+                raise ValueError('not serialisable')
+
+        max_attempts = self.app.config['OUTBOX_MAX_ATTEMPTS']
+        try:
+            with mock.patch.object(celery, 'producer_or_acquire'), mock.patch.object(celery, 'send_task', side_effect=send_task):
+                self.assertTrue(dispatch_outbox()==1)
+                for _attempt in range(max_attempts):
+                    self.assertTrue(dispatch_outbox()==0)
+        finally:
+            self.app.config['SHIPMENT_BATCH_WINDOW'] = 2
+        parked = OutboxMessage.query.filter_by(task=send_shipment.name).first()
+        self.assertTrue(parked.attempts==max_attempts and parked.dispatched_on is None)
+
+    def test_parked_messages(self):
+        max_attempts = self.app.config['OUTBOX_MAX_ATTEMPTS']
+        retention = self.app.config['OUTBOX_PARKED_RETENTION']
+        old = enqueue(send_shipment, '{"hash_id": "aa"}', 'company-id')
+        recent = enqueue(send_shipment, '{"hash_id": "bb"}', 'company-id')
+        batch = enqueue(send_shipment_batch, ['{"hash_id": "cc"}'], 'company-id')
+        pending = enqueue(send_shipment, '{"hash_id": "dd"}', 'company-id')
+        for message in (old, recent, batch):
+            message.attempts = max_attempts
+        pending.attempts = max_attempts - 1
+        old.created_on = datetime.datetime.utcnow() - datetime.timedelta(seconds=retention + 1)
+        db.session.commit()
+
+        self.assertTrue([message.id for message in parked_messages()]==[old.id, recent.id, batch.id])
+        self.assertTrue(count_parked()=={send_shipment.name: 2, send_shipment_batch.name: 1})
+
+        prune_outbox()
+        self.assertTrue(OutboxMessage.query.get(old.id) is None)
+        self.assertTrue(OutboxMessage.query.count()==3)
+
+        self.assertTrue(requeue_parked([batch.id])==1)
+        self.assertTrue(count_parked()=={send_shipment.name: 1})
+        self.assertTrue(requeue_parked()==1)
+        self.assertTrue(count_parked()=={})
+        self.assertTrue(OutboxMessage.query.get(recent.id).attempts==0)
+
+    def test_batch_unsupported_expires(self):
+        ttl = self.app.config['SHIPMENT_BATCH_UNSUPPORTED_TTL']
+        _batch_unsupported['http://old.peer/'] = time.time()
+        _batch_unsupported['http://upgraded.peer/'] = time.time() - ttl - 1
+        try:
+            self.assertFalse(_batch_supported('http://old.peer/'))
+            self.assertTrue(_batch_supported('http://upgraded.peer/'))
+            self.assertTrue('http://upgraded.peer/' not in _batch_unsupported)
+            self.assertTrue(_batch_supported('http://new.peer/'))
+        finally:
+            _batch_unsupported.clear()
+
+
+if __name__ == '__main__':
+    unittest.main()
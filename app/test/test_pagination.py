@@ -0,0 +1,113 @@
+import datetime
+import json
+import unittest
+import uuid
+
+from app.main.services import db
+from app.main.model.company import Company
+from app.main.model.position import Position
+from app.main.model.shipment import Shipment
+from app.main.service.position_service import filter_positions
+from app.main.util.pagination import keyset_batches
+from app.test.base import BaseTestCase
+
+
+SAME_DAY = datetime.datetime(2020, 5, 1, 10, 0)
+NEXT_DAY = datetime.datetime(2020, 5, 2, 10, 0)
+
+
+class TestPagination(BaseTestCase):
+
+    DEBUG = False
+
+    def setUp(self):
+        super().setUp()
+        self.companies = []
+        self.shipments = []
+        for index in range(2):
+            company = Company(public_id=str(uuid.uuid4()), name="company {}".format(index), vat_number="IT000{}".format(index),
+                created_on=SAME_DAY, is_own=index == 0, base_url='http://localhost:5400')
+            shipment = Shipment(public_id=str(uuid.uuid4()), hash_id=uuid.uuid4().hex*2, name="shipment {}".format(index),
+                created_on=SAME_DAY, shipment_date=SAME_DAY, origin="Milano", destination="Rotterdam", current_company_id=company.public_id)
+            db.session.add_all([company, shipment])
+            self.companies.append(company.public_id)
+            self.shipments.append(shipment.public_id)
+        #most positions share the creation date, the cursor must not skip or repeat them
+        self.positions = []
+        for index in range(7):
+            position = Position(public_id=str(uuid.uuid4()), hash_id=uuid.uuid4().hex*2,
+                created_on=SAME_DAY if index < 5 else NEXT_DAY, company_id=self.companies[index % 2],
+                shipment_id=self.shipments[index % 2], position=index+1, role=1)
+            db.session.add(position)
+            self.positions.append(position)
+        db.session.commit()
+        self.positions = [position.public_id for position in self.positions]
+
+    def pages(self, query):
+        """ follow the X-Next-Cursor headers, returns the ids of every page """
+        pages = []
+        url = '/position/?' + query
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([position['public_id'] for position in json.loads(response.data.decode())])
+            cursor = response.headers.get('X-Next-Cursor')
+            url = '/position/?{}&cursor={}'.format(query, cursor) if cursor else None
+        return pages
+
+    def test_cursor_round_trip(self):
+        pages = self.pages('limit=3')
+        self.assertTrue([len(page) for page in pages] == [3, 3, 1])
+        self.assertTrue(sum(pages, []) == self.positions)
+
+        #an exact multiple of the page size has no empty last page
+        pages = self.pages('limit=7')
+        self.assertTrue(len(pages) == 1 and pages[0] == self.positions)
+
+    def test_ties_on_the_creation_date(self):
+        pages = self.pages('limit=2&date_to=2020-05-01T23:59:59')
+        ids = sum(pages, [])
+        self.assertTrue(ids == self.positions[:5])
+        self.assertTrue(len(set(ids)) == len(ids))
+
+    def test_filters(self):
+        ids = sum(self.pages('limit=2&company_id=' + self.companies[1]), [])
+        self.assertTrue(ids == self.positions[1::2])
+        ids = sum(self.pages('limit=2&shipment_id=' + self.shipments[0]), [])
+        self.assertTrue(ids == self.positions[0::2])
+        ids = sum(self.pages('limit=1&date_from=2020-05-02T00:00:00'), [])
+        self.assertTrue(ids == self.positions[5:])
+        self.assertTrue(self.pages('limit=2&company_id=unknown') == [[]])
+
+    def export(self, query=''):
+        response = self.client.get('/position/rpc/export?' + query)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.mimetype == 'application/x-ndjson')
+        body = response.data.decode()
+        self.assertTrue(body == '' or body.endswith('\n'))
+        return [json.loads(line) for line in body.split('\n')[:-1]]
+
+    def test_export_framing(self):
+        lines = self.export()
+        self.assertTrue([line['public_id'] for line in lines] == self.positions)
+        cursors = [line['cursor'] for line in lines]
+        self.assertTrue(cursors == sorted(cursors) and len(set(cursors)) == len(cursors))
+        self.assertTrue(self.export('company_id=unknown') == [])
+
+    def test_export_resumes_from_cursor(self):
+        lines = self.export()
+        resumed = self.export('cursor={}'.format(lines[2]['cursor']))
+        self.assertTrue([line['public_id'] for line in resumed] == self.positions[3:])
+        resumed = self.export('shipment_id={}&cursor={}'.format(self.shipments[0], lines[2]['cursor']))
+        self.assertTrue([line['public_id'] for line in resumed] == self.positions[4::2])
+        self.assertTrue(self.export('cursor={}'.format(lines[-1]['cursor'])) == [])
+
+    def test_export_batches(self):
+        batches = list(keyset_batches(filter_positions(), Position.id, batch_size=2))
+        self.assertTrue([len(batch) for batch in batches] == [2, 2, 2, 1])
+        batches = list(keyset_batches(filter_positions(), Position.id, cursor=batches[1][-1].id, batch_size=2))
+        self.assertTrue([position.public_id for batch in batches for position in batch] == self.positions[4:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import threading
+import unittest
+
+from app.main.util.eonerror import EonError
+from app.main.util.passwordhasher import PasswordHasher
+from app.test.base import BaseTestCase
+
+
+class TestPasswordHasher(BaseTestCase):
+
+    DEBUG = False
+
+    def setUp(self):
+        super().setUp()
+        self.settings = {name: self.app.config[name] for name in ('PASSWORD_HASH_WORKERS', 'PASSWORD_HASH_QUEUE_DEPTH', 'PASSWORD_HASH_TIMEOUT')}
+        self.app.config.update(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE_DEPTH=0, PASSWORD_HASH_TIMEOUT=0.1)
+
+    def tearDown(self):
+        self.app.config.update(self.settings)
+        super().tearDown()
+
+    def test_saturated(self):
+        hasher = PasswordHasher()
+        release = threading.Event()
+
+        #the caller gives up, the hash keeps its slot until it is done
+        with self.assertRaises(EonError) as ctx:
+            hasher._run(release.wait, 5)
+        self.assertTrue(ctx.exception.code==503)
+        with self.assertRaises(EonError) as ctx:
+            hasher._run(len, 'password')
+        self.assertTrue(ctx.exception.code==503)
+
+        release.set()
+        hasher._executor.submit(len, '').result()
+        self.assertTrue(hasher._run(len, 'password')==8)
+
+    def test_generate_and_check(self):
+        hasher = PasswordHasher()
+        self.app.config['PASSWORD_HASH_TIMEOUT'] = 10
+        password_hash = hasher.generate('password')
+        self.assertTrue(hasher.check(password_hash, 'password'))
+        self.assertFalse(hasher.check(password_hash, 'wrong'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+
+from flask import Flask
+from sqlalchemy import event
+
+from app.main.services import db
+from app.main.model.company import Company
+from app.main.util.hashutils import HashUtils
+from app.main.util.profiler import Profiler, RequestProfile
+from app.test.base import BaseTestCase
+
+
+class TestProfiler(BaseTestCase):
+
+    DEBUG = False
+
+    def test_request_profile(self):
+        profiler = Profiler()
+        profiler._listen()
+        self.addCleanup(profiler._listen, event.remove)
+        calls = []
+
+        def digest(message):
+            calls.append(message)
+            return message if len(calls) > 1 else digest(message)
+        timed_digest = profiler._timed('hash', profiler._timed('hash', digest))
+
+        timed_digest('not profiled')
+        profiler._start()
+        Company.query.count()
+        db.session.commit()
+        timed_digest('profiled')
+        profile = profiler.current()
+
+        self.assertTrue(profile.queries >= 1 and profile.sql_time > 0)
+        self.assertTrue(profile.buckets['hash'] > 0 and profile.depth['hash'] == 0)
+        header = profile.server_timing(0.01)
+        self.assertTrue(header.startswith('app;dur=10.00, db;dur='))
+        self.assertTrue('queries"' in header and 'hash;dur=' in header)
+
+    def test_server_timing_header(self):
+        profiler = Profiler()
+        original_digest = HashUtils.digest
+        app = Flask(__name__)
+        app.config['PROFILING'] = True
+        profiler.init_app(app)
+        self.addCleanup(profiler.uninstall)
+
+        @app.route('/hash')
+        def hash_view():
+            return HashUtils().digest('profiled').hex()
+
+        @app.route('/broken')
+        def broken_view():
+            raise ValueError('broken')
+
+        client = app.test_client()
+        response = client.get('/hash')
+        self.assertTrue(response.status_code == 200)
+        header = response.headers['Server-Timing']
+        self.assertTrue(header.startswith('app;dur=') and 'hash;dur=' in header and 'commit;desc="0"' in header)
+        self.assertTrue(profiler.stats()['hash_view']['requests'] == 1)
+
+        #a failing view skips after_request, the profile is dropped on teardown
+        client.get('/broken')
+        self.assertTrue(profiler.current() is None)
+
+        profiler.uninstall()
+        self.assertTrue(HashUtils.digest is original_digest)
+
+
+if __name__ == '__main__':
+    unittest.main()
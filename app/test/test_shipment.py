@@ -0,0 +1,386 @@
+import datetime
+import json
+import unittest
+import uuid
+from unittest import mock
+
+from sqlalchemy import event
+
+from app.main.services import db
+from app.main.model.company import Company
+from app.main.model.shipment import Shipment
+from app.main.model.position import Position
+from app.main.service.position_service import compute_position_hash
+from app.main.service.shipment_service import receive_shipments_batch, receive_shipment_from_previous_peer, prepare_shipment_payload, get_shipment_payload, get_shipment_state, apply_shipment_delta
+from app.main.util.eonerror import EonError
+from app.main.util.hashutils import HashUtils
+from app.main.util.keymanagementutils import KeyManagementClient
+from app.main.util.payloadcache import shipment_payload_cache
+from app.main.util.gossipengine import GossipEngine
+from app.main.util.tasks import shipment_delta, send_shipment, send_shipment_batch
+from app.test.base import BaseTestCase
+
+
+def create_company(name, vat_number, is_own=False):
+    company = Company(
+        public_id=str(uuid.uuid4()),
+        name=name,
+        vat_number=vat_number,
+        created_on=datetime.datetime.utcnow(),
+        is_own=is_own,
+        base_url='http://localhost:5400'
+    )
+    db.session.add(company)
+    db.session.commit()
+    return company
+
+
+def shipment_payload(name, hash_id, sender_vat, receiver_vat):
+    return {
+        "hash_id": hash_id,
+        "name": name,
+        "shipment_date": "2020-05-01T10:00:00",
+        "origin": "Milano",
+        "destination": "Rotterdam",
+        "hs_code": "8471",
+        "description": "laptops",
+        "current_company_vat": sender_vat,
+        "waybill_number": "WB-1",
+        "custom_reference_number": "CR-1",
+        "positions": [
+            {"company_vat": sender_vat, "position": 1, "role": "1",
+             "hash_id": compute_position_hash(1, "1", sender_vat, hash_id), "signed_hash": ""},
+            {"company_vat": receiver_vat, "position": 2, "role": "2",
+             "hash_id": compute_position_hash(2, "2", receiver_vat, hash_id), "signed_hash": ""}
+        ]
+    }
+
+
+class TestShipmentImport(BaseTestCase):
+
+    DEBUG = False
+
+    def test_import_batch(self):
+        create_company("sender", "IT0001")
+        create_company("receiver", "IT0002", is_own=True)
+        data = {"shipments": [
+            shipment_payload("first", "aa"*32, "IT0001", "IT0002"),
+            shipment_payload("second", "bb"*32, "IT0001", "IT0002")
+        ]}
+
+        res = receive_shipments_batch(data)
+        self.assertTrue(res[1]==201)
+        self.assertTrue(len(res[0]["public_ids"])==2)
+        self.assertTrue(Shipment.query.count()==2)
+        self.assertTrue(Position.query.count()==4)
+        self.assertTrue(all(shipment.merkle_root for shipment in Shipment.query.all()))
+
+    def test_import_batch_is_atomic(self):
+        create_company("sender", "IT0001")
+        create_company("receiver", "IT0002", is_own=True)
+        corrupt = shipment_payload("second", "bb"*32, "IT0001", "IT0002")
+        corrupt["positions"][1]["hash_id"] = "cc"*32
+        data = {"shipments": [
+            shipment_payload("first", "aa"*32, "IT0001", "IT0002"),
+            corrupt
+        ]}
+
+        with self.assertRaises(EonError) as ctx:
+            receive_shipments_batch(data)
+        self.assertTrue(ctx.exception.code==400)
+        self.assertTrue(Shipment.query.count()==0)
+        self.assertTrue(Position.query.count()==0)
+
+    def test_import_batch_unknown_company(self):
+        create_company("sender", "IT0001")
+        data = {"shipments": [shipment_payload("first", "aa"*32, "IT0001", "IT0009")]}
+
+        with self.assertRaises(EonError) as ctx:
+            receive_shipments_batch(data)
+        self.assertTrue(ctx.exception.code==400)
+
+    def test_import_batch_checks_signatures(self):
+        create_company("sender", "IT0001").public_key = KeyManagementClient().get_serialized_pub_key().decode('utf-8')
+        create_company("receiver", "IT0002", is_own=True)
+        db.session.commit()
+        kmc = KeyManagementClient()
+        first = shipment_payload("first", "aa"*32, "IT0001", "IT0002")
+        second = shipment_payload("second", "bb"*32, "IT0001", "IT0002")
+        for payload in (first, second):
+            position = payload["positions"][0]
+            position["signed_hash"] = kmc.sign_message(HashUtils().digest(position["hash_id"]))['signed'].hex()
+        #the signature of a position pasted on another one
+        second["positions"][0]["signed_hash"] = first["positions"][0]["signed_hash"]
+
+        with self.assertRaises(EonError) as ctx:
+            receive_shipments_batch({"shipments": [first, second]})
+        self.assertTrue(ctx.exception.code==400)
+        self.assertTrue(Shipment.query.count()==0)
+
+        res = receive_shipments_batch({"shipments": [first]})
+        self.assertTrue(res[1]==201)
+        self.assertTrue(Position.query.filter(Position.signed_hash.isnot(None)).count()==1)
+
+    def test_delta_update(self):
+        create_company("sender", "IT0001")
+        create_company("receiver", "IT0002", is_own=True)
+        create_company("carrier", "IT0003")
+        payload = shipment_payload("first", "aa"*32, "IT0001", "IT0002")
+        receive_shipments_batch({"shipments": [dict(payload)]})
+
+        #next leg: a third position was added by the holder
+        payload["positions"].append({"company_vat": "IT0003", "position": 3, "role": "3",
+            "hash_id": compute_position_hash(3, "3", "IT0003", "aa"*32), "signed_hash": ""})
+        delta = shipment_delta(payload, get_shipment_state("aa"*32)[0])
+        self.assertTrue(len(delta["positions"])==1)
+
+        res = apply_shipment_delta(delta)
+        self.assertTrue(res[1]==200)
+        self.assertTrue(res[0]["added"]==1 and res[0]["signed"]==0)
+        self.assertTrue(Position.query.count()==3)
+        self.assertTrue(shipment_delta(payload, get_shipment_state("aa"*32)[0]) is None)
+
+    def test_delta_update_own_signature(self):
+        create_company("sender", "IT0001")
+        create_company("receiver", "IT0002", is_own=True)
+        payload = shipment_payload("first", "aa"*32, "IT0001", "IT0002")
+        receive_shipments_batch({"shipments": [dict(payload)]})
+
+        #a peer cannot sign the positions of this node
+        payload["positions"][1]["signed_hash"] = "ff"*48
+        delta = shipment_delta(payload, get_shipment_state("aa"*32)[0])
+        with self.assertRaises(EonError) as ctx:
+            apply_shipment_delta(delta)
+        self.assertTrue(ctx.exception.code==400)
+        self.assertTrue(Position.query.filter(Position.signed_hash.isnot(None)).count()==0)
+
+    def test_delta_update_holder_change(self):
+        sender = create_company("sender", "IT0001")
+        create_company("receiver", "IT0002", is_own=True)
+        carrier = create_company("carrier", "IT0003")
+        kmc = KeyManagementClient()
+        carrier.public_key = kmc.get_serialized_pub_key().decode('utf-8')
+        db.session.commit()
+        payload = shipment_payload("first", "aa"*32, "IT0001", "IT0002")
+        receive_shipments_batch({"shipments": [dict(payload)]})
+        carrier_hash = compute_position_hash(3, "3", "IT0003", "aa"*32)
+        payload["positions"].append({"company_vat": "IT0003", "position": 3, "role": "3",
+            "hash_id": carrier_hash, "signed_hash": ""})
+        payload["current_company_vat"] = "IT0003"
+
+        #the carrier did not sign its position, the holder does not change
+        with self.assertRaises(EonError) as ctx:
+            apply_shipment_delta(shipment_delta(payload, get_shipment_state("aa"*32)[0]))
+        self.assertTrue(ctx.exception.code==400)
+        self.assertTrue(Shipment.query.first().current_company_id==sender.public_id)
+
+        payload["positions"][2]["signed_hash"] = kmc.sign_message(HashUtils().digest(carrier_hash))['signed'].hex()
+        res = apply_shipment_delta(shipment_delta(payload, get_shipment_state("aa"*32)[0]))
+        self.assertTrue(res[1]==200)
+        self.assertTrue(Shipment.query.first().current_company_id==carrier.public_id)
+
+    def test_delta_update_unknown_shipment(self):
+        with self.assertRaises(EonError) as ctx:
+            apply_shipment_delta({"hash_id": "aa"*32, "positions": []})
+        self.assertTrue(ctx.exception.code==404)
+
+
+class PeerResponse:
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class LocalPeer:
+    """ answer the shipment rpc calls with the services of this node, as the destination would """
+
+    def __init__(self):
+        self.calls = []
+
+    def call(self, method, url, payload, headers):
+        endpoint = url.rsplit('/', 1)[1]
+        handler = {'update': apply_shipment_delta, 'import': receive_shipment_from_previous_peer, 'import-batch': receive_shipments_batch}[endpoint]
+        try:
+            result = handler(json.loads(payload))
+            status_code = result[1] if result else 200
+        except EonError as e:
+            db.session.rollback()
+            status_code = e.code
+        self.calls.append((method, endpoint, status_code))
+        return PeerResponse(status_code)
+
+    def broadcast(self, calls, deadline=None):
+        return [self.call(*call) for call in calls]
+
+
+class TestSendShipment(BaseTestCase):
+
+    DEBUG = False
+
+    def test_update_first_then_import(self):
+        create_company("sender", "IT0001")
+        receiver = create_company("receiver", "IT0002", is_own=True)
+        create_company("carrier", "IT0003")
+        payload = shipment_payload("first", "aa"*32, "IT0001", "IT0002")
+        peer = LocalPeer()
+
+        #the calls go through the engine, answered here in order
+        with mock.patch.object(GossipEngine, 'broadcast', side_effect=peer.broadcast):
+            #unknown to the peer: the update is refused, the shipment imported
+            send_shipment(json.dumps(payload), receiver.public_id)
+            self.assertTrue(peer.calls==[('put', 'update', 404), ('post', 'import', 200)])
+            self.assertTrue(Position.query.count()==2)
+
+            #known: a single PUT with the positions, the peer only adds the new one
+            peer.calls = []
+            payload["positions"].append({"company_vat": "IT0003", "position": 3, "role": "3",
+                "hash_id": compute_position_hash(3, "3", "IT0003", "aa"*32), "signed_hash": ""})
+            send_shipment(payload, receiver.public_id)
+        self.assertTrue(peer.calls==[('put', 'update', 200)])
+        self.assertTrue(Position.query.count()==3)
+
+    def test_rejected_batch_sent_one_by_one(self):
+        create_company("sender", "IT0001")
+        receiver = create_company("receiver", "IT0002", is_own=True)
+        known = shipment_payload("first", "aa"*32, "IT0001", "IT0002")
+        receive_shipments_batch({"shipments": [dict(known)]})
+        new = shipment_payload("second", "bb"*32, "IT0001", "IT0002")
+        peer = LocalPeer()
+
+        with mock.patch.object(GossipEngine, 'broadcast', side_effect=peer.broadcast):
+            send_shipment_batch([json.dumps(known), new], receiver.public_id)
+        #the peer knows the first one: the batch is refused, both are PUT, only the second is imported
+        self.assertTrue(peer.calls==[('post', 'import-batch', 409), ('put', 'update', 200), ('put', 'update', 404), ('post', 'import', 200)])
+        self.assertTrue(Shipment.query.count()==2)
+
+
+class QueryCounter:
+    """ count the statements sent to the db while in the with block """
+
+    def __init__(self):
+        self.count = 0
+
+    def _count(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(db.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(db.engine, 'before_cursor_execute', self._count)
+
+
+class TestShipmentPayload(BaseTestCase):
+
+    DEBUG = False
+
+    def create_shipment(self, legs):
+        own = create_company("own", "IT0001", is_own=True)
+        shipment = Shipment(
+            public_id=str(uuid.uuid4()),
+            hash_id=uuid.uuid4().hex*2,
+            name="shipment with {} legs".format(legs),
+            created_on=datetime.datetime.utcnow(),
+            shipment_date=datetime.datetime.utcnow(),
+            origin="Milano",
+            destination="Rotterdam",
+            current_company_id=own.public_id
+        )
+        db.session.add(shipment)
+        for index in range(legs):
+            company = own if index == 0 else create_company("carrier {}".format(index), "IT1{:03d}".format(index))
+            db.session.add(Position(
+                public_id=str(uuid.uuid4()),
+                hash_id=compute_position_hash(index+1, "1", company.vat_number, shipment.hash_id),
+                created_on=datetime.datetime.utcnow(),
+                company_id=company.public_id,
+                shipment_id=shipment.public_id,
+                position=index+1,
+                role=1
+            ))
+        db.session.commit()
+        return shipment.public_id
+
+    def count_payload_queries(self, legs):
+        shipment_id = self.create_shipment(legs)
+        db.session.expire_all()
+        with QueryCounter() as counter:
+            payload, target_company = prepare_shipment_payload(shipment_id)
+        self.assertTrue(len(payload["positions"])==legs)
+        self.assertTrue(payload["positions"][0]["signed_hash"])
+        return counter.count
+
+    def test_payload_queries_do_not_grow_with_legs(self):
+        few_legs = self.count_payload_queries(2)
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        many_legs = self.count_payload_queries(20)
+        self.assertEqual(few_legs, many_legs)
+        self.assertTrue(many_legs <= 4)
+
+    def version(self, shipment_id):
+        return db.session.query(Shipment.version).filter_by(public_id=shipment_id).scalar()
+
+    def test_version_default(self):
+        #rows written without the model, e.g. by a migration, get the server default
+        db.session.execute("INSERT INTO shipment (public_id, hash_id, name, created_on, origin, destination) "
+            "VALUES ('raw', '{}', 'raw', '2020-05-01 10:00:00', 'Milano', 'Rotterdam')".format("aa"*32))
+        db.session.commit()
+        self.assertTrue(self.version("raw")==1)
+
+    def test_version_bumped_by_positions(self):
+        shipment_id = self.create_shipment(2)
+        self.assertTrue(self.version(shipment_id)==1)
+
+        #signing the own position
+        prepare_shipment_payload(shipment_id)
+        self.assertTrue(self.version(shipment_id)==2)
+
+        carrier = create_company("carrier", "IT2001")
+        shipment = Shipment.query.filter_by(public_id=shipment_id).first()
+        db.session.add(Position(
+            public_id=str(uuid.uuid4()),
+            hash_id=compute_position_hash(3, "1", carrier.vat_number, shipment.hash_id),
+            created_on=datetime.datetime.utcnow(),
+            company_id=carrier.public_id,
+            shipment_id=shipment_id,
+            position=3,
+            role=1
+        ))
+        db.session.commit()
+        self.assertTrue(self.version(shipment_id)==3)
+
+        #a peer signature on an existing position
+        Position.query.filter_by(company_id=carrier.public_id).first().signed_hash = "ff"*48
+        db.session.commit()
+        self.assertTrue(self.version(shipment_id)==4)
+
+    def test_payload_cache(self):
+        shipment_id = self.create_shipment(2)
+        stats = shipment_payload_cache.stats()
+
+        first = get_shipment_payload(shipment_id)
+        self.assertTrue(shipment_payload_cache.stats()["misses"]==stats["misses"]+1)
+        #the own position was signed while building it, the entry is for the new version
+        self.assertTrue(shipment_payload_cache.get(shipment_id, self.version(shipment_id)) is not None)
+
+        stats = shipment_payload_cache.stats()
+        again = get_shipment_payload(shipment_id)
+        self.assertTrue(shipment_payload_cache.stats()["hits"]==stats["hits"]+1)
+        self.assertTrue(again["etag"]==first["etag"])
+
+        #a new signature invalidates the cached payload
+        carrier = Position.query.filter_by(shipment_id=shipment_id, position=2).first()
+        carrier.signed_hash = "ff"*48
+        db.session.commit()
+        stats = shipment_payload_cache.stats()
+        changed = get_shipment_payload(shipment_id)
+        self.assertTrue(shipment_payload_cache.stats()["misses"]==stats["misses"]+1)
+        self.assertTrue(changed["etag"]!=first["etag"])
+        self.assertTrue("ff"*48 in changed["body"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import datetime
+import json
+import unittest
+import uuid
+
+from app.main.services import db
+from app.main.model.company import Company
+from app.main.model.location import Location
+from app.main.model.outbox import OutboxMessage
+from app.main.model.position import Position
+from app.main.model.shipment import Shipment
+from app.main.model.validation import Validation
+from app.main.service.position_service import compute_position_hash
+from app.main.util.tasks import send_validations
+from app.test.base import BaseTestCase
+
+
+def create_company(name, vat_number, is_own=False):
+    company = Company(
+        public_id=str(uuid.uuid4()),
+        name=name,
+        vat_number=vat_number,
+        created_on=datetime.datetime.utcnow(),
+        is_own=is_own,
+        base_url='http://localhost:5400'
+    )
+    db.session.add(company)
+    db.session.commit()
+    return company
+
+
+def put_json(self, url, data):
+    return self.client.put(url, data=json.dumps(data), content_type='application/json')
+
+
+class TestSignBatch(BaseTestCase):
+
+    DEBUG = False
+
+    def create_positions(self, company, count):
+        shipment = Shipment(
+            public_id=str(uuid.uuid4()),
+            hash_id=uuid.uuid4().hex*2,
+            name="shipment of {}".format(company.name),
+            created_on=datetime.datetime.utcnow(),
+            shipment_date=datetime.datetime.utcnow(),
+            origin="Milano",
+            destination="Rotterdam",
+            current_company_id=company.public_id
+        )
+        db.session.add(shipment)
+        positions = [Position(
+            public_id=str(uuid.uuid4()),
+            hash_id=compute_position_hash(index+1, "1", company.vat_number, shipment.hash_id),
+            created_on=datetime.datetime.utcnow(),
+            company_id=company.public_id,
+            shipment_id=shipment.public_id,
+            position=index+1,
+            role=1
+        ) for index in range(count)]
+        db.session.add_all(positions)
+        db.session.commit()
+        return [position.public_id for position in positions]
+
+    def create_validations(self, company, count):
+        validations = []
+        for index in range(count):
+            location = Location(public_id=str(uuid.uuid4()), name="warehouse {}".format(index),
+                created_on=datetime.datetime.utcnow(), location_data="{}", location_key=uuid.uuid4().hex, company_id=company.public_id)
+            validations.append(Validation(public_id=str(uuid.uuid4()), created_on=datetime.datetime.utcnow(), location_id=location.public_id))
+            db.session.add(location)
+        db.session.add_all(validations)
+        db.session.commit()
+        return [validation.public_id for validation in validations]
+
+    def test_sign_positions(self):
+        own = create_company("own", "IT0001", is_own=True)
+        public_ids = self.create_positions(own, 3)
+
+        response = put_json(self, '/position/rpc/sign-batch', {'public_ids': public_ids})
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(sorted(json.loads(response.data.decode())['public_ids']) == sorted(public_ids))
+        self.assertTrue(Position.query.filter(Position.signed_hash.isnot(None)).count() == 3)
+
+    def test_sign_positions_unknown_or_not_own(self):
+        own = create_company("own", "IT0001", is_own=True)
+        other = create_company("other", "IT0002")
+        public_ids = self.create_positions(own, 2)
+
+        response = put_json(self, '/position/rpc/sign-batch', {'public_ids': public_ids + [str(uuid.uuid4())]})
+        self.assertEqual(response.status_code, 404)
+        response = put_json(self, '/position/rpc/sign-batch', {'public_ids': public_ids + self.create_positions(other, 1)})
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(Position.query.filter(Position.signed_hash.isnot(None)).count() == 0)
+
+    def test_sign_validations(self):
+        create_company("own", "IT0001", is_own=True)
+        requesting = create_company("requesting", "IT0002")
+        public_ids = self.create_validations(requesting, 3)
+
+        response = put_json(self, '/validation/rpc/sign-batch', {'public_ids': public_ids})
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Validation.query.filter(Validation.signed_location_key.isnot(None)).count() == 3)
+        #the requesting companies are notified by a single job
+        message = OutboxMessage.query.one()
+        self.assertTrue(message.task == send_validations.name and sorted(message.task_args[0]) == sorted(public_ids))
+
+    def test_sign_validations_unknown(self):
+        create_company("own", "IT0001", is_own=True)
+        requesting = create_company("requesting", "IT0002")
+        public_ids = self.create_validations(requesting, 2)
+
+        response = put_json(self, '/validation/rpc/sign-batch', {'public_ids': public_ids + [str(uuid.uuid4())]})
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(Validation.query.filter(Validation.signed_location_key.isnot(None)).count() == 0)
+        self.assertTrue(OutboxMessage.query.count() == 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+
+from sqlalchemy import event
+
+from app.main.services import db
+from app.main.model.company import Company
+from app.main.util.sqldiagnostics import SqlDiagnostics, statement_shape
+from app.test.base import BaseTestCase
+
+
+class TestSqlDiagnostics(BaseTestCase):
+
+    DEBUG = False
+
+    def test_statement_shape(self):
+        self.assertTrue(statement_shape('SELECT a FROM b WHERE c IN (?, ?,\n ?)') == 'SELECT a FROM b WHERE c IN (?)')
+        self.assertTrue(statement_shape('SELECT a FROM b WHERE c IN (%(c_1)s, %(c_2)s)') == 'SELECT a FROM b WHERE c IN (?)')
+
+    def test_repeated_statement_reported_once(self):
+        diagnostics = SqlDiagnostics()
+        diagnostics.repeat_threshold = 3
+        diagnostics.listen(db.engine)
+        self.addCleanup(diagnostics.listen, db.engine, event.remove)
+        diagnostics.start_scope('test')
+
+        with self.assertLogs('eonpeers.sql', level='WARNING') as logs:
+            for i in range(6):
+                Company.query.filter_by(vat_number=str(i)).first()
+        self.assertTrue(len(logs.output)==1)
+        self.assertTrue('possible N+1 in test: statement run 4 times' in logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import json
+import unittest
+from unittest import mock
+
+from app.main.model.shipment import Shipment
+from app.main.model.position import Position
+from app.main.service.position_service import compute_position_hash
+from app.main.service.shipment_service import receive_shipments_batch, payload_leaves
+from app.main.service import sync_service
+from app.main.service.sync_service import get_sync_summary, get_sync_bucket, get_sync_payloads, reconcile_with_peer, summarize, _entry_digest
+from app.main.util.eonerror import EonError
+from app.main.util.merkle import merkle_root
+from app.test.base import BaseTestCase
+from app.test.test_shipment import create_company, shipment_payload, QueryCounter
+
+
+class FakeResponse:
+
+    def __init__(self, body):
+        self.status_code = 200
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+class FakePeer:
+    """ a peer answering the sync endpoints from the payloads it holds """
+
+    def __init__(self, payloads):
+        self.payloads = {payload["hash_id"]: dict(payload, merkle_root=merkle_root(payload_leaves(payload["positions"]))) for payload in payloads}
+        self.requested = []
+
+    def entries(self):
+        return {hash_id: _entry_digest(hash_id, payload["merkle_root"], len([position for position in payload["positions"] if position["signed_hash"]]))
+            for hash_id, payload in self.payloads.items()}
+
+    def call(self, method, url, payload, headers):
+        path = url.split('?')[0]
+        if path.endswith('sync/summary'):
+            return FakeResponse({'buckets': summarize(self.entries()), 'count': len(self.payloads)})
+        if '/sync/bucket/' in path:
+            prefix = path.rsplit('/', 1)[1]
+            return FakeResponse({'entries': {hash_id: entry for hash_id, entry in self.entries().items() if hash_id.startswith(prefix)}})
+        hash_ids = json.loads(payload)['hash_ids']
+        self.requested.extend(hash_ids)
+        return FakeResponse({'shipments': [self.payloads[hash_id] for hash_id in hash_ids]})
+
+
+class TestSync(BaseTestCase):
+
+    DEBUG = False
+
+    def setUp(self):
+        super().setUp()
+        self.partner = create_company("sender", "IT0001")
+        create_company("receiver", "IT0002", is_own=True)
+        create_company("other", "IT0003")
+
+    def test_summary_and_bucket(self):
+        receive_shipments_batch({"shipments": [
+            shipment_payload("first", "aa"*32, "IT0001", "IT0002"),
+            shipment_payload("second", "ab"*32, "IT0001", "IT0002"),
+            shipment_payload("third", "bb"*32, "IT0001", "IT0002"),
+            #not shared with the partner
+            shipment_payload("fourth", "cc"*32, "IT0003", "IT0002")
+        ]})
+
+        summary = get_sync_summary("IT0001")
+        self.assertTrue(summary["count"]==3)
+        self.assertTrue(set(summary["buckets"])=={"aa", "ab", "bb"})
+
+        entries = get_sync_bucket("IT0001", "AA")["entries"]
+        self.assertTrue(list(entries)==["aa"*32])
+        shipment = Shipment.query.filter_by(hash_id="aa"*32).first()
+        self.assertTrue(entries["aa"*32]==_entry_digest("aa"*32, shipment.merkle_root, 0))
+        self.assertTrue(get_sync_bucket("IT0003", "cc")["entries"])
+        self.assertTrue(get_sync_bucket("IT0001", "cc")["entries"]=={})
+
+        for prefix in ("%%", "a%", "a_", "zz", "aaa"):
+            with self.assertRaises(EonError) as ctx:
+                get_sync_bucket("IT0001", prefix)
+            self.assertTrue(ctx.exception.code==400)
+
+    def test_payloads_of_shared_shipments_only(self):
+        receive_shipments_batch({"shipments": [
+            shipment_payload("first", "aa"*32, "IT0001", "IT0002"),
+            shipment_payload("second", "bb"*32, "IT0001", "IT0002"),
+            shipment_payload("third", "cc"*32, "IT0003", "IT0002")
+        ]})
+        roots = {shipment.hash_id: shipment.merkle_root for shipment in Shipment.query.all()}
+
+        with QueryCounter() as counter:
+            payloads = get_sync_payloads("IT0001", ["aa"*32, "bb"*32, "cc"*32, "dd"*32])["shipments"]
+        self.assertTrue([payload["hash_id"] for payload in payloads]==["aa"*32, "bb"*32])
+        self.assertTrue(all(payload["merkle_root"]==roots[payload["hash_id"]] for payload in payloads))
+        self.assertTrue(counter.count <= 5)
+        #read only, the own positions are not signed for the peer
+        self.assertTrue(Position.query.filter(Position.signed_hash.isnot(None)).count()==0)
+
+        with self.assertRaises(EonError) as ctx:
+            get_sync_payloads("IT0001", ["aa"*32]*(sync_service.MAX_PAYLOADS_PER_REQUEST+1))
+        self.assertTrue(ctx.exception.code==400)
+
+    def test_reconcile_imports_and_updates(self):
+        known = shipment_payload("first", "aa"*32, "IT0001", "IT0002")
+        same = shipment_payload("second", "bb"*32, "IT0001", "IT0002")
+        receive_shipments_batch({"shipments": [dict(known), dict(same)]})
+
+        #the peer added a leg to the known shipment and holds one missing here
+        updated = dict(known, positions=known["positions"] + [{"company_vat": "IT0003", "position": 3, "role": "3",
+            "hash_id": compute_position_hash(3, "3", "IT0003", "aa"*32), "signed_hash": ""}])
+        missing = shipment_payload("third", "cc"*32, "IT0001", "IT0002")
+        peer = FakePeer([updated, same, missing])
+
+        with mock.patch.object(sync_service, 'make_gossip_call', side_effect=peer.call):
+            result = reconcile_with_peer(self.partner.public_id)
+        self.assertTrue(result=={'imported': 1, 'updated': 1, 'failed': 0})
+        self.assertTrue(sorted(peer.requested)==["aa"*32, "cc"*32])
+        self.assertTrue(Shipment.query.count()==3)
+        self.assertTrue(Position.query.count()==7)
+
+        #both sides agree, nothing left to transfer
+        peer.requested = []
+        with mock.patch.object(sync_service, 'make_gossip_call', side_effect=peer.call):
+            result = reconcile_with_peer(self.partner.public_id)
+        self.assertTrue(result=={'imported': 0, 'updated': 0, 'failed': 0})
+        self.assertTrue(peer.requested==[])
+
+
+if __name__ == '__main__':
+    unittest.main()
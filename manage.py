@@ -1,6 +1,11 @@
 #!/usr/bin/env python
+import datetime
+import json
 import os
+import time
 import unittest
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 import app
 
 from flask_migrate import Migrate, MigrateCommand
@@ -9,6 +14,8 @@ from flask_script import Manager
 from app.main.app import create_app
 from app.main.model import blacklist  # noqa
 from app.main.model import user  # noqa
+from app.main.model.user import User
+from app.main.util.hashutils import HashUtils
 from app.main.services import db
 from app.main.celery import celery, setup_worker
 
@@ -34,11 +41,115 @@ def test():
     return 1
 
 
-@manager.command
-def celery():
+@manager.option('-q', '--queues', dest='queues', default=None, help='comma separated queues to consume, all by default')
+@manager.option('-c', '--concurrency', dest='concurrency', default=None, type=int, help='worker processes, by default from CELERY_QUEUE_CONCURRENCY')
+def celery(queues, concurrency):
     """Runs celery worker."""
     from app.main.util import tasks  # noqa
-    return setup_worker(celery, app)
+    return setup_worker(celery, app, queues=queues.split(',') if queues else None, concurrency=concurrency)
+
+
+@manager.option('-n', '--number', dest='number', default=200, type=int, help='logins to perform')
+@manager.option('-c', '--concurrency', dest='concurrency', default=8, type=int, help='concurrent clients')
+def bench_login(number, concurrency):
+    """Measures logins per second through the login endpoint."""
+    email = 'bench-{}@eonpeers.local'.format(uuid.uuid4().hex[:8])
+    bench_user = User(
+        public_id=str(uuid.uuid4()),
+        email=email,
+        username=email,
+        password='bench-password',
+        registered_on=datetime.datetime.utcnow()
+    )
+    db.session.add(bench_user)
+    db.session.commit()
+    body = json.dumps({'email': email, 'password': 'bench-password'})
+
+    def login(_i):
+        return app.test_client().post('/auth/login', data=body, content_type='application/json').status_code
+
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            statuses = list(executor.map(login, range(number)))
+        elapsed = time.perf_counter() - start
+    finally:
+        db.session.delete(bench_user)
+        db.session.commit()
+    print('bcrypt rounds: {}'.format(app.config.get('BCRYPT_LOG_ROUNDS')))
+    print('logins: {}, ok: {}, rejected (503): {}'.format(number, statuses.count(200), statuses.count(503)))
+    print('logins per second: {:.1f}'.format(statuses.count(200) / elapsed))
+
+
+@manager.option('-n', '--number', dest='number', default=100000, type=int, help='messages to hash')
+def bench_hash(number):
+    """Compares per-object hashing with the batch HashUtils API."""
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes, hmac
+
+    def old_digest(message):
+        digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
+        digest.update(message.encode())
+        return digest.finalize()
+
+    def old_hmac(message, key):
+        h = hmac.HMAC(old_digest(key), hashes.SHA256(), backend=default_backend())
+        h.update(message.encode())
+        return h.finalize()
+
+    hu = HashUtils()
+    location_key = uuid.uuid4().hex * 2
+    messages = ['{}1{}{}'.format(i, 'IT0001', location_key) for i in range(number)]
+
+    def timed(label, fn):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        print('{:<24} {:>8.3f}s {:>12.0f} msg/s'.format(label, elapsed, number / elapsed))
+        return result
+
+    old = timed('digest (per object)', lambda: [old_digest(m) for m in messages])
+    new = timed('digest_many', lambda: hu.digest_many(messages))
+    assert old == new
+    old = timed('hmac (per object)', lambda: [old_hmac(m, location_key) for m in messages])
+    new = timed('hmac_many', lambda: hu.hmac_many(messages, location_key))
+    assert old == new
+
+
+@manager.command
+def backfill_key_fingerprints():
+    """Fills the public key fingerprint of the companies stored before the column existed."""
+    from app.main.model.company import Company
+    from app.main.util.keymanagementclientfactory import public_key_fingerprint
+    companies = Company.query.filter(Company.public_key != None, Company.public_key_fingerprint == None).all()
+    for company in companies:
+        company.public_key_fingerprint = public_key_fingerprint(company.public_key)
+    db.session.commit()
+    print('fingerprints filled: {}'.format(len(companies)))
+
+
+@manager.command
+def backfill_token_hashes():
+    """Fills the digest of the tokens blacklisted before the column existed, the shared index is loaded afterwards."""
+    from app.main.model.blacklist import BlacklistToken
+    print('token digests filled: {}'.format(BlacklistToken.backfill_token_hashes()))
+
+
+@manager.command
+def outbox_parked():
+    """Lists the outbox messages parked after too many failed publications."""
+    from app.main.service.outbox_service import parked_messages
+    messages = parked_messages()
+    for message in messages:
+        print('{} {} {} attempts: {} args: {}'.format(message.id, message.created_on.isoformat(), message.task, message.attempts, message.args))
+    print('parked messages: {}'.format(len(messages)))
+
+
+@manager.option('-i', '--ids', dest='ids', default=None, help='comma separated ids of the messages, all the parked ones by default')
+def requeue_outbox(ids):
+    """Gives the parked outbox messages to the dispatcher again."""
+    from app.main.service.outbox_service import requeue_parked
+    print('messages requeued: {}'.format(requeue_parked([int(i) for i in ids.split(',')] if ids else None)))
 
 
 @manager.option('-n', '--name', help='test class filename')